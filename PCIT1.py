@@ -8,6 +8,9 @@ import shutil   as _shutil
 import numpy    as _n
 import scipy.special as _scipy_special
 import sys as _sys
+import numbers as _numbers
+import threading as _threading
+import ctypes    as _ctypes
 
 import traceback as _traceback
 _p = _traceback.print_last
@@ -19,7 +22,15 @@ from spinmob.egg._gui import Button, ComboBox, NumberBox, Label, TextBox
 _g = _egg.gui
 
 from serial.tools.list_ports import comports as _comports
-from PCIT1_api    import PCIT1_api
+from PCIT1_api     import PCIT1_api
+from PCIT1_connection import connection_manager, get_port_watcher
+from PCIT1_program import program_runner, load_program, list_programs
+from PCIT1_pipeline import load_pipeline
+from PCIT1_clock    import gate_clock
+from PCIT1_catalog  import run_catalog
+from PCIT1_export   import snapshot_exporter
+from PCIT1_stats   import window_histogram, count_histogram, log_histogram, quantile_sketch, photon_statistics, allan_deviation, analysis_worker
+from PCIT1_storage import acquisition_store, archive_writer, archive_reader, is_archive, deferred_saver, save_histogram, load_histogram
 
 # GUI settings
 _s.settings['dark_theme_qt'] = True
@@ -29,9 +40,19 @@ style_1 = 'font-size: 14pt; font-weight: bold; color: '+('mediumspringgreen' if
 style_2 = 'font-size: 17pt; font-weight: bold; color: '+('white'             if _s.settings['dark_theme_qt'] else 'red')
 style_3 = 'font-size: 17pt; font-weight: bold; color: '+('cyan'              if _s.settings['dark_theme_qt'] else 'purple')
 
-# 
+# Writes DataboxPlot settings in the background, after typing stops
+settings_saver = deferred_saver(1.0)
+
+# Files below are per window: histo adds its name to each (see histo._get_path)
 PROGRAM_STEPS = 10
 PROGRAM_DIR   = 'Programs'
+PIPELINE_DIR  = 'Pipelines'
+CATALOG_PATH  = 'runs.sqlite'
+SPILL_PATH    = 'acquisition_spill.arc'
+CHECKPOINT_PATH = 'histogram_checkpoint.json'
+SNAPSHOT_DIR  = 'Snapshots'
+BROWSE_ROWS   = 100000
+REPLAY_ROWS   = 1<<20
 
 
 class serial_gui_base(_g.BaseObject):
@@ -43,7 +64,9 @@ class serial_gui_base(_g.BaseObject):
     api_class=None : class
         Class to use when connecting. For example, api_class=PCIT1_api would
         work. Note this is not an instance, but the class itself. An instance is
-        created when you connect and stored in self.api.
+        created when you connect and stored in self.api. To have several
+        windows share one connection, use the subscribe method of a
+        PCIT1_stream.PCIT1_broker instead.
         
     name='serial_gui' : str
         Unique name to give this instance, so that its settings will not
@@ -136,6 +159,9 @@ class serial_gui_base(_g.BaseObject):
 
         # Other data
         self.t0 = None
+        
+        # Start enumerating ports in the background for Refresh
+        get_port_watcher()
 
         # Run the base object stuff and autoload settings
         _g.BaseObject.__init__(self, autosettings_path=name)
@@ -165,14 +191,13 @@ class serial_gui_base(_g.BaseObject):
                 
             default_port = 0
              
-            # Get all the available ports
-            if _comports:
-                for inx, p in enumerate(_comports()):
-                    self._ports.append(p.device)
-                    ports      .append(p.description)
-                    
-                    if 'Arduino' in p.description:
-                        default_port = inx
+            # Get all the available ports (enumerated in the background)
+            for inx, p in enumerate(get_port_watcher().get_ports()):
+                self._ports.append(p[0])
+                ports      .append(p[1])
+                
+                if 'Arduino' in p[1]:
+                    default_port = inx
                         
             # Append simulation port
             ports      .append('Simulation')
@@ -259,6 +284,7 @@ class serial_gui_base(_g.BaseObject):
         Disconnects. When you close the window.
         """
         print('Window closed but not destroyed. Use show() to bring it back.')
+        settings_saver.flush()
         if self.button_connect():
             print('  Disconnecting...')
             self.button_connect(False)
@@ -302,7 +328,7 @@ class serial_gui_base(_g.BaseObject):
 
 class histo(serial_gui_base):
 
-    def __init__(self, name='PCIT1-A', api = PCIT1_api, show=True, block=False, window_size=[1,300]):
+    def __init__(self, name='PCIT1-A', api = connection_manager, show=True, block=False, window_size=[1,300]):
 
 
         # Run the base class stuff, which shows the window at the end.
@@ -310,6 +336,40 @@ class histo(serial_gui_base):
         
         self.window.set_size([0,0])
         
+        # Stepped acquisition program (created when one is run)
+        self.program = None
+        
+        # Processing pipeline applied to each batch (None for raw data)
+        self.pipeline = None
+        
+        # Per-sample timestamps from the iteration numbers
+        self.clock = gate_clock()
+        
+        # Index of saved runs
+        self.catalog = run_catalog(self._get_path(CATALOG_PATH))
+        
+        # Number of connection outages already written to the plot header
+        self._outages = 0
+
+        # Histogram of the last few seconds (for spotting drift)
+        self.window_histogram = window_histogram()
+        
+        # Compact storage of all acquired samples, shared by the plots. Old
+        # samples are spilled to disk beyond the memory budget.
+        self.store = acquisition_store(spill_path=self._get_path(SPILL_PATH))
+        
+        # Histogram of every count of the run, for exact statistics
+        self.totals = count_histogram()
+        self._checkpoint_time = _time.time()
+        self._checkpoint_path = self._get_path(CHECKPOINT_PATH)
+        
+        # Plot images and statistics written for remote monitoring. A
+        # snapshot waits for the plot scripts running when it was taken:
+        # [(plot, its scripts_done at the time)], or None when none waits
+        self.snapshots = snapshot_exporter(_os.path.join(SNAPSHOT_DIR, name), 0)
+        self._snapshot_waiting = None
+        self._snapshot_force   = False
+        
         # Build the GUI
         self.gui_components(name)
         
@@ -317,12 +377,26 @@ class histo(serial_gui_base):
         self.window.show(block)
      
 
+    
+    def _get_path(self, path):
+        """
+        Returns path with this window's name in front of the file name (like
+        the autosettings files), so several windows never share a file.
+        """
+        directory, file = _os.path.split(path)
+        return _os.path.join(directory, self.name+'.'+file)
         
     def _after_button_connect_toggled(self):
         """
         Called after the connection or disconnection routine.
         """
         if self.button_connect.is_checked():
+            self._outages = 0
+            self.clock.reset()
+            
+            # The time column is relative to this
+            self.plot   .h(PCIT1_Started=self.t0)
+            self.scatter.h(PCIT1_Started=self.t0)
     
             # Get the setpoint
             try:
@@ -339,14 +413,303 @@ class histo(serial_gui_base):
             self.timer.stop()
     
     def _update_integrated_counts(self):
-        self.number_integrated_counts.set_value( sum(self.plot['Counts (C)']) )
+        self.number_integrated_counts.set_value( self.totals.sum )
         
     def _update_mean(self):
-        self.number_mean.set_value( _n.mean(self.plot['Counts (C)']) )
+        self.number_mean.set_value( self.totals.get_mean() )
     
     def _update_std(self):
         ####
-        self.number_std.set_value( _n.std(self.plot['Counts (C)']) )
+        self.number_std.set_value( self.totals.get_std() )
+    
+    def _update_quantiles(self, *a):
+        median, percentile = self.totals.get_quantiles([0.5, 0.01*self.number_percentile.get_value()])
+        self.number_median          .set_value(median)
+        self.number_percentile_value.set_value(percentile)
+    
+    def _get_histogram_headers(self):
+        """
+        Returns the metadata saved with the run histogram.
+        """
+        return {'PCIT1_Started'      : self.t0,
+                'PCIT1_Saved'        : _time.time(),
+                'PCIT1_Gate_Period'  : self.clock.get_period(),
+                'PCIT1_Pipeline'     : repr(self.pipeline),
+                'PCIT1_Outages'      : getattr(self.api, 'outages', []),
+                'DataboxPlot_Note'   : self.plot.text_log_note()}
+    
+    def _checkpoint(self):
+        """
+        Saves the run histogram to self._checkpoint_path if it's time to.
+        """
+        interval = 60*self.number_checkpoint.get_value()
+        if not interval or _time.time()-self._checkpoint_time < interval: return
+        
+        self._checkpoint_time = _time.time()
+        save_histogram(self._checkpoint_path, self.totals, self._get_histogram_headers())
+    
+    def _snapshot(self, force=False):
+        """
+        Exports the Histogram and Scatter plots plus the current statistics
+        to self.snapshots.directory if it's time to (or force=True).
+        """
+        if not force and not self.snapshots.is_due(): return
+        
+        # One is already waiting for the plots
+        if self._snapshot_waiting is not None:
+            self._snapshot_force = self._snapshot_force or force
+            return
+        
+        # Bring hidden plots up to date first
+        for tab in [self.tab_histogram, self.tab_scatter]:
+            if tab in self._dirty:
+                self._dirty.discard(tab)
+                self._renderers[tab]()
+        
+        # Their scripts run in the background; export once the ones running
+        # now have been drawn
+        self._snapshot_force   = force
+        self._snapshot_waiting = [(p, p.scripts_done) for p in [self.plot, self.scatter] if p.is_plotting()]
+        self._after_plot()
+    
+    def _after_plot(self):
+        """
+        Called whenever either plot has drawn a script's result. Exports the
+        pending snapshot, if any, once the scripts it waits for are drawn.
+        """
+        if self._snapshot_waiting is None: return
+        for p, n in self._snapshot_waiting:
+            if p.scripts_done == n: return
+        
+        force = self._snapshot_force
+        self._snapshot_waiting = None
+        
+        stats = {'samples'           : self.totals.n,
+                 'integrated_counts' : self.totals.sum,
+                 'mean'              : self.number_mean.get_value(),
+                 'std'               : self.number_std.get_value(),
+                 'median'            : self.number_median.get_value(),
+                 'percentile'        : self.number_percentile.get_value(),
+                 'percentile_value'  : self.number_percentile_value.get_value(),
+                 'window_mean'       : self.number_window_mean.get_value(),
+                 'window_std'        : self.number_window_std.get_value(),
+                 'samples_on_disk'   : self.number_spilled.get_value(),
+                 'gate_period'       : self.clock.get_period(),
+                 'connected'         : self.api.is_connected() if hasattr(self.api, 'is_connected') else True,
+                 'outages'           : len(getattr(self.api, 'outages', [])),
+                 'started'           : self.t0}
+        
+        # Plots that haven't been drawn yet have no widgets
+        views = dict()
+        for name, plot in [('histogram', self.plot), ('scatter', self.scatter)]:
+            if len(plot.plot_widgets): views[name] = plot.plot_widgets[0]
+        
+        self.snapshots.export(views, stats, force)
+    
+    def _number_snapshot_changed(self, *a):
+        """
+        Applies the new snapshot interval (s, 0 for none).
+        """
+        self.snapshots.interval = self.number_snapshot.get_value()
+    
+    def _button_snapshot_clicked(self, *a):
+        """
+        Writes a snapshot right away.
+        """
+        self._snapshot(True)
+    
+    def _button_save_histogram_clicked(self, *a):
+        """
+        Saves the run histogram and metadata.
+        """
+        path = _s.dialogs.save('*.json', 'Save histogram to...', force_extension='*.json')
+        if not path: return
+        save_histogram(path, self.totals, self._get_histogram_headers())
+    
+    def _button_load_histogram_clicked(self, *a):
+        """
+        Loads a saved run histogram, which further data is added to.
+        """
+        path = _s.dialogs.load('*.json', 'Load histogram...')
+        if not path: return
+        
+        self.totals, headers = load_histogram(path)
+        self.button_histogram_only.set_checked(True)
+        self._update_integrated_counts()
+        self._update_mean()
+        self._update_std()
+        self._update_quantiles()
+        self._dirty.add(self.tab_histogram)
+        self._render()
+    
+    def _button_histogram_only_toggled(self, *a):
+        """
+        Switches between keeping every sample and keeping only the histogram.
+        """
+        self._checkpoint_time = _time.time()
+        self._dirty.add(self.tab_histogram)
+        self._render()
+    
+    def _render_histogram(self):
+        """
+        Draws the Histogram tab, from the run histogram in histogram-only mode.
+        """
+        if not self.button_histogram_only.is_checked(): return self.plot.plot()
+        
+        y, x = self.totals.get_histogram()
+        self.plot._set_number_of_plots(x, y)
+    
+    def _update_scatter(self):
+        """
+        Shows the newest samples in the Scatter tab, unless browsing.
+        """
+        if self.button_browse.is_checked(): return
+        self.scatter.update_from_store(self.store, ['Number', 'Counts (C)'])
+        self._dirty.add(self.tab_scatter)
+    
+    def _browse(self, *a):
+        """
+        Shows the selected time range in the Scatter tab, reading spilled
+        samples back from disk. Long ranges are thinned to BROWSE_ROWS samples.
+        """
+        if not self.button_browse.is_checked(): return
+        
+        keys    = ['Time (s)', 'Counts (C)']
+        columns = self.store.read_time(keys, self.number_browse_start.get_value(), self.number_browse_stop.get_value(), BROWSE_ROWS)
+        
+        # Saving writes what is shown, not the store
+        self.scatter.clear_columns()
+        self.scatter._store = None
+        for n in range(len(keys)): self.scatter[keys[n]] = columns[n]
+        self._dirty.add(self.tab_scatter)
+        self._render()
+    
+    def _button_browse_toggled(self, *a):
+        """
+        Switches the Scatter tab between browsing and the newest samples.
+        """
+        if self.button_browse.is_checked(): self._browse()
+        else:
+            self._update_scatter()
+            self._render()
+    
+    def _button_browse_view_clicked(self, *a):
+        """
+        Browses the time range currently shown in the Scatter tab, e.g. after
+        zooming into it.
+        """
+        if not len(self.scatter.plot_widgets) or not self.button_browse.is_checked(): return
+        
+        t0, t1 = self.scatter.plot_widgets[0].getViewBox().viewRange()[0]
+        self.number_browse_start.set_value(max(t0, 0), block_signals=True)
+        self.number_browse_stop .set_value(max(t1, 0), block_signals=True)
+        self._browse()
+    
+    def _number_budget_changed(self, *a):
+        """
+        Applies the new memory budget (MB, 0 for no limit) to the store.
+        """
+        self.store.set_budget(int(self.number_budget.get_value()*1e6) or None)
+    
+    def _update_window(self):
+        self.number_window_mean.set_value(self.window_histogram.get_mean())
+        self.number_window_std .set_value(self.window_histogram.get_std())
+        self._dirty.add(self.tab_window)
+    
+    def _update_window_plot(self):
+        h, edges = self.window_histogram.get_histogram()
+        self.curve_window.setData(edges, h)
+    
+    def _number_window_changed(self, *a):
+        """
+        Resizes the window histogram without reprocessing any data.
+        """
+        self.window_histogram.set_window(self.number_window.get_value())
+        self._update_window()
+        self._render()
+    
+    def _number_max_lag_changed(self, *a):
+        """
+        Waits for the maximum lag to stop changing (e.g. while typing or
+        scrolling) before applying it.
+        """
+        self.timer_max_lag.start()
+    
+    def _timer_max_lag_tick(self, *a):
+        """
+        Applies the new maximum lag to the photon statistics. Lowering it
+        keeps everything. Raising it recomputes the autocorrelation from the
+        stored counts, read in chunks in the worker thread, or starts it
+        over if they are not all stored (Histogram Only). The Fano factor is
+        kept either way.
+        """
+        max_lag = self.number_max_lag.get_value()
+        
+        # Only rows stored by now; later ones reach the worker as usual
+        history = None
+        n = len(self.store)
+        if n == self.totals.n:
+            history = (self.store.read_rows(['Counts (C)'], a, a+REPLAY_ROWS)[0] for a in range(0, n, REPLAY_ROWS))
+        
+        self.photon_worker.replace_analyzer(lambda analyzer: analyzer.with_max_lag(max_lag, history))
+        self._dirty.add(self.tab_statistics)
+    
+    def _update_statistics_plot(self):
+        """
+        Draws the latest results of the photon statistics worker.
+        """
+        k, g = self.photon_worker.call(self.photon_worker.analyzer.get_autocorrelation)
+        w, F = self.photon_worker.call(self.photon_worker.analyzer.get_fano)
+        
+        ok = _n.isfinite(F)
+        self.curve_autocorrelation.setData(k[1:], g[1:])
+        self.curve_fano           .setData(w[ok], F[ok])
+    
+    def _update_allan_plot(self):
+        """
+        Draws the latest Allan deviation.
+        """
+        m, adev = self.allan_worker.call(self.allan_worker.analyzer.get_allan_deviation)
+        self.curve_allan.setData(m, adev)
+    
+    def _before_plot_save(self):
+        """
+        Called at the start of self.plot.save_file(). Stores the Allan
+        deviation in the header so it travels with the run.
+        """
+        m, adev = self.allan_worker.call(self.allan_worker.analyzer.get_allan_deviation)
+        self.plot.h(**{'Allan_tau(gates)' : list(m), 'Allan_deviation(C)' : list(adev)})
+    
+    def _render(self, *a):
+        """
+        Redraws the visible tab if it has new data since it was last drawn.
+        Hidden tabs stay marked (in self._dirty) and catch up when shown.
+        """
+        tab = self._tab_list[self.tabs.get_current_tab()]
+        if tab in self._dirty:
+            self._dirty.discard(tab)
+            self._renderers[tab]()
+    
+    def _after_plot_clear(self):
+        """
+        Called after either plot's Clear button is done.
+        """
+        self.store.clear()
+        self.totals = count_histogram()
+        self.plot   .update_from_store(self.store, ['Time (s)', 'Counts (C)'])
+        self.button_browse.set_checked(False, block_signals=True)
+        self._update_scatter()
+        self._dirty.add(self.tab_histogram)
+        
+        self.window_histogram = window_histogram(self.number_window.get_value())
+        self._update_window()
+        
+        if self.pipeline is not None: self.pipeline.reset()
+        
+        self.photon_worker.set_analyzer(photon_statistics(self.number_max_lag.get_value()))
+        self.allan_worker .set_analyzer(allan_deviation())
+        self._dirty.update([self.tab_statistics, self.tab_allan])
+        self._render()
         
     
     def _timer_tick(self, *a):
@@ -357,24 +720,162 @@ class histo(serial_gui_base):
         
         
         
-        # Get the time, temperature, and setpoint
-        t = current_time - self.t0
         N, C = self.api.read_all_data()  
+        self._update_connection()
+        
+        # Corrections, cuts, etc
+        if self.pipeline is not None:
+            try:
+                N, C = self.pipeline.process(N, C)
+                self._dirty.add(self.tab_pipeline)
+            except Exception as e:
+                self.combo_pipeline.set_index(0)
+                self.label_pipeline.set_text('Pipeline stopped: '+str(e))
+        
+        # Time of each sample, from its gate index
+        t = self.clock.append_data(current_time - self.t0, N)
+        if self.clock.get_period(): self.number_gate_measured.set_value(self.clock.get_period())
+        self.number_gate_jitter.set_value(self.clock.residual)
         
-        for i in range(len(C)):
-            # Append this to the databox
-            self.plot.append_row([t, C[i]], ckeys=['Time (s)', 'Counts (C)'])
-            self.scatter.append_row([N[i], C[i]], ckeys=['Number', 'Counts (C)'])
-        self.plot.plot()
-        self.scatter.plot()
+        self.totals.append_data(C)
+        self._dirty.add(self.tab_histogram)
+        
+        # Histogram only: nothing per sample is kept
+        if self.button_histogram_only.is_checked(): self._checkpoint()
+        
+        # Store the batch once; both plots show views of the same columns
+        else:
+            self.store.append_data(t, N, C)
+            self.number_spilled.set_value(self.store.first)
+            self.plot.update_from_store(self.store, ['Time (s)', 'Counts (C)'])
+            self._update_scatter()
 
         self._update_integrated_counts()
         self._update_mean()
         self._update_std()
+        self._update_quantiles()
+        
+        self.window_histogram.append_data(t, C)
+        
+        # Photon statistics are computed in the background
+        self.photon_worker.append_data(C)
+        self.allan_worker .append_data(C)
+        self._dirty.update([self.tab_statistics, self.tab_allan])
+        self._update_window()
+        
+        # Feed the running program, if any
+        if self.program is not None and self.button_program_run.is_checked():
+            if len(self.program.append_data(N, C)): self._update_program_plot()
+            self.label_program.set_text('Step %d / %d' % (min(self.program.get_step()+1, len(self.program)), len(self.program)))
+            if self.program.is_done(): self.button_program_run.set_checked(False)
+        
+        # Draw only what can be seen
+        self._render()
+        
+        # Images for remote monitoring, now and then
+        self._snapshot()
         
         # Update the GUI
         self.window.process_events()
     
+    def _update_connection(self):
+        """
+        Shows whether the connection manager is waiting for the device to
+        come back, and records finished outages in the plot header.
+        """
+        if not hasattr(self.api, 'outages'): return
+        
+        if self.api.is_connected(): self.label_status.set_text('')
+        else:                       self.label_status.set_text('*** Reconnecting ***').set_colors('pink' if _s.settings['dark_theme_qt'] else 'red')
+        
+        # Outages relative to t0, like the time column
+        if len(self.api.outages) != self._outages:
+            self._outages = len(self.api.outages)
+            self.clock.reset()
+            self.plot.h(Outages=[[a-self.t0, b-self.t0] for a, b in self.api.outages])
+    
+    def _number_gate_changed(self, *a):
+        """
+        Restarts the sample clock with the new gate period.
+        """
+        self.clock.period = self.number_gate.get_value() or None
+        self.clock.reset()
+    
+    def _button_pipeline_refresh_clicked(self, *a):
+        """
+        Re-reads the list of pipelines in PIPELINE_DIR.
+        """
+        for n in range(len(self.combo_pipeline.get_all_items())): self.combo_pipeline.remove_item(0)
+        for item in ['(none)']+list_programs(PIPELINE_DIR): self.combo_pipeline.add_item(item)
+    
+    def _combo_pipeline_changed(self, *a):
+        """
+        Loads the selected pipeline, which applies to data from now on.
+        """
+        self.pipeline = None
+        self.label_pipeline.set_text('')
+        if self.combo_pipeline.get_index() == 0: return
+        
+        try:    self.pipeline = load_pipeline(_os.path.join(PIPELINE_DIR, self.combo_pipeline.get_text()))
+        except Exception as e: self.label_pipeline.set_text(str(e))
+        self._update_pipeline_label()
+    
+    def _update_pipeline_label(self):
+        """
+        Shows the time spent in each stage of the pipeline.
+        """
+        if self.pipeline is None: return
+        self.label_pipeline.set_text('\n'.join(['%-12s last %8.3f ms   mean %8.3f ms' % (name, 1e3*last, 1e3*mean) for name, last, mean in self.pipeline.get_timings()]))
+    
+    def program_set_setting(self, step, setting):
+        """
+        Called whenever a running program requests a new step. Overwrite this
+        to drive the hardware (e.g. move the slit or detector).
+        """
+        return
+    
+    def _button_program_refresh_clicked(self, *a):
+        """
+        Re-reads the list of programs in PROGRAM_DIR.
+        """
+        for n in range(len(self.combo_program.get_all_items())): self.combo_program.remove_item(0)
+        for item in list_programs(PROGRAM_DIR) or ['(none)']: self.combo_program.add_item(item)
+    
+    def _button_program_run_toggled(self, *a):
+        """
+        Loads and starts the selected program, or stops the current one.
+        """
+        if not self.button_program_run.is_checked():
+            self.button_program_run.set_text('Run').set_colors(background='')
+            return
+        
+        try:
+            settings, gates = load_program(_os.path.join(PROGRAM_DIR, self.combo_program.get_text()), PROGRAM_STEPS)
+        except Exception as e:
+            self.label_program.set_text(str(e))
+            self.button_program_run.set_checked(False)
+            return
+        
+        self.program = program_runner(settings, gates, settle_gates=self.number_program_settle.get_value())
+        self.program.event_step = self.program_set_setting
+        self.program.start()
+        
+        self._update_program_plot()
+        self.label_program.set_text('Step 1 / %d' % len(self.program))
+        self.button_program_run.set_text('Stop').set_colors(background='red')
+    
+    def _update_program_plot(self):
+        """
+        Copies the per-step results of the program into the program plot.
+        """
+        self.program_plot.clear_columns()
+        self.program_plot['Setting']   = self.program.settings
+        self.program_plot['Mean (C)']  = self.program.get_means()
+        self.program_plot['Std (C)']   = self.program.get_stds()
+        self.program_plot['Gates']     = self.program.n
+        self._dirty.add(self.tab_program)
+        self._render()
+    
     def gui_components(self,name):
         
         self.grid_upper_mid = self.window.place_object(_g.GridLayout(margins=False), alignment = 1)
@@ -406,6 +907,148 @@ class histo(serial_gui_base):
             value=0, tip='Standard devation of the count data.', decimals = 3),
             alignment=1, column = 3).set_width(150).disable().set_style(style_2)
         
+        self.grid_upper_mid.add(_g.Label('Median:'), alignment=1, column = 4).set_style('font-size: 17pt; font-weight: bold; color: cyan')
+        
+        self.number_median = self.grid_upper_mid.add(_g.NumberBox(
+            value=0, tip='Median of the count data (exact, from the run histogram).'),
+            alignment=1, column = 5).set_width(150).disable().set_style(style_2)
+        
+        self.number_percentile = self.grid_upper_mid.add(_g.NumberBox(
+            value=90, bounds=(0,100), suffix='%', autosettings_path=name+'.number_percentile',
+            tip='Percentile shown to the right.'),
+            alignment=1, column = 6).set_width(80)
+        
+        self.number_percentile_value = self.grid_upper_mid.add(_g.NumberBox(
+            value=0, tip='Count below which the chosen percentage of the data lies (exact, from the run histogram).'),
+            alignment=1, column = 7).set_width(150).disable().set_style(style_2)
+        
+        self.number_percentile.signal_changed.connect(self._update_quantiles)
+        
+        self.grid_upper_mid.new_autorow()
+        
+        self.grid_upper_mid.add(_g.Label('Window:'), alignment=1, column = 0).set_style('font-size: 17pt; font-weight: bold; color: cyan')
+        
+        self.number_window = self.grid_upper_mid.add(_g.NumberBox(
+            value=60, step=10, bounds=(1,3600), suffix='s', autosettings_path=name+'.number_window',
+            tip='Width of the "last T seconds" window used for the Window tab and statistics.'),
+            alignment=1, column = 1).set_width(150).set_style(style_2)
+        
+        self.grid_upper_mid.add(_g.Label('Window mean / std:'), alignment=1, column = 2).set_style('font-size: 17pt; font-weight: bold; color: cyan')
+        
+        self.number_window_mean = self.grid_upper_mid.add(_g.NumberBox(
+            value=0, tip='Mean of the counts in the window.'),
+            alignment=1, column = 3).set_width(150).disable().set_style(style_2)
+        
+        self.number_window_std = self.grid_upper_mid.add(_g.NumberBox(
+            value=0, tip='Standard deviation of the counts in the window.', decimals = 3),
+            alignment=1, column = 4).set_width(150).disable().set_style(style_2)
+        
+        self.window_histogram.set_window(self.number_window.get_value())
+        self.number_window.signal_changed.connect(self._number_window_changed)
+        
+        self.grid_upper_mid.new_autorow()
+        
+        self.grid_upper_mid.add(_g.Label('Gate period:'), alignment=1, column = 0).set_style('font-size: 17pt; font-weight: bold; color: cyan')
+        
+        self.number_gate = self.grid_upper_mid.add(_g.NumberBox(
+            value=0, bounds=(0,None), suffix='s', siPrefix=True, autosettings_path=name+'.number_gate',
+            tip='Gate period used to timestamp each sample. Set to 0 to measure it against the computer clock.'),
+            alignment=1, column = 1).set_width(150).set_style(style_2)
+        
+        self.grid_upper_mid.add(_g.Label('Measured / jitter:'), alignment=1, column = 2).set_style('font-size: 17pt; font-weight: bold; color: cyan')
+        
+        self.number_gate_measured = self.grid_upper_mid.add(_g.NumberBox(
+            value=0, suffix='s', siPrefix=True, tip='Gate period in use (configured or fitted).'),
+            alignment=1, column = 3).set_width(150).disable().set_style(style_2)
+        
+        self.number_gate_jitter = self.grid_upper_mid.add(_g.NumberBox(
+            value=0, suffix='s', siPrefix=True, tip='RMS scatter of the batch arrival times about the fitted clock.'),
+            alignment=1, column = 4).set_width(150).disable().set_style(style_2)
+        
+        self.clock.period = self.number_gate.get_value() or None
+        self.clock.reset()
+        self.number_gate.signal_changed.connect(self._number_gate_changed)
+        
+        self.grid_upper_mid.new_autorow()
+        
+        self.grid_upper_mid.add(_g.Label('Memory budget:'), alignment=1, column = 0).set_style('font-size: 17pt; font-weight: bold; color: cyan')
+        
+        self.number_budget = self.grid_upper_mid.add(_g.NumberBox(
+            value=0, step=10, bounds=(0,None), suffix=' MB', autosettings_path=name+'.number_budget',
+            tip='Memory for the raw samples. Older samples are moved to "'+self.store.spill_path+'" (plot scripts can read them back with store.read_rows() / store.read_time()). 0 means no limit.'),
+            alignment=1, column = 1).set_width(150).set_style(style_2)
+        
+        self.grid_upper_mid.add(_g.Label('Samples on disk:'), alignment=1, column = 2).set_style('font-size: 17pt; font-weight: bold; color: cyan')
+        
+        self.number_spilled = self.grid_upper_mid.add(_g.NumberBox(
+            value=0, int=True, tip='Number of samples spilled to disk.'),
+            alignment=1, column = 3).set_width(150).disable().set_style(style_2)
+        
+        self._number_budget_changed()
+        self.number_budget.signal_changed.connect(self._number_budget_changed)
+        
+        self.grid_upper_mid.new_autorow()
+        
+        self.button_browse = self.grid_upper_mid.add(_g.Button(
+            'Browse', checkable=True,
+            tip='Show the selected time range in the Scatter tab (reading samples spilled to disk back in) instead of the newest samples.'),
+            alignment=1, column = 0)
+        
+        self.number_browse_start = self.grid_upper_mid.add(_g.NumberBox(
+            value=0, bounds=(0,None), suffix='s', siPrefix=True, tip='Start of the time range to browse.'),
+            alignment=1, column = 1).set_width(150).set_style(style_2)
+        
+        self.grid_upper_mid.add(_g.Label('to'), alignment=1, column = 2).set_style('font-size: 17pt; font-weight: bold; color: cyan')
+        
+        self.number_browse_stop = self.grid_upper_mid.add(_g.NumberBox(
+            value=60, bounds=(0,None), suffix='s', siPrefix=True, tip='End of the time range to browse.'),
+            alignment=1, column = 3).set_width(150).set_style(style_2)
+        
+        self.button_browse_view = self.grid_upper_mid.add(_g.Button(
+            'Use View', tip='Browse the time range shown in the Scatter tab (zoom in, then click).'),
+            alignment=1, column = 4)
+        
+        self.button_browse      .signal_toggled.connect(self._button_browse_toggled)
+        self.number_browse_start.signal_changed.connect(self._browse)
+        self.number_browse_stop .signal_changed.connect(self._browse)
+        self.button_browse_view .signal_clicked.connect(self._button_browse_view_clicked)
+        
+        self.grid_upper_mid.new_autorow()
+        
+        self.button_histogram_only = self.grid_upper_mid.add(_g.Button(
+            'Histogram Only', checkable=True, autosettings_path=name+'.button_histogram_only',
+            tip='Keep only the run histogram (constant memory), not the individual samples.'),
+            alignment=1, column = 0)
+        
+        self.grid_upper_mid.add(_g.Label('Checkpoint every:'), alignment=1, column = 1).set_style('font-size: 17pt; font-weight: bold; color: cyan')
+        
+        self.number_checkpoint = self.grid_upper_mid.add(_g.NumberBox(
+            value=10, bounds=(0,None), suffix=' min', autosettings_path=name+'.number_checkpoint',
+            tip='In histogram-only mode, save the histogram to "'+self._checkpoint_path+'" this often. 0 disables checkpoints.'),
+            alignment=1, column = 2).set_width(150).set_style(style_2)
+        
+        self.button_save_histogram = self.grid_upper_mid.add(_g.Button('Save Histogram', tip='Save the run histogram and metadata.'), alignment=1, column = 3)
+        self.button_load_histogram = self.grid_upper_mid.add(_g.Button('Load Histogram', tip='Load a saved run histogram and continue adding to it.'), alignment=1, column = 4)
+        
+        self.button_histogram_only.signal_toggled.connect(self._button_histogram_only_toggled)
+        self.button_save_histogram.signal_clicked.connect(self._button_save_histogram_clicked)
+        self.button_load_histogram.signal_clicked.connect(self._button_load_histogram_clicked)
+        
+        self.grid_upper_mid.new_autorow()
+        
+        self.grid_upper_mid.add(_g.Label('Snapshot every:'), alignment=1, column = 0).set_style('font-size: 17pt; font-weight: bold; color: cyan')
+        
+        self.number_snapshot = self.grid_upper_mid.add(_g.NumberBox(
+            value=0, step=10, bounds=(0,None), suffix=' s', autosettings_path=name+'.number_snapshot',
+            tip='Write images of the Histogram and Scatter plots and the current statistics (stats.json) to "'+self.snapshots.directory+'" this often, for remote monitoring. 0 disables snapshots.'),
+            alignment=1, column = 1).set_width(150).set_style(style_2)
+        
+        self.button_snapshot = self.grid_upper_mid.add(_g.Button('Snapshot Now', tip='Write the snapshot files now.'), alignment=1, column = 2)
+        
+        self._number_snapshot_changed()
+        self.number_snapshot.signal_changed.connect(self._number_snapshot_changed)
+        self.button_snapshot.signal_clicked.connect(self._button_snapshot_clicked)
+        
         self.window.new_autorow()
         self.grid_bot = self.window.place_object(_g.GridLayout(margins=False), alignment=0).disable()
         
@@ -423,20 +1066,300 @@ class histo(serial_gui_base):
             autosettings_path=name+'.plot',
             delimiter=',', styles = [dict(pen=(0,1)), dict(pen=None, symbol='o')], alignment=0))
         
-        # Add data plotting to main tab
-        self.scatter = self.tab_scatter.add(_g.DataboxPlot(
+        # Add data plotting to main tab. Like self.plot, this is the local
+        # DataboxPlot, so scripts see the store's compact columns as floats
+        # and saving includes samples spilled to disk.
+        self.scatter = self.tab_scatter.add(DataboxPlot(
             file_type='*.csv',
             autosettings_path=name+'.plot',
             delimiter=','), alignment=0)
         
+        # Window tab
+        self.tab_window   = self.tabs.add_tab('Window')
+        self.plot_window  = self.tab_window.add(_pg.PlotWidget(), alignment=0)
+        self.curve_window = _pg.PlotDataItem([0,1], [0], stepMode=True, fillLevel=0, fillOutline=True, brush=(0,255,255,150))
+        self.plot_window.addItem(self.curve_window)
+        
+        self.plot   .catalog     = self.catalog
+        self.plot   .plot_script_globals = dict(store=self.store)
+        self.scatter.plot_script_globals = dict(store=self.store)
+        self.plot   .after_clear = self._after_plot_clear
+        self.scatter.after_clear = self._after_plot_clear
+        self.plot   .after_plot  = self._after_plot
+        self.scatter.after_plot  = self._after_plot
+        
+        # Photon statistics tab
+        self.tab_statistics  = self.tabs.add_tab('Statistics')
+        self.grid_statistics = self.tab_statistics.add(_g.GridLayout(margins=False), alignment=0)
+        
+        self.grid_statistics.add(_g.Label('Max lag:'))
+        self.number_max_lag = self.grid_statistics.add(_g.NumberBox(
+            100, step=10, int=True, bounds=(1,None), autosettings_path=name+'.number_max_lag',
+            tip='Largest lag (in gates) of the autocorrelation.')).set_width(100)
+        self.grid_statistics.set_column_stretch(2)
+        
+        self.tab_statistics.new_autorow()
+        self.grid_statistics_plots = self.tab_statistics.add(_g.GridLayout(margins=False), alignment=0)
+        
+        self.plot_autocorrelation = self.grid_statistics_plots.add(_pg.PlotWidget(), alignment=0)
+        self.plot_autocorrelation.setLabel('bottom', 'Lag (gates)')
+        self.plot_autocorrelation.setLabel('left',   'Autocorrelation of Counts (C)')
+        self.curve_autocorrelation = self.plot_autocorrelation.plot(pen=(0,255,255), symbol='o', symbolSize=4)
+        
+        self.plot_fano = self.grid_statistics_plots.add(_pg.PlotWidget(), alignment=0)
+        self.plot_fano.setLogMode(x=True, y=False)
+        self.plot_fano.setLabel('bottom', 'Counting window (gates)')
+        self.plot_fano.setLabel('left',   'Fano factor')
+        self.plot_fano.addLine(y=1, pen=_pg.mkPen('w', style=_pg.QtCore.Qt.DashLine))
+        self.curve_fano = self.plot_fano.plot(pen=(0,255,255), symbol='o', symbolSize=4)
+        
+        self.photon_worker = analysis_worker(photon_statistics(self.number_max_lag.get_value()))
+        self.timer_max_lag = _g.Timer(interval_ms=500, single_shot=True)
+        self.timer_max_lag.signal_tick.connect(self._timer_max_lag_tick)
+        self.number_max_lag.signal_changed.connect(self._number_max_lag_changed)
+        
+        # Allan deviation tab
+        self.tab_allan  = self.tabs.add_tab('Allan')
+        self.plot_allan = self.tab_allan.add(_pg.PlotWidget(), alignment=0)
+        self.plot_allan.setLogMode(x=True, y=True)
+        self.plot_allan.setLabel('bottom', 'Averaging time (gates)')
+        self.plot_allan.setLabel('left',   'Overlapping Allan deviation (C)')
+        self.curve_allan = self.plot_allan.plot(pen=(0,255,255), symbol='o', symbolSize=4)
+        
+        self.allan_worker = analysis_worker(allan_deviation())
+        self.plot.before_save_file = self._before_plot_save
+        
+        # Program tab
+        self.tab_program  = self.tabs.add_tab('Program')
+        self.grid_program = self.tab_program.add(_g.GridLayout(margins=False), alignment=0)
+        
+        self.grid_program.add(_g.Label('Program:'))
+        self.combo_program = self.grid_program.add(_g.ComboBox(
+            list_programs(PROGRAM_DIR) or ['(none)'],
+            tip='Step program to run, from the "'+PROGRAM_DIR+'" directory. Each line is "setting, gates".'))
+        self.button_program_refresh = self.grid_program.add(_g.Button('Refresh', tip='Update the list of programs.')).set_width(60)
+        self.button_program_run     = self.grid_program.add(_g.Button('Run', checkable=True, tip='Run the selected program on the incoming data.')).set_width(60)
+        self.grid_program.add(_g.Label('Settle:'))
+        self.number_program_settle  = self.grid_program.add(_g.NumberBox(
+            100, step=10, int=True, bounds=(0,None), suffix=' gates', autosettings_path=name+'.number_program_settle',
+            tip='Gates to discard at the start of each step, so readings taken before the new setting\n'+
+                'arrived are not counted. Use at least the number of gates per timer tick.')).set_width(100)
+        self.label_program          = self.grid_program.add(_g.Label(''))
+        self.grid_program.set_column_stretch(6)
+        
+        self.tab_program.new_autorow()
+        self.program_plot = self.tab_program.add(_g.DataboxPlot(
+            file_type='*.csv',
+            autosettings_path=name+'.program_plot',
+            autoscript=4,
+            delimiter=','), alignment=0)
+        
+        self.button_program_refresh.signal_clicked.connect(self._button_program_refresh_clicked)
+        self.button_program_run    .signal_toggled.connect(self._button_program_run_toggled)
+        
+        # Pipeline tab
+        self.tab_pipeline  = self.tabs.add_tab('Pipeline')
+        self.grid_pipeline = self.tab_pipeline.add(_g.GridLayout(margins=False), alignment=0)
+        
+        self.grid_pipeline.add(_g.Label('Pipeline:'))
+        self.combo_pipeline = self.grid_pipeline.add(_g.ComboBox(
+            ['(none)']+list_programs(PIPELINE_DIR),
+            tip='Processing applied to each batch before it is plotted, from the "'+PIPELINE_DIR+'" directory. Each line is "stage setting=value ...".'))
+        self.button_pipeline_refresh = self.grid_pipeline.add(_g.Button('Refresh', tip='Update the list of pipelines.')).set_width(60)
+        self.grid_pipeline.set_column_stretch(3)
+        
+        self.tab_pipeline.new_autorow()
+        self.label_pipeline = self.tab_pipeline.add(_g.Label(''), alignment=0)
+        self.label_pipeline.set_style('font-family: monospace')
+        
+        self.combo_pipeline         .signal_changed.connect(self._combo_pipeline_changed)
+        self.button_pipeline_refresh.signal_clicked.connect(self._button_pipeline_refresh_clicked)
+        
+        # Tabs in order, how to draw each, and which need drawing
+        self._tab_list  = [self.tab_histogram, self.tab_scatter, self.tab_window, self.tab_statistics, self.tab_allan, self.tab_program, self.tab_pipeline]
+        self._renderers = {self.tab_histogram : self._render_histogram,
+                           self.tab_scatter   : self.scatter.plot,
+                           self.tab_window    : self._update_window_plot,
+                           self.tab_statistics: self._update_statistics_plot,
+                           self.tab_allan     : self._update_allan_plot,
+                           self.tab_program   : self.program_plot.plot,
+                           self.tab_pipeline  : self._update_pipeline_label}
+        self._dirty     = set()
+        self.tabs.signal_switched.connect(self._render)
+        
         self.window.set_row_stretch(2, 100)
         
         # Timer for collecting data
         self.timer = _g.Timer(interval_ms=1000, single_shot=False)
         self.timer.signal_tick.connect(self._timer_tick)
 
+
+
+class interval_histo(serial_gui_base):
+    """
+    Live log-binned histogram of the time between events, for the PCIT1-A
+    in interval-timer mode. Records are read and binned in bulk (see
+    PCIT1_api.read_all_intervals and PCIT1_stats.log_histogram), so the much
+    higher record rates of this mode cost no per-record Python work.
+    """
+    def __init__(self, name='PCIT1-A Intervals', api = PCIT1_api, show=True, block=False, window_size=[1,300]):
+
+        # Run the base class stuff, which shows the window at the end.
+        serial_gui_base.__init__(self, api_class=api, name=name, show=False, window_size=window_size)
+        
+        self.window.set_size([0,0])
+        
+        # Streaming histogram (in timer ticks) and the first event seen
+        self.intervals       = log_histogram(1, 1e12)
+        self.quantiles       = quantile_sketch()
+        self.first_timestamp = None
+        self.last_timestamp  = None
+        
+        # Build the GUI
+        self.gui_components(name)
+        
+        # Finally show it.
+        self.window.show(block)
+    
+    def _after_button_connect_toggled(self):
+        """
+        Called after the connection or disconnection routine.
+        """
+        if self.button_connect.is_checked(): self.timer.start()
+        else:                                self.timer.stop()
+    
+    def _button_clear_clicked(self, *a):
+        """
+        Starts the histogram over.
+        """
+        self.intervals       = log_histogram(1, 1e12)
+        self.quantiles       = quantile_sketch()
+        self.first_timestamp = None
+        self.last_timestamp  = None
+        self._update()
+    
+    def _timer_tick(self, *a):
+        """
+        Called whenever the timer ticks. Bins everything that arrived.
+        """
+        timestamps, intervals = self.api.read_all_intervals()
+        if len(intervals) == 0: return
         
+        if self.first_timestamp is None: self.first_timestamp = int(timestamps[0])
+        self.last_timestamp = int(timestamps[-1])
         
+        self.intervals.append_data(intervals)
+        self.quantiles.append_data(intervals)
+        self._update()
+        
+        # Update the GUI
+        self.window.process_events()
+    
+    def _update(self):
+        """
+        Updates the numbers and the plot.
+        """
+        tick = self.number_tick.get_value()
+        
+        self.number_events.set_value(self.intervals.n)
+        self.number_mean  .set_value(self.intervals.get_mean()*tick)
+        self.number_median.set_value(self.quantiles.get_quantiles(0.5)*tick if self.quantiles.n else 0)
+        
+        if self.last_timestamp is not None and self.last_timestamp > self.first_timestamp:
+            self.number_rate.set_value(self.intervals.n / ((self.last_timestamp-self.first_timestamp)*tick))
+        
+        # Events per second of interval, vs interval (s)
+        self.curve.setData(self.intervals.edges*tick, self.intervals.get_density()/tick)
+    
+    def gui_components(self, name):
+        
+        self.grid_upper_mid = self.window.place_object(_g.GridLayout(margins=False), alignment = 1)
+        
+        self.grid_upper_mid.add(_g.Label('Events:'), alignment=1).set_style(style_2)
+        self.number_events = self.grid_upper_mid.add(_g.NumberBox(
+            value=0, int=True, tip='Number of intervals recorded.'),
+            alignment=1).set_width(150).disable().set_style(style_2)
+        
+        self.grid_upper_mid.add(_g.Label('Rate:'), alignment=1).set_style('font-size: 17pt; font-weight: bold; color: cyan')
+        self.number_rate = self.grid_upper_mid.add(_g.NumberBox(
+            value=0, suffix='Hz', siPrefix=True, tip='Average event rate.'),
+            alignment=1).set_width(150).disable().set_style(style_2)
+        
+        self.grid_upper_mid.add(_g.Label('Mean interval:'), alignment=1).set_style('font-size: 17pt; font-weight: bold; color: cyan')
+        self.number_mean = self.grid_upper_mid.add(_g.NumberBox(
+            value=0, suffix='s', siPrefix=True, tip='Mean time between events.'),
+            alignment=1).set_width(150).disable().set_style(style_2)
+        
+        self.grid_upper_mid.add(_g.Label('Median interval:'), alignment=1).set_style('font-size: 17pt; font-weight: bold; color: cyan')
+        self.number_median = self.grid_upper_mid.add(_g.NumberBox(
+            value=0, suffix='s', siPrefix=True, tip='Median time between events (within 1%, from a streaming quantile sketch).'),
+            alignment=1).set_width(150).disable().set_style(style_2)
+        
+        self.grid_upper_mid.new_autorow()
+        
+        self.grid_upper_mid.add(_g.Label('Tick:'), alignment=1)
+        self.number_tick = self.grid_upper_mid.add(_g.NumberBox(
+            value=1e-8, suffix='s', siPrefix=True, bounds=(1e-12, None), autosettings_path=name+'.number_tick',
+            tip='Duration of one interval-timer tick.'), alignment=1).set_width(150)
+        self.button_clear = self.grid_upper_mid.add(_g.Button('Clear', tip='Start the histogram over.'), alignment=1).set_width(60)
+        
+        self.window.new_autorow()
+        self.grid_bot = self.window.place_object(_g.GridLayout(margins=False), alignment=0).disable()
+        
+        self.plot_widget = self.grid_bot.add(_pg.PlotWidget(), alignment=0)
+        self.plot_widget.setLogMode(x=True, y=True)
+        self.plot_widget.setLabel('bottom', 'Interval', units='s')
+        self.plot_widget.setLabel('left',   'Events per interval width', units='1/s')
+        self.curve = _pg.PlotDataItem(self.intervals.edges*self.number_tick.get_value(), self.intervals.counts,
+                                      stepMode=True, pen=(0,255,255))
+        self.plot_widget.addItem(self.curve)
+        
+        self.window.set_row_stretch(2, 100)
+        
+        self.button_clear.signal_clicked.connect(self._button_clear_clicked)
+        self.number_tick .signal_changed.connect(self._update)
+        
+        # Timer for collecting data
+        self.timer = _g.Timer(interval_ms=250, single_shot=False)
+        self.timer.signal_tick.connect(self._timer_tick)
+
+
+class _databox_snapshot():
+    """
+    Read-only copy of a databox's header and column views, given to plot
+    scripts as d so they can run in the background while new data arrives.
+    Supports d[n], d['key'], d.c(), d.h(), d.ckeys, d.hkeys and len(d).
+    
+    Compact integer columns (e.g. uint16 counts from the acquisition store)
+    are handed to the script as float64, converted in the script's thread
+    on first access, so arithmetic like differences doesn't wrap around.
+    """
+    def __init__(self, d):
+        self.ckeys   = list(d.ckeys)
+        self.hkeys   = list(d.hkeys)
+        self.headers = dict(d.headers)
+        self.columns = dict()
+        for k in self.ckeys:
+            a = _n.asarray(d.columns[k]).view()
+            a.flags.writeable = False
+            self.columns[k] = a
+
+    def __len__(self): return len(self.ckeys)
+
+    def __getitem__(self, n):
+        if isinstance(n, _numbers.Integral): n = self.ckeys[n]
+        a = self.columns[n]
+        if a.dtype.kind in 'iu':
+            a = a.astype(float)
+            a.flags.writeable = False
+            self.columns[n] = a
+        return a
+
+    def c(self, n): return self[n]
+
+    def h(self, key): return self.headers[key]
+
+
 class DataboxPlot(_d.databox, _g.GridLayout):
     """
     This object is a spinmob databox plus a collection of common controls and
@@ -484,18 +1407,22 @@ class DataboxPlot(_d.databox, _g.GridLayout):
     options in the combo box to see example / common scripts, or select "Edit"
     to create your own.
     The script's namespace includes: all of numpy (sin, cos, sqrt, array, etc),
-    all of scipy.special (erf, erfc, etc), d=self, styles=self._styles,
-    sm=s=_s=spinmob, and everything in self.plot_script_globals.
+    all of scipy.special (erf, erfc, etc), d=a read-only snapshot of self,
+    styles=a copy of self._styles, sm=s=_s=spinmob, and everything in
+    self.plot_script_globals.
     Optional additional globals can be defined by setting
     self.plot_script_globals to a dictionary of your choice. For example,
     self.plot_script_globals = dict(d2=self.my_other_databox) will expose
     self.my_other_databox to the script as d2.
     The script is executed by either self.plot() or when you click the
-    "Try it!" button. If there is an error, the script will turn pink and the
-    error will be printed to the console, but this is a "safe" crash and will
-    not affect the flow of the program otherwise.
-    Importantly, this script will NOT affect the underlying data unless you
-    use it to actually modify the variable d, e.g., d[0] = d[0]+3.
+    "Try it!" button. It runs in a background thread, so a slow script never
+    holds up acquisition; while it runs, further plot() calls just ask for
+    another run when it is done, and the last good plot stays on screen. If
+    there is an error, or the script takes longer than the time budget next
+    to the script, the script will turn pink, but this is a "safe" crash and
+    will not affect the flow of the program otherwise.
+    The script can NOT modify the underlying data: the columns of d are
+    read-only views.
     """
 
     def __init__(self, file_type="*.dat", autosettings_path=None, autoscript=1,
@@ -517,7 +1444,7 @@ class DataboxPlot(_d.databox, _g.GridLayout):
         self.button_clear    = self.grid_controls1.place_object(Button("Clear", tip='Clear all header and columns.').set_width(40), alignment=1)
         self.button_load     = self.grid_controls1.place_object(Button("Load",  tip='Load data from file.')         .set_width(40), alignment=1)
         self.button_save     = self.grid_controls1.place_object(Button("Save",  tip='Save data to file.')           .set_width(40), alignment=1)
-        self.combo_binary    = self.grid_controls1.place_object(ComboBox(['Text', 'float16', 'float32', 'float64', 'int8', 'int16', 'int32', 'int64', 'complex64', 'complex128', 'complex256'], tip='Format of output file columns.'), alignment=1)
+        self.combo_binary    = self.grid_controls1.place_object(ComboBox(['Text', 'Archive', 'float16', 'float32', 'float64', 'int8', 'int16', 'int32', 'int64', 'complex64', 'complex128', 'complex256'], tip='Format of output file columns. "Archive" writes compressed chunks that can be partially read back (see PCIT1_storage.archive_reader).'), alignment=1)
         self.button_autosave = self.grid_controls1.place_object(Button("Auto",   checkable=True, tip='Enable autosaving. Note this will only autosave when self.autosave() is called in the host program.').set_width(40), alignment=1)
         self.number_file     = self.grid_controls1.place_object(NumberBox(int=True, bounds=(0,None), tip='Current autosave file name prefix number. This will increment every autosave().'))
 
@@ -528,6 +1455,7 @@ class DataboxPlot(_d.databox, _g.GridLayout):
 
         self.button_script     = self.grid_controls2.place_object(Button  ("Script",      checkable=True, checked=True, tip='Show the script box.').set_width(50)).set_checked(False)
         self.combo_autoscript  = self.grid_controls2.place_object(ComboBox(['Edit', 'x=d[0]', 'Pairs', 'Triples', 'x=d[0], ey', 'x=None', 'User'], tip='Script mode. Select "Edit" to modify the script.')).set_value(autoscript)
+        self.number_bin_width  = self.grid_controls2.place_object(NumberBox(1, int=True, bounds=(1,None), tip='Number of consecutive counts per histogram bin.')).set_width(50)
         self.button_multi      = self.grid_controls2.place_object(Button  ("Multi",       checkable=True, tip="If checked, plot with multiple plots. If unchecked, all data on the same plot.").set_width(40)).set_checked(True)
         self.button_link_x     = self.grid_controls2.place_object(Button  ("Link",        checkable=True, tip="Link the x-axes of all plots.").set_width(40)).set_checked(autoscript==1)
         self.button_enabled    = self.grid_controls2.place_object(Button  ("Enable",      checkable=True, tip="Enable this plot.").set_width(50)).set_checked(True)
@@ -542,6 +1470,7 @@ class DataboxPlot(_d.databox, _g.GridLayout):
         self.button_save_script = self.grid_script.place_object(Button("Save", tip='Save the shown script.').set_width(40), 2,1)
         self.button_load_script = self.grid_script.place_object(Button("Load", tip='Load a script.').set_width(40), 2,2)
         self.button_plot        = self.grid_script.place_object(Button("Plot!", tip='Attempt to plot using the shown script!').set_width(40), 2,3)
+        self.number_script_budget = self.grid_script.place_object(NumberBox(2, bounds=(0.01,None), suffix='s', siPrefix=True, tip='Time budget for the script. Results arriving later are discarded.').set_width(70), 2,0)
 
         self.script = self.grid_script.place_object(TextBox("", multiline=True,
             tip='Script defining how the data is plotted. The minimum requirement is that\n'+
@@ -561,7 +1490,7 @@ class DataboxPlot(_d.databox, _g.GridLayout):
 
                 '  mkPen & mkBrush : from pyqtgraph, used for creating styles.\n\n'+
 
-                '  d : this DataboxPlot instance\n\n' +
+                '  d : read-only snapshot of this DataboxPlot\'s columns and header\n\n' +
 
                 '  spinmob, sm, s, and _s : spinmob library'),
                 1,0, row_span=4, alignment=0)
@@ -638,6 +1567,30 @@ class DataboxPlot(_d.databox, _g.GridLayout):
         self._previous_styles = None # Used to determine if a rebuild is necessary
         self.plot_widgets     = []
         self.ROIs             = []
+        
+        # Incrementally maintained histograms of columns, keyed by ckey
+        self._histograms      = dict()
+
+        # Plot script running in the background (see plot()), and whether
+        # another plot() was requested while it ran
+        self._script_job      = None
+        self._script_again    = False
+        self._script_timer    = _g.Timer(interval_ms=50, single_shot=False)
+        self._script_timer.signal_tick.connect(self._script_timer_tick)
+
+        # Number of background scripts drawn or given up on so far
+        self.scripts_done     = 0
+
+        # Circular buffer used by append_row() when there is a history
+        self._ring            = None
+        self._ring_stale      = False
+
+        # Store and range of its rows currently shown (see update_from_store())
+        self._store           = None
+        self._store_rows      = (0,0)
+
+        # archive_writer used by "Log Data" when the format is "Archive"
+        self._log_archive     = None
 
         ##### Functionality of buttons etc...
 
@@ -655,6 +1608,7 @@ class DataboxPlot(_d.databox, _g.GridLayout):
         self.button_link_x     .signal_toggled.connect(self._button_link_x_clicked)
         self.button_enabled    .signal_toggled.connect(self._button_enabled_clicked)
         self.number_file       .signal_changed.connect(self._number_file_changed)
+        self.number_bin_width  .signal_changed.connect(self._number_bin_width_changed)
         self.script            .signal_changed.connect(self._script_changed)
         self.number_history    .signal_changed.connect(self.save_gui_settings)
         self.text_log_note     .signal_changed.connect(self.save_gui_settings)
@@ -667,6 +1621,8 @@ class DataboxPlot(_d.databox, _g.GridLayout):
                                        "self.button_link_x",
                                        "self.button_script",
                                        "self.number_file",
+                                       "self.number_bin_width",
+                                       "self.number_script_budget",
                                        "self.script",
                                        "self.number_history",
                                        "self.text_log_note", ]
@@ -700,8 +1656,8 @@ class DataboxPlot(_d.databox, _g.GridLayout):
                 # Add header information to the Databox
                 self.h(**{
                     'DataboxPlot_Note'              : self.text_log_note(),
-                    'DataboxPlot_LogFileCreated'    : _t.ctime(_t.time()),
-                    'DataboxPlot_LogFileCreated(s)' : _t.time(),})
+                    'DataboxPlot_LogFileCreated'    : _time.ctime(_time.time()),
+                    'DataboxPlot_LogFileCreated(s)' : _time.time(),})
 
                 if len(self.ckeys): self.h(**{'Log File Initial Row Count' : len(self[0])})
                 else:               self.h(**{'Log File Initial Row Count' : 0})
@@ -714,11 +1670,44 @@ class DataboxPlot(_d.databox, _g.GridLayout):
                 self.text_log_note.enable()
 
         else:
+            path = self.label_log_path.get_text()
             self.label_log_path.set_text('').hide()
             self.text_log_note.enable()
 
+            # Write out whatever the archive logger is holding
+            if self._log_archive is not None:
+                self._log_archive.close()
+                self._log_archive = None
+
+            # Index the finished log
+            if self.catalog is not None and path:
+                try:    self.catalog.add_file(path, True)
+                except Exception as e: print('Could not catalog '+path+':', e)
+
     def __repr__(self): return "<DataboxPlot instance: " + self._repr_tail()
 
+    def save_gui_settings(self, *a):
+        """
+        Snapshots the current configuration of the controls (if the
+        autosettings_path is set) and hands it to settings_saver, which
+        writes it once the controls have been quiet for a moment.
+        """
+        if not self._autosettings_path: return
+
+        # for saving header info
+        d = _d.databox(delimiter=',')
+
+        # add all the controls settings
+        for x in self._autosettings_controls: self._store_gui_setting(d, x)
+
+        # Summary of standard set_value items
+        d.h(_autosettings_standard_items=list(d.hkeys))
+
+        # Add any additional special information specified by derived objects.
+        self._additional_save_gui_settings(d)
+
+        settings_saver.submit(_os.path.join(_egg.gui.get_egg_settings_path(), self._autosettings_path), d)
+
     def _button_enabled_clicked(self, *a):  self.save_gui_settings()
     def _number_file_changed(self, *a):     self.save_gui_settings()
     def _script_changed(self, *a):          self.save_gui_settings()
@@ -768,6 +1757,19 @@ class DataboxPlot(_d.databox, _g.GridLayout):
         self.plot()
         self.save_gui_settings()
 
+    def _number_bin_width_changed(self, *a):
+        """
+        Called whenever the bin width changes. Rebins the maintained histograms
+        in place when possible; the rest are rebuilt on the next plot().
+        """
+        width = self.number_bin_width.get_value()
+        for ckey in list(self._histograms):
+            try:               self._histograms[ckey].set_width(width)
+            except ValueError: self._histograms.pop(ckey)
+        
+        self.plot()
+        self.save_gui_settings()
+
     def _button_link_x_clicked(self, *a):
         """
         Called whenever the Link X button is clicked.
@@ -831,7 +1833,10 @@ class DataboxPlot(_d.databox, _g.GridLayout):
         """
         Called whenever the button is clicked.
         """
+        self._ring_stale = False
+        self._ring       = None
         self.clear()
+        self._histograms.clear()
         self.plot()
 
         self.after_clear()
@@ -850,6 +1855,20 @@ class DataboxPlot(_d.databox, _g.GridLayout):
         """
         return
 
+    def after_plot(self):
+        """
+        Dummy function you can overwrite to run code each time the result of
+        a background plot script has been drawn (or the script given up on).
+        """
+        return
+
+    def is_plotting(self):
+        """
+        Returns True while a plot script is running in the background, i.e.
+        the plot does not show the latest data yet.
+        """
+        return self._script_job is not None
+
     def append_row(self, row, ckeys=None, history=True):
         """
         Appends the supplied row of data, using databox.append_row(), but with
@@ -865,26 +1884,184 @@ class DataboxPlot(_d.databox, _g.GridLayout):
         history=True : True or integer
             Number of previous data points to keep in memory. If True (default),
             use self.number_history's value. If 0, kep all data.
+        With a nonzero history, rows are written into a circular buffer in
+        O(1), and the contiguous columns are only rebuilt when someone looks
+        at them (e.g. once per plot()).
         """
         if history is True: history = self.number_history()
 
+        # Circular buffer mode
+        if history and self._ring_append(row, ckeys, history):
+            self._log_rows([[x] for x in row])
+            return self
+
+        # Otherwise make sure the columns are up to date and stop using the ring
+        self._reset_ring()
+
+        # Remember the columns feeding the maintained histograms
+        old = dict()
+        for ckey in self._histograms:
+            if ckey in self.ckeys: old[ckey] = self[ckey]
+
         # First append like normal
         super().append_row(row, ckeys, history)
 
+        # Update the maintained histograms: drop whatever rows the history
+        # trimmed from the front, and add the new row.
+        for ckey in list(self._histograms):
+            if not ckey in self.ckeys or not ckey in old:
+                self._histograms.pop(ckey)
+                continue
+
+            try:
+                dropped = len(old[ckey]) + 1 - len(self[ckey])
+                if dropped > 0: self._histograms[ckey].remove_data(old[ckey][:dropped])
+                self._histograms[ckey].append_data(self[ckey][-1:])
+            except ValueError:
+                self._histograms.pop(ckey)
+
         # If the dump file is checked, dump the row
-        if self.button_log_data() and len(self.label_log_path()):
+        self._log_rows([[x] for x in row])
 
-            # Get a list of strings
-            row_strings = []
-            for x in row: row_strings.append(str(x))
+        return self
 
-            # The most pythony python that ever pythoned.
-            delimiter = '\t' if self.delimiter is None else self.delimiter
+    def _reset_ring(self):
+        """
+        Brings the columns up to date and stops using the circular buffer.
+        """
+        self._materialize()
+        self._ring = None
+
+    def _ring_append(self, row, ckeys, history):
+        """
+        Writes row into the circular buffer of the specified length, setting
+        it up from the current columns if needed. Returns False if the row
+        cannot be handled this way (no columns yet, new ckeys, or
+        non-numeric values), in which case nothing is done.
+        """
+        if ckeys is not None and list(ckeys) != list(self.ckeys): return False
+        if len(self.ckeys) == 0 or len(row) != len(self.ckeys):   return False
+        for x in row:
+            if not isinstance(x, _numbers.Number): return False
+
+        # (Re)build the ring from the last history rows of the columns
+        if self._ring is None or self._ring_capacity != history or list(self._ring) != list(self.ckeys):
+            self._materialize()
+            self._ring = dict()
+            for k in self.ckeys:
+                c = _n.asarray(self.columns[k])[-history:]
+                self._ring[k] = _n.zeros(history, dtype=complex if c.dtype.kind == 'c' else float)
+                self._ring[k][:len(c)] = c
+            self._ring_capacity = history
+            self._ring_count    = len(c)
+            self._ring_head     = len(c) % history
+
+            # Histograms of rows that no longer fit are rebuilt on the next plot
+            for k in list(self._histograms):
+                if self._histograms[k].n != self._ring_count: self._histograms.pop(k)
+
+        # Overwrite the oldest row (updating the maintained histograms)
+        h    = self._ring_head
+        full = self._ring_count == self._ring_capacity
+        for i in range(len(self.ckeys)):
+            k = self.ckeys[i]
+            if k in self._histograms:
+                try:
+                    if full: self._histograms[k].remove_data(self._ring[k][h:h+1])
+                    self._histograms[k].append_data([row[i]])
+                except ValueError:
+                    self._histograms.pop(k)
+            self._ring[k][h] = row[i]
+
+        self._ring_head  = (h+1) % self._ring_capacity
+        self._ring_count = min(self._ring_count+1, self._ring_capacity)
+        self._ring_stale = True
+        return True
 
-            # Append a single line.
-            f = open(self.label_log_path(), 'a')
-            f.write(delimiter.join(row_strings)+'\n')
-            f.close()
+    def _materialize(self):
+        """
+        Rebuilds contiguous (oldest first) columns from the circular buffer,
+        if anything was appended since the last time.
+        """
+        if not getattr(self, '_ring_stale', False): return
+        self._ring_stale = False
+
+        h, n = self._ring_head, self._ring_count
+        for k in self._ring:
+            r = self._ring[k]
+            if n < self._ring_capacity: self.columns[k] = r[:n].copy()
+            else:                       self.columns[k] = _n.concatenate((r[h:], r[:h]))
+
+    def __getitem__(self, n):
+        self._materialize()
+        return super().__getitem__(n)
+
+    def _log_rows(self, columns):
+        """
+        If the "Log Data" button is enabled, appends the rows formed by the
+        supplied columns to the log file.
+        """
+        if not self.button_log_data() or not len(self.label_log_path()): return
+
+        # Archive logging: compressed chunks appended to the archive
+        if self.combo_binary.get_text() == 'Archive':
+            if self._log_archive is None:
+                path = self.label_log_path()
+                self._log_archive = archive_writer(path, self.ckeys,
+                    [_n.asarray(self[k]).dtype for k in self.ckeys], self._get_headers(), chunk_size=4096,
+                    append=is_archive(path) and archive_reader(path).ckeys == list(self.ckeys))
+            self._log_archive.append_data(columns)
+            return
+
+        # The most pythony python that ever pythoned.
+        delimiter = '\t' if self.delimiter is None else self.delimiter
+
+        # Get a list of strings, one per row
+        lines = []
+        for row in zip(*columns): lines.append(delimiter.join([str(x) for x in row])+'\n')
+
+        # Append them all at once.
+        f = open(self.label_log_path(), 'a')
+        f.write(''.join(lines))
+        f.close()
+
+    def update_from_store(self, store, keys):
+        """
+        Shows the newest rows of an acquisition_store (see PCIT1_storage) as
+        this DataboxPlot's columns, without copying the data. The rows shown
+        are limited by self.number_history, as with append_row(). Maintained
+        histograms and the "Log Data" file are updated with the changed rows only.
+        Parameters
+        ----------
+        store : acquisition_store
+            Store holding the data.
+        keys : list of strings
+            Store columns to show. These become the ckeys.
+        """
+        a0, b0 = self._store_rows
+        self._reset_ring()
+
+        # Start over if the store was cleared or the columns changed
+        if len(store) < b0 or list(self.ckeys) != list(keys):
+            a0 = b0 = 0
+            self._histograms.clear()
+
+        start = store.update_databox(self, keys, self.number_history())
+        b     = len(store)
+
+        for ckey in list(self._histograms):
+            try:
+                # Rows leaving the front, rows re-entering the front (history
+                # increased), and new rows at the back.
+                if start > a0: self._histograms[ckey].remove_data(store.read_rows([ckey], a0, min(start,b0))[0])
+                if start < a0: self._histograms[ckey].append_data(store.read_rows([ckey], start, a0)[0])
+                self._histograms[ckey].append_data(store.read_rows([ckey], max(start,b0), b)[0])
+            except ValueError:
+                self._histograms.pop(ckey)
+
+        self._log_rows(store.read_rows(keys, b0, b))
+        self._store       = store
+        self._store_rows  = (start, b)
 
         return self
 
@@ -902,8 +2079,19 @@ class DataboxPlot(_d.databox, _g.GridLayout):
             Note that setting header_only=True will include settings and the usual
             databox header.
         **kwargs are sent to the normal databox save_file() function.
+        
+        When showing an acquisition_store (see update_from_store()), rows
+        spilled to disk are saved too. Archives stream them from the spill
+        file; other formats need them all in memory while saving.
         """
         self.before_save_file()
+        self._materialize()
+        
+        # First row to save, if some of it has been spilled to disk
+        spilled = None
+        if not just_settings and self._store is not None and len(self._store) == self._store_rows[1]:
+            spilled = max(len(self._store)-self.number_history(), 0) if self.number_history() else 0
+            if spilled >= self._store_rows[0]: spilled = None
 
         # Update the log file note
         self.h(**{'DataboxPlot_Note' : self.text_log_note(),})
@@ -920,12 +2108,75 @@ class DataboxPlot(_d.databox, _g.GridLayout):
         # add all the controls settings to the header
         for x in self._autosettings_controls: self._store_gui_setting(d, x)
 
+        # Compressed chunked archive
+        if kwargs['binary'] == 'Archive': path = self._save_archive(d, path, spilled)
+
         # save the file using the skeleton function, so as not to recursively
         # call this one again!
-        _d.databox.save_file(d, path, self.file_type, self.file_type, force_overwrite, **kwargs)
+        else:
+            # Page the spilled rows in for the save
+            if spilled is not None:
+                columns = self._store.read_rows(d.ckeys, spilled, self._store_rows[1])
+                for n in range(len(d.ckeys)): d.columns[d.ckeys[n]] = columns[n]
+            
+            if _d.databox.save_file(d, path, self.file_type, self.file_type, force_overwrite, **kwargs) is False: path = None
+            else: path = d.path
+
+        # Index the saved run
+        if self.catalog is not None and path and not just_settings:
+            try:
+                if spilled is None: self.catalog.add_run(path, [d[k] for k in d.ckeys], self._get_headers(d), d.ckeys)
+                else:               self.catalog.add_file(path, force=True)
+            except Exception as e: print('Could not catalog '+path+':', e)
+        
+        # Back to views of the rows in memory
+        if spilled is not None: self._store.update_databox(self, list(self.ckeys), self.number_history())
 
         return self
 
+    def _get_headers(self, d=None):
+        """
+        Returns a dictionary of the header of databox d (default self).
+        """
+        if d is None: d = self
+        headers = dict()
+        for k in d.hkeys: headers[k] = d.headers[k]
+        return headers
+
+    def _save_archive(self, d, path=None, spilled=None):
+        """
+        Saves the header and columns of databox d as a compressed chunked
+        archive. Returns the path, or None if the dialog was cancelled. If
+        spilled is a row number, the store's rows from there up to the rows
+        in d are read back from disk and written first, a chunk at a time.
+        """
+        if path is None:
+            path = _s.dialogs.save(self.file_type, 'Save archive to...', force_extension=self.file_type)
+            if not path: return None
+
+        w = archive_writer(path, d.ckeys, [_n.asarray(d[k]).dtype for k in d.ckeys], self._get_headers(d))
+        if spilled is not None:
+            for a in range(spilled, self._store_rows[0], 1<<20):
+                w.append_data(self._store.read_rows(d.ckeys, a, min(a+(1<<20), self._store_rows[0])))
+        w.append_data([d[k] for k in d.ckeys])
+        w.close()
+        return path
+
+    def _load_archive(self, d, path, header_only=False):
+        """
+        Loads a compressed chunked archive into databox d.
+        """
+        r = archive_reader(path)
+
+        d.clear()
+        d.path = path
+        for k in r.headers: d.h(**{k : r.headers[k]})
+        if header_only: return d
+
+        columns = r.read_rows()
+        for n in range(len(r.ckeys)): d[r.ckeys[n]] = columns[n]
+        return d
+
     def load_file(self, path=None, just_settings=False, just_data=False):
         """
         Loads a data file. After the file is loaded, calls self.after_load_file(self),
@@ -952,8 +2203,20 @@ class DataboxPlot(_d.databox, _g.GridLayout):
             d = self
             header_only = False
 
-        # Load the file
-        result = _d.databox.load_file(d, path, filters=self.file_type, header_only=header_only, quiet=just_settings)
+        # Maintained histograms and the circular buffer start over, and the
+        # data no longer comes from a store
+        if not just_settings:
+            self._histograms.clear()
+            self._ring_stale = False
+            self._ring       = None
+            self._store      = None
+
+        # Load the file (archives are recognized by their first bytes)
+        if path is None: path = _s.dialogs.load(self.file_type)
+        if not path: return
+
+        if is_archive(path): result = self._load_archive(d, path, header_only)
+        else:                result = _d.databox.load_file(d, path, filters=self.file_type, header_only=header_only, quiet=just_settings)
 
         # import the settings if they exist in the header
         if not just_data:
@@ -1111,11 +2374,17 @@ class DataboxPlot(_d.databox, _g.GridLayout):
     # Globals to help execute the plot script
     plot_script_globals = dict();
 
+    # run_catalog in which saved and logged runs are indexed (None for no indexing)
+    catalog = None
+
     def plot(self):
         """
         Updates the plot according to the script and internal data.
         """
 
+        # Rebuild the columns from the circular buffer once per redraw
+        self._materialize()
+
         # If we're disabled or have no data, clear
         if not self.button_enabled.is_checked() \
         or len(self)==0:
@@ -1126,76 +2395,149 @@ class DataboxPlot(_d.databox, _g.GridLayout):
         if not self.combo_autoscript.get_index()==0:
             self.script.set_text(self._generate_autoscript())
 
-        ##### Try the script and make the curves / plots match
-        try:
+        # Only one script at a time; run again when it's done
+        if self._script_job is not None:
+            self._script_again = True
+            return self
+        self._script_again = False
 
-            # get globals for sin, cos etc and libraries
-            g = dict(_n.__dict__, np=_n, _n=_n, numpy=_n)
-            g.update(_scipy_special.__dict__, special=_scipy_special)
-            g.update(dict(spinmob=_s, sm=_s, s=_s, _s=_s))
+        # get globals for sin, cos etc and libraries
+        g = dict(_n.__dict__, np=_n, _n=_n, numpy=_n)
+        g.update(_scipy_special.__dict__, special=_scipy_special)
+        g.update(dict(spinmob=_s, sm=_s, s=_s, _s=_s))
 
-            # Pyqtgraph globals
-            g.update(dict(mkPen=_pg.mkPen, mkBrush=_pg.mkBrush))
+        # Pyqtgraph globals
+        g.update(dict(mkPen=_pg.mkPen, mkBrush=_pg.mkBrush))
 
-            # Object globals
-            g.update(dict(d=self, x=None, y=None, ex=None, ey=None, styles=self._styles))
+        # Object globals
+        d = _databox_snapshot(self)
+        g.update(dict(d=d, x=None, y=None, ex=None, ey=None, styles=list(self._styles)))
 
-            # Default values
-            g.update(dict(xlabels='x', ylabels='y'))
+        # Default values
+        g.update(dict(xlabels='x', ylabels='y'))
 
-            # Other globals
-            g.update(self.plot_script_globals)
+        # Other globals
+        g.update(self.plot_script_globals)
+
+        # run the script in the background
+        self._script_job = job = dict(started=_time.time(), done=False)
+        job['thread'] = _threading.Thread(target=self._run_script, args=(job, self.script.get_text(), g, d, self.number_bin_width.get_value()), daemon=True)
+        job['thread'].start()
+        self._script_timer.start()
+
+        return self
 
+    def _run_script(self, job, script, g, d, width):
+        """
+        Runs the plot script with globals g (in a background thread) and
+        stores the result in job.
+        """
+        try:
             # run the script.
-            exec(self.script.get_text(), g)
+            exec(script, g)
 
-            # x & y should now be data arrays, lists of data arrays or Nones
-            x = g['x']
+            # Histogram the counts. Columns are histogrammed later by
+            # _get_histogram(), which reuses the maintained histograms.
             y = g['y']
-            #ex = g['ex']
-            ey = g['ey'] # Use spinmob._plotting_mess
+            for ckey in d.ckeys:
+                if y is d[ckey]:
+                    job['ckey'] = ckey
+                    break
+            else: job['histogram'] = count_histogram(width).append_data(y).get_histogram()
+
+            job['styles'] = g['styles']
+
+        except Exception as e: job['error'] = e
+
+        job['done'] = True
+
+    def _script_timer_tick(self, *a):
+        """
+        Checks on the background plot script and applies its result.
+        """
+        job = self._script_job
+        if job is None:
+            self._script_timer.stop()
+            return
+
+        # Over budget: forget the job (its result is never looked at), so
+        # a script that never returns can't block later plots, and ask its
+        # thread to stop. A script stuck in a blocking call only stops when
+        # the call returns.
+        if not job['done'] and _time.time()-job['started'] > self.number_script_budget.get_value():
+            self._script_job = None
+            self._script_timer.stop()
+            _ctypes.pythonapi.PyThreadState_SetAsyncExc(_ctypes.c_ulong(job['thread'].ident), _ctypes.py_object(TimeoutError))
+            self._show_script_error(TimeoutError('Script took longer than %g s; the previous plot is kept.' % self.number_script_budget.get_value()))
+            self.scripts_done += 1
+            self.after_plot()
+            if self._script_again: self.plot()
+            return
+
+        if not job['done']: return
+        self._script_job = None
+        self._script_timer.stop()
+
+        if   'error' in job: self._show_script_error(job['error'])
+        else:
+            try:
+                if 'ckey' in job: y, x = self._get_histogram(self[job['ckey']]).get_histogram()
+                else:             y, x = job['histogram']
 
-            # make everything the right shape
-            #x, y = _s.fun._match_data_sets(x,y)
-            #ey   = _s.fun._match_error_to_data_set(y,ey)
+                # make sure we have exactly the right number of plots
+                self._styles = job['styles']
+                self._set_number_of_plots(x,y)
 
-            x = list(x)
-            y = list(y)
-            
-            y, x = _n.histogram(y,bins = _n.linspace(min(y),max(y),(max(y)-min(y))+1))
-            
-            
+                # unpink the script, since it seems to have worked
+                self.script       .set_colors(None, None)
+                self.button_script.set_colors(None, None)
 
-            # make sure we have exactly the right number of plots
-            self._set_number_of_plots(x,y)
-            
-        
+                # Remember the style of this plot
+                if self._styles: self._previous_styles = list(self._styles)
+                else:            self._previous_styles = self._styles
 
-            # unpink the script, since it seems to have worked
-            self.script       .set_colors(None, None)
-            self.button_script.set_colors(None, None)
+                # Clear the error if present
+                self._label_script_error.hide()
 
-            # Remember the style of this plot
-            if self._styles: self._previous_styles = list(self._styles)
-            else:            self._previous_styles = self._styles
+            except Exception as e: self._show_script_error(e)
 
-            # Clear the error if present
-            self._label_script_error.hide()
+        self.scripts_done += 1
+        self.after_plot()
 
-        # otherwise, look angry and don't autosave
-        except Exception as e:
-            self._e = e
-            if _s.settings['dark_theme_qt']: self.script.set_colors(None,'#552222')
-            else:                            self.script.set_colors(None,'pink')
-            self.button_script.set_colors('black', 'pink')
+        # Someone asked for a newer plot in the meantime
+        if self._script_again: self.plot()
 
-            # Show the error
-            self._label_script_error.show()
-            self._label_script_error.set_text('OOP! '+ type(e).__name__ + ": '" + str(e.args[0]) + "'")
-            if _s.settings['dark_theme_qt']: self._label_script_error.set_colors('pink', None)
-            else:                            self._label_script_error.set_colors('red', None)
+    def _show_script_error(self, e):
+        """
+        Turns the script pink and shows the exception e.
+        """
+        self._e = e
+        if _s.settings['dark_theme_qt']: self.script.set_colors(None,'#552222')
+        else:                            self.script.set_colors(None,'pink')
+        self.button_script.set_colors('black', 'pink')
 
-        return self
+        # Show the error
+        self._label_script_error.show()
+        self._label_script_error.set_text('OOP! '+ type(e).__name__ + ": '" + str(e.args[0] if e.args else '') + "'")
+        if _s.settings['dark_theme_qt']: self._label_script_error.set_colors('pink', None)
+        else:                            self._label_script_error.set_colors('red', None)
+
+    def _get_histogram(self, y):
+        """
+        Returns a count_histogram of y. If y is one of the columns, the
+        histogram is kept and updated by append_row() from then on, so later
+        plots only cost the new rows.
+        """
+        width = self.number_bin_width.get_value()
+
+        for ckey in self.ckeys:
+            if y is self[ckey]:
+                h = self._histograms.get(ckey)
+                if h is None or h.n != len(y) or h.width != width:
+                    h = self._histograms[ckey] = count_histogram(width).append_data(y)
+                return h
+
+        return count_histogram(width).append_data(y)
 
     def autosave(self):
         """
@@ -1303,8 +2645,9 @@ class DataboxPlot(_d.databox, _g.GridLayout):
             # remove it from the grid so nothing is tracking it
             self.grid_plot.remove_object(p)
 
-        # Delete the curves, too
+        # Delete the curves and error bars, too
         while len(self._curves): self._curves.pop()
+        while len(self._errors): self._errors.pop()
         
         
         
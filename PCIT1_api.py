@@ -1,5 +1,6 @@
-import serial as _serial
-import numpy  as _n
+import serial   as _serial
+import numpy    as _n
+import warnings as _warnings
 
 class PCIT1_api():
     """
@@ -20,6 +21,12 @@ class PCIT1_api():
         
         self.n = 0
         
+        # Interval timer: incomplete record left over from the last read,
+        # the simulated clock (ticks), and the number of malformed records.
+        self._interval_buffer = b''
+        self._interval_clock  = 0
+        self.rejected         = 0
+        
         if not _serial:
             print('You need to install pyserial to use the TeachSpin PCIT1-A.')
             self.simulation_mode = True
@@ -59,7 +66,7 @@ class PCIT1_api():
             iteration, count = [int(i) for i in data.strip('\n\r').split(',')]
             
         else:
-            self.n +=1 if self.n < 65535 else  0
+            self.n = self.n+1 if self.n < 65535 else 0
             iteration = self.n
             count = int(_n.rint(_n.random.normal(50, 8)))
 
@@ -95,6 +102,94 @@ class PCIT1_api():
         return iteration_numbers, counts
             
         
+    def read_all_intervals(self, simulation_rate=2e5, simulation_tick=1e-8):
+        """
+        Reads all interval-timer records in the input buffer at once, for use
+        when the instrument is in interval-timer mode. Each record is a line
+        "timestamp,interval" (or just "interval") in timer ticks. The whole
+        buffer is parsed in one go by numpy, and an incomplete last record is
+        kept for the next call. The record format is taken from the last
+        (always complete) record; records of the other format or that aren't
+        integers (e.g. a partial first line after connecting) are dropped and
+        counted in self.rejected. Only a buffer with such records is parsed
+        record by record.
+
+        Parameters
+        ----------
+        simulation_rate=2e5 : float
+            Mean event rate (Hz) in simulation mode.
+        simulation_tick=1e-8 : float
+            Duration of one timer tick (s) in simulation mode.
+
+        Returns
+        -------
+        timestamps : 1D int64 array
+            Time of each event (ticks).
+        intervals : 1D int64 array
+            Time since the previous event (ticks).
+
+        """
+        if not self.simulation_mode:
+            data = self._interval_buffer + self.device.read(self.device.in_waiting)
+            
+            # Keep the incomplete record for next time
+            end = max(data.rfind(b'\n'), data.rfind(b'\r'))+1
+            self._interval_buffer = data[end:]
+            
+            text = data[:end].replace(b'\r\n', b'\n').replace(b'\r', b'\n').strip(b'\n')
+            if len(text) == 0: return _n.zeros(0, dtype=_n.int64), _n.zeros(0, dtype=_n.int64)
+            
+            # Two numbers per record, or one
+            columns = text[text.rfind(b'\n')+1:].count(b',')+1
+            
+            # Fast path: every record is non-empty with the same number of
+            # commas as the last one, and everything parses as an integer.
+            b      = _n.frombuffer(text+b'\n', dtype=_n.uint8)
+            ends   = _n.flatnonzero(b == 10)
+            commas = _n.diff(_n.cumsum(b == 44)[ends], prepend=0)
+            values = None
+            if (_n.diff(ends, prepend=-1) > 1).all() and (commas == columns-1).all():
+                with _warnings.catch_warnings():
+                    _warnings.simplefilter('error')
+                    try:    values = _n.fromstring(text.replace(b'\n', b','), dtype=_n.int64, sep=',')
+                    except (ValueError, DeprecationWarning): pass
+                if values is not None and len(values) != len(ends)*columns: values = None
+            
+            # Garbled buffer: go record by record
+            if values is None: values = self._parse_records(text.split(b'\n'), columns)
+            
+            if columns == 2: 
+                values     = values.reshape(-1,2)
+                timestamps = values[:,0]
+                intervals  = values[:,1]
+            
+            else:
+                intervals  = values
+                timestamps = self._interval_clock + _n.cumsum(intervals)
+        
+        else:
+            intervals  = 1+_n.random.exponential(1.0/(simulation_rate*simulation_tick), _n.random.poisson(0.05*simulation_rate)).astype(_n.int64)
+            timestamps = self._interval_clock + _n.cumsum(intervals)
+        
+        if len(timestamps): self._interval_clock = int(timestamps[-1])
+        return timestamps, intervals
+    
+    def _parse_records(self, tokens, columns):
+        """
+        Slow path of read_all_intervals(): parses the records one at a time,
+        keeping those with the specified number of integer values and counting
+        the rest in self.rejected. Returns the values as a flat int64 array.
+        """
+        tokens = [x for x in tokens if x]
+        values = []
+        for x in tokens:
+            if x.count(b',') != columns-1: continue
+            try:    values.append(_n.array(x.split(b','), dtype='S24').astype(_n.int64))
+            except ValueError: pass
+        
+        self.rejected += len(tokens)-len(values)
+        return _n.concatenate(values) if len(values) else _n.zeros(0, dtype=_n.int64)
+    
     def disconnect(self):
         """
         Disconnects the port.
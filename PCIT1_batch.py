@@ -0,0 +1,181 @@
+"""
+Batch reprocessing of saved runs across a pool of processes. From the
+command line, e.g.
+
+    python PCIT1_batch.py "Data/*.csv" "Data/*.arc" -o results.jsonl -j 8 --script analysis.py
+
+Each run is read in chunks (see PCIT1_storage.read_run()) and reduced to its
+count histogram and statistics. If a script is given, its function
+
+    def analyze(path, headers, histogram): return dict(...)
+
+is called with the run's header and PCIT1_stats.count_histogram, and the
+returned values are added to the run's result.
+
+All results go to one JSON-lines file, one line per run, written as each run
+finishes. Running the same command again skips the runs already in the
+output, so an interrupted batch can simply be restarted.
+"""
+import os            as _os
+import glob          as _glob
+import json          as _json
+import time          as _time
+import runpy         as _runpy
+import argparse      as _argparse
+import multiprocessing as _mp
+
+from PCIT1_stats   import count_histogram
+from PCIT1_storage import read_run, json_safe
+
+
+# User analyze() function, loaded once per worker process
+_analyze = None
+
+def _init_worker(script):
+    """
+    Loads the user script in each worker process.
+    """
+    global _analyze
+    if script: _analyze = _runpy.run_path(script)['analyze']
+
+def process_run(path, ckey='Counts (C)', time_key='Time (s)', width=1, chunk_size=65536):
+    """
+    Reduces one saved run to a dictionary of results: path, samples, mean,
+    std, t_start, t_stop, histogram (counts) and edges, plus whatever the
+    user script's analyze() returns. Errors are returned as 'error' rather
+    than raised, so one bad file doesn't stop a batch.
+    """
+    result = dict(path=path)
+    try:
+        headers, ckeys, chunks = read_run(path, chunk_size)
+        if ckey not in ckeys: raise Exception('No column "'+ckey+'".')
+        c = ckeys.index(ckey)
+        t = ckeys.index(time_key) if time_key in ckeys else None
+
+        h = count_histogram(width)
+        t_start, t_stop = None, None
+        for columns in chunks:
+            h.append_data(columns[c])
+            if t is not None and len(columns[t]):
+                if t_start is None: t_start = float(columns[t][0])
+                t_stop = float(columns[t][-1])
+
+        counts, edges = h.get_histogram()
+        result.update(samples=h.n, mean=h.get_mean() if h.n else None, std=h.get_std() if h.n else None,
+                      t_start=t_start, t_stop=t_stop, histogram=counts, edges=edges)
+
+        if _analyze is not None: result.update(_analyze(path, headers, h))
+
+    except Exception as e: result['error'] = type(e).__name__+': '+str(e)
+
+    return json_safe(result)
+
+def _process_run(arguments): return process_run(*arguments)
+
+def read_results(path):
+    """
+    Returns the list of results in a JSON-lines output file, skipping
+    damaged lines and dropping an incomplete last line (left by an
+    interruption) from the file.
+    """
+    if not _os.path.exists(path): return []
+
+    f = open(path, 'rb+')
+    data = f.read()
+    end  = data.rfind(b'\n')+1
+    if end < len(data): f.truncate(end)
+    f.close()
+
+    results = []
+    for line in data[:end].splitlines():
+        try:    results.append(_json.loads(line))
+        except ValueError: pass
+    return results
+
+def run_batch(patterns, output='results.jsonl', processes=None, script=None, ckey='Counts (C)',
+              time_key='Time (s)', width=1, chunk_size=65536, retry_errors=False, quiet=False):
+    """
+    Processes every run matching the glob patterns with a pool of processes,
+    appending one result per run to output. Runs already in output are
+    skipped (also failed ones, unless retry_errors=True, in which case their
+    old result is replaced).
+
+    Parameters
+    ----------
+    patterns : str or list of str
+        Glob pattern(s) of the runs to process.
+    output='results.jsonl' : str
+        JSON-lines file collecting the results.
+    processes=None : int
+        Number of worker processes (None for one per core).
+    script=None : str
+        Optional path of a script defining analyze(path, headers, histogram).
+    ckey, time_key, width, chunk_size
+        Sent to process_run().
+    retry_errors=False : bool
+        Whether to process runs that failed last time again.
+    quiet=False : bool
+        If True, don't print progress.
+
+    Returns
+    -------
+    Number of runs processed.
+    """
+    if isinstance(patterns, str): patterns = [patterns]
+    paths = []
+    for p in patterns: paths += _glob.glob(p)
+    paths = sorted(set([_os.path.abspath(p) for p in paths]) - set([_os.path.abspath(output)]))
+
+    # Resume
+    results = read_results(output)
+    done    = set([r['path'] for r in results if not retry_errors or 'error' not in r])
+    todo    = [p for p in paths if p not in done]
+
+    # Failed runs about to be retried: drop their old results, so each run
+    # keeps one line
+    retry = set(todo) & set([r['path'] for r in results if 'error' in r])
+    if retry:
+        f = open(output+'.tmp', 'w')
+        for r in results:
+            if r['path'] not in retry: f.write(_json.dumps(r)+'\n')
+        f.close()
+        _os.replace(output+'.tmp', output)
+    if not quiet: print(len(paths), 'runs,', len(paths)-len(todo), 'already done.')
+    if not todo: return 0
+
+    f  = open(output, 'a')
+    t0 = _time.time()
+    n  = 0
+    pool = _mp.Pool(processes, _init_worker, (script,))
+    try:
+        arguments = [(p, ckey, time_key, width, chunk_size) for p in todo]
+        for result in pool.imap_unordered(_process_run, arguments):
+            f.write(_json.dumps(result)+'\n')
+            f.flush()
+            n += 1
+
+            if not quiet:
+                rate = n/max(_time.time()-t0, 1e-9)
+                print('\r%d / %d runs, %.1f runs/s, %.0f s left   ' % (n, len(todo), rate, (len(todo)-n)/rate), end='')
+                if 'error' in result: print('\n', result['path'], result['error'])
+    finally:
+        pool.terminate()
+        f.close()
+
+    if not quiet: print()
+    return n
+
+
+if __name__ == '__main__':
+
+    parser = _argparse.ArgumentParser(description='Reprocess saved PCIT1 runs in parallel.')
+    parser.add_argument('patterns', nargs='+', help='Glob pattern(s) of the runs, e.g. "Data/*.csv".')
+    parser.add_argument('-o', '--output', default='results.jsonl', help='JSON-lines output file (appended to, so runs can be resumed).')
+    parser.add_argument('-j', '--processes', type=int, default=None, help='Number of processes (default: one per core).')
+    parser.add_argument('--script', default=None, help='Script defining analyze(path, headers, histogram).')
+    parser.add_argument('--ckey', default='Counts (C)', help='Column with the counts.')
+    parser.add_argument('--width', type=int, default=1, help='Histogram bin width.')
+    parser.add_argument('--retry-errors', action='store_true', help='Process runs that failed last time again.')
+    a = parser.parse_args()
+
+    run_batch(a.patterns, a.output, a.processes, a.script, a.ckey, width=a.width, retry_errors=a.retry_errors)
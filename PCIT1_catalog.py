@@ -0,0 +1,229 @@
+import os      as _os
+import json    as _json
+import time    as _time
+import sqlite3 as _sqlite3
+import numpy   as _n
+
+from PCIT1_stats   import count_histogram
+from PCIT1_storage import read_run, json_safe
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id        INTEGER PRIMARY KEY,
+    path      TEXT UNIQUE NOT NULL,
+    modified  REAL,
+    size      INTEGER,
+    indexed   REAL,
+    t_start   REAL,
+    t_stop    REAL,
+    samples   INTEGER,
+    total     INTEGER,
+    mean      REAL,
+    std       REAL,
+    minimum   INTEGER,
+    maximum   INTEGER,
+    note      TEXT,
+    headers   TEXT,
+    origin    INTEGER,
+    width     INTEGER,
+    histogram BLOB
+);
+CREATE INDEX IF NOT EXISTS runs_modified ON runs (modified);
+CREATE INDEX IF NOT EXISTS runs_mean     ON runs (mean);
+"""
+
+# Columns returned by run_catalog.query()
+_SUMMARY = ['id', 'path', 'modified', 'size', 'indexed', 't_start', 't_stop', 'samples',
+            'total', 'mean', 'std', 'minimum', 'maximum', 'note']
+
+
+class run_catalog():
+    """
+    Index of saved and logged runs in a local SQLite database. For each run
+    it keeps the path, file modification time and size, time range, number
+    of samples, total / mean / std / min / max of the counts, the note and
+    header, and the count histogram, so searching and overlaying many runs
+    never touches the data files.
+
+    The time range (t_start, t_stop) is in seconds since the epoch, from the
+    run's time column (relative to the start of acquisition) plus the
+    'PCIT1_Started' header written by histo. Runs without that header have
+    no time range.
+
+    Example queries:
+
+        c = run_catalog()
+        c.query('mean > ? AND modified > ?', [40, time.time()-30*24*3600])
+        c.get_histograms('note LIKE ?', ['%slit B%'])
+
+    Parameters
+    ----------
+    path='runs.sqlite' : str
+        Path of the database (created if needed).
+    ckey='Counts (C)' : str
+        Column holding the counts.
+    time_key='Time (s)' : str
+        Column holding the time (optional in the runs).
+    """
+    def __init__(self, path='runs.sqlite', ckey='Counts (C)', time_key='Time (s)'):
+
+        self.path     = path
+        self.ckey     = ckey
+        self.time_key = time_key
+
+        self.db = _sqlite3.connect(path)
+        self.db.executescript(_SCHEMA)
+        self.db.commit()
+
+    def __len__(self): return self.db.execute('SELECT COUNT(*) FROM runs').fetchone()[0]
+
+    def __repr__(self): return '<run_catalog '+self.path+': '+str(len(self))+' runs>'
+
+    def close(self):
+        """
+        Closes the database.
+        """
+        self.db.close()
+
+    def add_run(self, path, columns, headers={}, ckeys=None):
+        """
+        Indexes a run whose data is already in memory (e.g. right after
+        saving it), replacing any previous entry for the same path.
+
+        Parameters
+        ----------
+        path : str
+            Path of the saved file.
+        columns : dict or list
+            Column arrays, keyed by ckey (or a list in ckeys order).
+        headers={} : dict
+            Header of the run.
+        ckeys=None : list
+            Column keys if columns is a list.
+        """
+        if ckeys is not None: columns = dict(zip(ckeys, columns))
+        return self._add(path, headers, [[columns.get(self.ckey, []), columns.get(self.time_key)]])
+
+    def add_file(self, path, force=False):
+        """
+        Indexes a saved file (archive or spinmob data file), reading it in
+        chunks. Files already indexed are skipped unless they have changed
+        since (or force=True).
+
+        Returns True if the file was (re)indexed.
+        """
+        path = _os.path.abspath(path)
+        if not force:
+            row = self.db.execute('SELECT modified, size FROM runs WHERE path=?', [path]).fetchone()
+            if row and row[0] == _os.path.getmtime(path) and row[1] == _os.path.getsize(path): return False
+
+        headers, ckeys, chunks = read_run(path)
+        c = ckeys.index(self.ckey)         if self.ckey     in ckeys else None
+        t = ckeys.index(self.time_key)     if self.time_key in ckeys else None
+
+        self._add(path, headers, ([x[c] if c is not None else [], x[t] if t is not None else None] for x in chunks))
+        return True
+
+    def add_files(self, paths, force=False):
+        """
+        Indexes each of the supplied paths (see add_file()), printing any
+        failures. Returns the number of files (re)indexed.
+        """
+        n = 0
+        for path in paths:
+            try:    n += self.add_file(path, force)
+            except Exception as e: print('run_catalog:', path, e)
+        return n
+
+    def _add(self, path, headers, chunks):
+        """
+        Computes the summary of the (counts, times) chunks and stores it.
+        """
+        path = _os.path.abspath(path)
+
+        # Absolute start of the run, which the time column is relative to
+        try:    started = float(headers['PCIT1_Started'])
+        except (KeyError, TypeError, ValueError): started = None
+
+        h    = count_histogram()
+        t0, t1 = None, None
+        for C, t in chunks:
+            try:    h.append_data(C)
+            except ValueError: h = None # Not counts
+            if t is not None and len(t):
+                t0 = float(t[0])  if t0 is None else min(t0, float(_n.min(t)))
+                t1 = float(t[-1]) if t1 is None else max(t1, float(_n.max(t)))
+            if h is None: break
+
+        counts, edges = h.get_histogram() if h else (_n.zeros(0, dtype=_n.int64), _n.zeros(1))
+        exists = _os.path.exists(path)
+
+        self.db.execute('INSERT OR REPLACE INTO runs (path, modified, size, indexed, t_start, t_stop, samples, total, mean, std, '+
+                        'minimum, maximum, note, headers, origin, width, histogram) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)',
+            [path,
+             _os.path.getmtime(path) if exists else None,
+             _os.path.getsize (path) if exists else None,
+             _time.time(),
+             started+t0 if started is not None and t0 is not None else None,
+             started+t1 if started is not None and t1 is not None else None,
+             h.n if h else None, h.sum if h else None,
+             float(h.get_mean()) if h and h.n else None,
+             float(h.get_std())  if h and h.n else None,
+             int(edges[0]+0.5)  if len(counts) else None,
+             int(edges[-1]-0.5) if len(counts) else None,
+             str(headers.get('DataboxPlot_Note', '')),
+             _json.dumps(json_safe(headers)),
+             int(edges[0]+0.5) if len(counts) else None,
+             h.width if h else None,
+             counts.astype(_n.int64).tobytes()])
+        self.db.commit()
+
+    def remove_missing(self):
+        """
+        Forgets runs whose files no longer exist. Returns how many were removed.
+        """
+        missing = [r[0] for r in self.db.execute('SELECT id, path FROM runs') if not _os.path.exists(r[1])]
+        self.db.executemany('DELETE FROM runs WHERE id=?', [[i] for i in missing])
+        self.db.commit()
+        return len(missing)
+
+    def query(self, where='1', parameters=[], order_by='modified'):
+        """
+        Returns a list of dictionaries summarizing the matching runs.
+
+        Parameters
+        ----------
+        where='1' : str
+            SQL condition on the columns id, path, modified, size, indexed,
+            t_start, t_stop (all times in s since epoch), samples, total,
+            mean, std, minimum, maximum and note, with ? for each parameter.
+        parameters=[] : list
+            Values for the ?'s in where.
+        order_by='modified' : str
+            SQL ordering.
+        """
+        rows = self.db.execute('SELECT '+', '.join(_SUMMARY)+' FROM runs WHERE '+where+' ORDER BY '+order_by, list(parameters))
+        return [dict(zip(_SUMMARY, r)) for r in rows]
+
+    def get_headers(self, path):
+        """
+        Returns the stored header of the run at path.
+        """
+        row = self.db.execute('SELECT headers FROM runs WHERE path=?', [_os.path.abspath(path)]).fetchone()
+        if row is None: raise Exception(path+' is not in the catalog.')
+        return _json.loads(row[0])
+
+    def get_histograms(self, where='1', parameters=[], order_by='modified'):
+        """
+        Returns a list of (path, counts, edges) for the matching runs, with
+        the same counts and edges as count_histogram.get_histogram(), for
+        overlaying many runs.
+        """
+        result = []
+        for path, origin, width, blob in self.db.execute('SELECT path, origin, width, histogram FROM runs WHERE '+where+' ORDER BY '+order_by, list(parameters)):
+            counts = _n.frombuffer(blob, dtype=_n.int64)
+            if origin is None: edges = _n.zeros(1)
+            else:              edges = origin + _n.arange(len(counts)+1)*width - 0.5
+            result.append((path, counts, edges))
+        return result
@@ -0,0 +1,117 @@
+import numpy as _n
+
+
+class gate_clock():
+    """
+    Reconstructs a timestamp for every sample from its iteration number.
+
+    The counter's iteration numbers wrap around (every modulus gates); they
+    are unwrapped into a running gate index u, and each sample gets the time
+
+        t = offset + period*u
+
+    The offset (and, if no period is configured, the period) come from a
+    running least-squares fit of the host time at which each batch arrived
+    against the gate index of its last sample. Old batches are forgotten
+    with a memory of about memory batches, so slow drift of the
+    instrument's clock relative to the host clock is followed. The constant
+    delay between the end of a gate and its arrival at the host ends up in
+    the offset.
+
+    Parameters
+    ----------
+    period=None : float
+        Gate period (s). If None (or 0), it is measured by the fit.
+    modulus=65536 : int
+        Number of distinct iteration numbers before they wrap.
+    memory=1000 : float
+        Approximate number of batches remembered by the fit.
+    """
+    def __init__(self, period=None, modulus=65536, memory=1000):
+
+        self.period  = period or None
+        self.modulus = modulus
+        self.memory  = memory
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets everything (e.g. after clearing the data).
+        """
+        # Last raw iteration number and unwrapped index
+        self._raw = None
+        self.u    = -1
+
+        # First unwrapped index of the fit (for numerical precision)
+        self._u0  = None
+
+        # Decaying sums for the fit of t = a + b*(u-u0)
+        self._S = _n.zeros(5) # 1, u, t, u*u, u*t
+
+        # Latest fit and RMS residual of the batch arrival times
+        self.offset   = None
+        self.slope    = self.period
+        self.residual = 0.0
+        self._residual2 = 0.0
+
+    def unwrap(self, iterations):
+        """
+        Returns the unwrapped gate index (int64 array) of each iteration number.
+        """
+        N = _n.asarray(iterations, dtype=_n.int64)
+        if len(N) == 0: return N
+
+        if self._raw is None: self._raw, self.u = int(N[0]), int(N[0])-1
+
+        steps = _n.diff(N, prepend=self._raw) % self.modulus
+
+        u = self.u + _n.cumsum(steps)
+        self._raw, self.u = int(N[-1]), int(u[-1])
+        return u
+
+    def append_data(self, t, iterations):
+        """
+        Adds a batch of iteration numbers that arrived at host time t, and
+        returns the reconstructed time of each sample (float64 array).
+
+        Parameters
+        ----------
+        t : float
+            Host time at which the batch was read (s).
+        iterations : list or 1D array
+            Iteration numbers of the batch.
+        """
+        u = self.unwrap(iterations)
+        if len(u) == 0: return _n.zeros(0)
+
+        if self._u0 is None: self._u0 = int(u[-1])
+        x = float(u[-1]-self._u0)
+
+        # Residual of this batch against the previous fit
+        if self.offset is not None:
+            r = t - self.offset - self.slope*x
+            self._residual2 += (r*r-self._residual2)/min(self.memory, self._S[0]+1)
+            self.residual    = self._residual2**0.5
+
+        # Update the decaying sums and the fit
+        self._S *= 1.0-1.0/self.memory
+        self._S += [1.0, x, t, x*x, x*t]
+        S1, Su, St, Suu, Sut = self._S
+
+        if self.period:
+            self.slope = self.period
+        else:
+            D = S1*Suu - Su*Su
+            if D > 1e-9*S1*Suu: self.slope = (S1*Sut - Su*St)/D
+
+        # Until there are two distinct gate indices, there's nothing to fit
+        if self.slope is None: return _n.full(len(u), float(t))
+
+        self.offset = (St - self.slope*Su)/S1
+        return self.offset + self.slope*(u-self._u0)
+
+    def get_period(self):
+        """
+        Returns the configured or measured gate period (s), or None if unknown.
+        """
+        return self.slope
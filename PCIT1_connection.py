@@ -0,0 +1,218 @@
+import threading as _threading
+import time      as _time
+
+from serial.tools.list_ports import comports as _comports
+from PCIT1_api import PCIT1_api
+
+
+def _identity(p):
+    """
+    Returns something that identifies the physical device behind a
+    comports() entry, even if it comes back under a different port name.
+    """
+    if getattr(p, 'serial_number', None): return 'SN:'+str(p.serial_number)
+    if getattr(p, 'vid', None) is not None: return 'USB:%04X:%04X:%s' % (p.vid, p.pid, p.location)
+    return 'PORT:'+str(p.device)
+
+
+class port_watcher():
+    """
+    Enumerates the serial ports in a background thread, so that nothing on
+    the GUI thread ever waits for the operating system to list them. Use
+    get_port_watcher() to get the shared instance.
+
+    Parameters
+    ----------
+    interval=1 : float
+        Time between enumerations (s).
+    """
+    def __init__(self, interval=1.0):
+
+        self.interval = interval
+
+        # List of (device, description, identity), and a counter that
+        # increments with every completed enumeration
+        self.ports   = []
+        self.version = 0
+
+        self._scanned = _threading.Event()
+        self._thread  = _threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        """
+        Enumeration loop (runs in the background thread).
+        """
+        while True:
+            try:
+                self.ports    = [(p.device, p.description, _identity(p)) for p in _comports()]
+                self.version += 1
+                self._scanned.set()
+            except Exception as e: print('port_watcher:', e)
+            _time.sleep(self.interval)
+
+    def get_ports(self, wait=0):
+        """
+        Returns the latest list of (device, description, identity), waiting
+        up to wait seconds for the first enumeration.
+        """
+        if wait: self._scanned.wait(wait)
+        return list(self.ports)
+
+    def get_identity(self, device):
+        """
+        Returns the identity of the specified port, or None if it is not present.
+        """
+        for d, description, identity in self.ports:
+            if d == device: return identity
+        return None
+
+    def find(self, identity):
+        """
+        Returns the port currently used by the device with the specified
+        identity, or None if it is not present.
+        """
+        for d, description, i in self.ports:
+            if i == identity: return d
+        return None
+
+_port_watcher = None
+def get_port_watcher():
+    """
+    Returns the shared port_watcher, starting it if needed.
+    """
+    global _port_watcher
+    if _port_watcher is None: _port_watcher = port_watcher()
+    return _port_watcher
+
+
+class connection_manager():
+    """
+    Wraps a PCIT1_api connection and keeps it alive across USB unplug /
+    replug. It has the same constructor arguments and read_all_data() /
+    disconnect() / simulation_mode interface as PCIT1_api, so it can be used
+    as histo's api.
+
+    If reading fails, or the device disappears from the port list, the
+    connection is marked as lost and read_all_data() returns no data. A
+    background thread waits for the same physical device (matched by serial
+    number or USB location, so the port name may change) to reappear and
+    reconnects within about retry seconds of it showing up. Each outage is
+    recorded in self.outages as a [start, end] pair of times (s since epoch).
+
+    Parameters
+    ----------
+    port='COM4' : str
+        Port to connect to.
+    baudrate=230400, timeout=15
+        Sent to api_class.
+    api_class=PCIT1_api : class
+        Class used to open the connection.
+    retry=0.5 : float
+        Time between reconnection attempts (s).
+    """
+    def __init__(self, port='COM4', address=0, baudrate=230400, timeout=15, api_class=PCIT1_api, retry=0.5):
+
+        self.port      = port
+        self.baudrate  = baudrate
+        self.timeout   = timeout
+        self.retry     = retry
+        self._api_class = api_class
+
+        self.api = api_class(port=port, baudrate=baudrate, timeout=timeout)
+
+        # Outage bookkeeping
+        self.outages    = []
+        self.last_error = None
+        self._lost_time = None
+
+        self._lock   = _threading.Lock()
+        self._stop   = _threading.Event()
+        self._thread = None
+
+        # Simulations never drop out
+        if self.api.simulation_mode: return
+
+        self.watcher  = get_port_watcher()
+        self.identity = self.watcher.get_identity(port)
+        self._thread  = _threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def simulation_mode(self): return self.api is not None and self.api.simulation_mode
+
+    def is_connected(self):
+        """
+        Returns False while the connection is lost.
+        """
+        return self._lost_time is None
+
+    def read_all_data(self):
+        """
+        Same as PCIT1_api.read_all_data(), but returns empty lists instead
+        of raising if the connection is lost.
+        """
+        with self._lock:
+            if self._lost_time is not None: return [], []
+            try: return self.api.read_all_data()
+            except Exception as e:
+                self._lose(e)
+                return [], []
+
+    def _lose(self, error=None):
+        """
+        Marks the connection as lost (call with the lock held).
+        """
+        if self._lost_time is not None: return
+        self._lost_time = _time.time()
+        self.last_error = error
+        print('Lost connection to', self.port, '', error or '')
+        try:    self.api.disconnect()
+        except Exception: pass
+
+    def _run(self):
+        """
+        Watches for the device to disappear / reappear (runs in the background thread).
+        """
+        version = self.watcher.version
+        while not self._stop.wait(self.retry):
+
+            # Only act on fresh enumerations
+            if self.watcher.version == version: continue
+            version = self.watcher.version
+
+            # If we never learned who the device is, use the first enumeration
+            if self.identity is None and self._lost_time is None:
+                self.identity = self.watcher.get_identity(self.port)
+
+            port = self.watcher.find(self.identity) if self.identity else self.port
+
+            # Proactively notice that it's gone
+            if self._lost_time is None:
+                if port is None:
+                    with self._lock: self._lose('Device removed.')
+                continue
+
+            # Try to come back
+            if port is None: continue
+            try:    api = self._api_class(port=port, baudrate=self.baudrate, timeout=self.timeout)
+            except Exception: continue
+
+            # PCIT1_api falls back to simulation mode when it can't connect
+            if api.simulation_mode: continue
+
+            with self._lock:
+                self.api  = api
+                self.port = port
+                self.outages.append([self._lost_time, _time.time()])
+                self._lost_time = None
+            print('Reconnected to', port)
+
+    def disconnect(self):
+        """
+        Stops watching and closes the connection.
+        """
+        self._stop.set()
+        if self._thread is not None and self._thread is not _threading.current_thread(): self._thread.join()
+        with self._lock:
+            if self._lost_time is None: self.api.disconnect()
@@ -0,0 +1,128 @@
+import os        as _os
+import json      as _json
+import time      as _time
+import queue     as _queue
+import threading as _threading
+
+import pyqtgraph           as _pg
+import pyqtgraph.exporters as _exporters
+
+from PCIT1_storage import json_safe
+
+
+class snapshot_exporter():
+    """
+    Periodically renders plots to image files plus a JSON file of statistics
+    in a directory, for watching a run remotely (e.g. from a file share or a
+    simple web page). Rendering happens offscreen, from the plot's scene,
+    at most once per interval; the files are written by a background thread,
+    each to a temporary name and then moved into place, so readers never see
+    a half-written file.
+
+    For each view name, export() writes <name>.png and/or <name>.svg, and
+    always stats.json.
+
+    Parameters
+    ----------
+    directory='Snapshots' : str
+        Where to put the files (created if needed).
+    interval=60 : float
+        Minimum time between snapshots (s). 0 disables them.
+    formats=['png'] : list
+        Image formats to write, 'png' and/or 'svg'.
+    width=800 : int
+        Width of the PNG images (pixels).
+    """
+    def __init__(self, directory='Snapshots', interval=60, formats=['png'], width=800):
+
+        self.directory = directory
+        self.interval  = interval
+        self.formats   = list(formats)
+        self.width     = width
+
+        self.last    = 0    # Time of the last snapshot
+        self.skipped = 0    # Snapshots dropped because writing fell behind
+
+        # One snapshot waiting at most
+        self._queue  = _queue.Queue(1)
+        self._thread = _threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def is_due(self):
+        """
+        Returns True if it's time for another snapshot.
+        """
+        return bool(self.interval) and _time.time()-self.last >= self.interval
+
+    def export(self, views, stats, force=False):
+        """
+        Renders the views and queues them (and the stats) for writing, if a
+        snapshot is due (or force=True). Returns True if it did.
+
+        Parameters
+        ----------
+        views : dict
+            Name : pyqtgraph PlotItem or PlotWidget to render.
+        stats : dict
+            Statistics for stats.json (numbers, strings, lists).
+        force=False : bool
+            Export even if a snapshot isn't due.
+        """
+        if not force and not self.is_due(): return False
+        self.last = _time.time()
+
+        # Writer still busy with the last one; skip rather than pile up
+        if self._queue.full():
+            self.skipped += 1
+            return False
+
+        # A view that can't be rendered right now is left out of this snapshot
+        files = dict()
+        for name in views:
+            item = views[name]
+            try:
+                if isinstance(item, _pg.PlotWidget): item = item.getPlotItem()
+
+                if 'png' in self.formats:
+                    e = _exporters.ImageExporter(item)
+                    e.parameters()['width'] = self.width
+                    files[name+'.png'] = e.export(toBytes=True)
+
+                if 'svg' in self.formats:
+                    files[name+'.svg'] = _exporters.SVGExporter(item).export(toBytes=True)
+
+            except Exception as e: print('snapshot_exporter:', name, e)
+
+        stats = dict(stats, snapshot_time=self.last, snapshot_ctime=_time.ctime(self.last))
+        files['stats.json'] = _json.dumps(json_safe(stats), indent=1).encode()
+
+        self._queue.put(files)
+        return True
+
+    def _write(self, name, data):
+        """
+        Writes one file atomically.
+        """
+        path = _os.path.join(self.directory, name)
+        root, extension = _os.path.splitext(path)
+        temporary = root+'.tmp'+extension
+
+        # PNGs arrive as QImages
+        if isinstance(data, bytes):
+            f = open(temporary, 'wb')
+            f.write(data)
+            f.close()
+        elif not data.save(temporary): raise Exception('Could not write '+temporary)
+
+        _os.replace(temporary, path)
+
+    def _run(self):
+        """
+        Writes queued snapshots (runs in the background thread).
+        """
+        while True:
+            files = self._queue.get()
+            try:
+                if not _os.path.exists(self.directory): _os.makedirs(self.directory, exist_ok=True)
+                for name in files: self._write(name, files[name])
+            except Exception as e: print('snapshot_exporter:', e)
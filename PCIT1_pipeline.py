@@ -0,0 +1,299 @@
+import time  as _time
+import numpy as _n
+
+
+class stage():
+    """
+    Base class for a processing stage. A stage receives each batch as numpy
+    arrays of iteration numbers N and counts C (int64), and returns the
+    processed N and C. It can keep whatever state it needs between batches,
+    and should forget it in reset().
+
+    Keyword arguments are the stage's settings (see load_pipeline()), and
+    are stored in self.settings.
+    """
+    def __init__(self, **settings):
+        self.settings = settings
+        self.reset()
+
+    def __repr__(self): return '<'+type(self).__name__+' '+str(self.settings)+'>'
+
+    def reset(self):
+        """
+        Forgets any state (called when the data is cleared).
+        """
+        return
+
+    def process(self, N, C):
+        """
+        Overwrite this to process a batch. Returns N, C.
+        """
+        return N, C
+
+
+def _diffuse(x, residual=0.0):
+    """
+    Rounds the float array x to integers, carrying each rounding error over
+    to the next value (error diffusion), so the running total of the result
+    stays within 1/2 of the running total of x. Rounding each value on its
+    own would bias the totals whenever the corrections are small compared
+    to 1.
+
+    Parameters
+    ----------
+    x : 1D float array
+        Values to round.
+    residual=0.0 : float
+        Rounding error carried over from the previous batch.
+
+    Returns
+    -------
+    y : 1D int64 array
+        Rounded values.
+    residual : float
+        Rounding error to carry over to the next batch.
+    """
+    if len(x) == 0: return _n.zeros(0, dtype=_n.int64), residual
+
+    c = residual + _n.cumsum(x)
+    Y = _n.floor(c + 0.5)
+    return _n.diff(Y, prepend=0.0).astype(_n.int64), float(c[-1]-Y[-1])
+
+
+class dead_time(stage):
+    """
+    Non-paralyzable dead-time correction of each gate,
+
+        C -> C / (1 - C*tau/gate)
+
+    rounded to integers with error diffusion (see _diffuse()), so the
+    corrected totals and means are unbiased even when the correction is
+    much less than one count per gate.
+
+    Parameters
+    ----------
+    tau=0 : float
+        Dead time after each count (s).
+    gate=1 : float
+        Gate duration (s).
+    """
+    def __init__(self, tau=0.0, gate=1.0):
+        stage.__init__(self, tau=float(tau), gate=float(gate))
+
+    def reset(self):
+        self._residual = 0.0
+
+    def process(self, N, C):
+        live = 1.0 - C*(self.settings['tau']/self.settings['gate'])
+        if _n.any(live <= 0): raise Exception('dead_time: counts exceed gate/tau; check the settings.')
+        C, self._residual = _diffuse(C/live, self._residual)
+        return N, C
+
+
+class background(stage):
+    """
+    Subtracts a background (e.g. dark counts) from each gate. The background
+    is either fixed, or, if counts is not given, the mean of the first
+    samples gates (e.g. taken with the source blocked), which are dropped.
+    A fractional background is subtracted with error diffusion (see
+    _diffuse()), and the results can be negative, which keeps the mean
+    unbiased.
+
+    Parameters
+    ----------
+    counts=None : float
+        Background counts per gate. If None, it is measured.
+    samples=100 : int
+        Number of gates to measure the background from.
+    clip=False : bool
+        If True, negative results are set to 0. This biases the mean upward
+        whenever the signal is comparable to the background.
+    """
+    def __init__(self, counts=None, samples=100, clip=False):
+        stage.__init__(self, counts=counts, samples=int(samples), clip=bool(clip))
+
+    def reset(self):
+        self.counts    = self.settings['counts']
+        self._n        = 0
+        self._sum      = 0
+        self._residual = 0.0
+
+    def process(self, N, C):
+
+        # Still measuring the background
+        if self.counts is None:
+            k = min(self.settings['samples']-self._n, len(C))
+            self._n   += k
+            self._sum += int(C[:k].sum())
+            N, C = N[k:], C[k:]
+            if self._n == self.settings['samples']: self.counts = self._sum/self._n
+            else: return N, C
+
+        C, self._residual = _diffuse(C - self.counts, self._residual)
+        if self.settings['clip']: _n.maximum(C, 0, out=C)
+        return N, C
+
+
+class cut(stage):
+    """
+    Drops gates whose counts are outside [minimum, maximum] (e.g. bursts).
+
+    Parameters
+    ----------
+    minimum=None, maximum=None : int
+        Limits (inclusive). None means no limit.
+    """
+    def __init__(self, minimum=None, maximum=None):
+        stage.__init__(self, minimum=minimum, maximum=maximum)
+        self.dropped = 0
+
+    def process(self, N, C):
+        keep = _n.ones(len(C), dtype=bool)
+        if self.settings['minimum'] is not None: keep &= C >= self.settings['minimum']
+        if self.settings['maximum'] is not None: keep &= C <= self.settings['maximum']
+        self.dropped += len(C)-int(keep.sum())
+        return N[keep], C[keep]
+
+
+class rebin(stage):
+    """
+    Sums groups of consecutive gates (rebinning in time). Leftover gates wait
+    for the next batch. Each group gets the iteration number of its last gate.
+
+    Parameters
+    ----------
+    gates=10 : int
+        Number of gates per group.
+    """
+    def __init__(self, gates=10):
+        stage.__init__(self, gates=int(gates))
+
+    def reset(self):
+        self._N = _n.zeros(0, dtype=_n.int64)
+        self._C = _n.zeros(0, dtype=_n.int64)
+
+    def process(self, N, C):
+        m = self.settings['gates']
+        N = _n.concatenate((self._N, N))
+        C = _n.concatenate((self._C, C))
+
+        k = len(C) - len(C) % m
+        self._N, self._C = N[k:], C[k:]
+
+        return N[m-1:k:m], C[:k].reshape(-1, m).sum(axis=1)
+
+
+# Stages known to load_pipeline(). Add your own stage classes here.
+STAGES = dict(dead_time=dead_time, background=background, cut=cut, rebin=rebin)
+
+
+def _value(s):
+    """
+    Converts a setting from a pipeline file into None, bool, int, float or str.
+    """
+    if s in ['None', 'none']:  return None
+    if s in ['True', 'true']:  return True
+    if s in ['False','false']: return False
+    for f in [int, float]:
+        try:    return f(s)
+        except ValueError: pass
+    return s
+
+
+class pipeline():
+    """
+    Runs each batch from PCIT1_api.read_all_data() through a list of stages
+    before it reaches the views, and keeps track of how long each stage takes.
+
+    Parameters
+    ----------
+    stages=[] : list
+        Stage instances, run in order.
+    """
+    def __init__(self, stages=[]):
+        self.stages = list(stages)
+        self.reset()
+
+    def __len__(self): return len(self.stages)
+
+    def __repr__(self): return '<pipeline: '+', '.join([type(s).__name__ for s in self.stages])+'>'
+
+    def reset(self):
+        """
+        Resets every stage and the timings.
+        """
+        for s in self.stages: s.reset()
+
+        # Number of batches, total and last time for each stage (s)
+        self.calls = 0
+        self.total = _n.zeros(len(self.stages))
+        self.last  = _n.zeros(len(self.stages))
+
+    def process(self, N, C):
+        """
+        Processes a batch. Returns the int64 arrays N, C.
+        """
+        N = _n.asarray(N, dtype=_n.int64)
+        C = _n.asarray(C, dtype=_n.int64)
+
+        for n in range(len(self.stages)):
+            t = _time.perf_counter()
+            N, C = self.stages[n].process(N, C)
+            self.last[n] = _time.perf_counter()-t
+
+        self.total += self.last
+        self.calls += 1
+        return N, C
+
+    def get_timings(self):
+        """
+        Returns a list of (stage name, last time, mean time) in seconds.
+        """
+        mean = self.total/max(self.calls, 1)
+        return [(type(self.stages[n]).__name__, float(self.last[n]), float(mean[n])) for n in range(len(self.stages))]
+
+
+def load_pipeline(path):
+    """
+    Loads a pipeline from a text file. Each line that is not empty and does
+    not start with '#' defines one stage as
+
+        name setting=value setting=value ...
+
+    where name is a key of STAGES, e.g.
+
+        dead_time tau=50e-9 gate=0.01
+        background counts=2.5
+
+    Parameters
+    ----------
+    path : str
+        Path to the pipeline file.
+
+    Returns
+    -------
+    pipeline
+    """
+    f = open(path, 'r')
+    lines = f.readlines()
+    f.close()
+
+    stages = []
+    for n in range(len(lines)):
+        line = lines[n].split('#')[0].strip()
+        if line == '': continue
+
+        s = line.split()
+        if s[0] not in STAGES:
+            raise Exception(path+' line '+str(n+1)+': unknown stage "'+s[0]+'". Options are '+', '.join(STAGES)+'.')
+
+        settings = dict()
+        for x in s[1:]:
+            if not '=' in x: raise Exception(path+' line '+str(n+1)+': expected setting=value, got "'+x+'".')
+            k, v = x.split('=', 1)
+            settings[k] = _value(v)
+
+        try:    stages.append(STAGES[s[0]](**settings))
+        except TypeError as e: raise Exception(path+' line '+str(n+1)+': '+str(e))
+
+    return pipeline(stages)
@@ -0,0 +1,236 @@
+import os    as _os
+import numpy as _n
+
+
+def list_programs(directory='Programs'):
+    """
+    Returns a sorted list of the program file names in the specified directory,
+    or an empty list if the directory does not exist.
+
+    Parameters
+    ----------
+    directory='Programs' : str
+        Directory to search.
+    """
+    if not _os.path.isdir(directory): return []
+
+    names = []
+    for name in _os.listdir(directory):
+        if _os.path.isfile(_os.path.join(directory, name)) and not name.startswith('.'):
+            names.append(name)
+    names.sort()
+    return names
+
+def load_program(path, max_steps=10):
+    """
+    Loads a stepped acquisition program from a text file. Each line that is not
+    empty and does not start with '#' defines one step as
+
+        setting, gates
+
+    meaning "dwell for this many gates at this setting, then advance".
+
+    Parameters
+    ----------
+    path : str
+        Path to the program file.
+    max_steps=10 : int
+        Maximum number of steps allowed in a program.
+
+    Returns
+    -------
+    settings : 1D float array
+        Setting for each step.
+    gates : 1D int64 array
+        Number of gates to dwell for at each step.
+    """
+    settings = []
+    gates    = []
+
+    f = open(path, 'r')
+    lines = f.readlines()
+    f.close()
+
+    for n in range(len(lines)):
+        line = lines[n].strip()
+        if line == '' or line.startswith('#'): continue
+
+        s = line.replace(',', ' ').split()
+        if len(s) != 2:
+            raise Exception(path+' line '+str(n+1)+': expected "setting, gates".')
+
+        settings.append(float(s[0]))
+        gates   .append(int  (s[1]))
+
+    if len(settings) == 0:         raise Exception(path+' contains no steps.')
+    if len(settings) >  max_steps: raise Exception(path+' has more than '+str(max_steps)+' steps.')
+    if min(gates) <= 0:            raise Exception(path+' has a step with no gates.')
+
+    return _n.array(settings, dtype=float), _n.array(gates, dtype=_n.int64)
+
+
+class program_runner():
+    """
+    Runs a stepped acquisition program over the incoming stream of gates,
+    keeping a separate histogram and statistics for each step in preallocated
+    arrays.
+
+    Gates are assigned to steps by their position in the stream, so a batch
+    that straddles a step boundary is split between the two steps. The next
+    step is requested (via self.event_step) lead_gates gates before the
+    boundary, but since the request can only happen after a batch is read,
+    gates later in that same batch were still taken at the old setting. The
+    first settle_gates gates of every step are therefore discarded; set it to
+    at least the number of gates in one batch (plus whatever the hardware
+    needs to move).
+
+    Parameters
+    ----------
+    settings : list or 1D array
+        Setting for each step.
+    gates : list or 1D array of ints
+        Number of gates to dwell for at each step.
+    max_count=1023 : int
+        Largest count with its own histogram bin. Larger counts are accumulated
+        in one overflow bin (index max_count+1), and negative counts (e.g. after
+        background subtraction) in bin 0. The means and standard deviations
+        are exact either way.
+    lead_gates=0 : int
+        How many gates before the end of a step to request the next setting.
+    settle_gates=0 : int
+        How many gates to discard at the start of each step, on top of its
+        dwell gates.
+    """
+    def __init__(self, settings, gates, max_count=1023, lead_gates=0, settle_gates=0):
+
+        self.settings = _n.array(settings, dtype=float)
+        self.gates    = _n.array(gates,    dtype=_n.int64)
+        if len(self.settings) != len(self.gates): raise Exception('settings and gates must have the same length.')
+        if len(self.gates) == 0 or self.gates.min() <= 0: raise Exception('Every step needs at least one gate.')
+
+        self.max_count  = int(max_count)
+        self.lead_gates   = int(lead_gates)
+        self.settle_gates = int(settle_gates)
+        if self.settle_gates < 0: raise Exception('settle_gates cannot be negative.')
+
+        # Sample index at which each step ends (exclusive) and its first kept sample
+        self._ends = _n.cumsum(self.gates+self.settle_gates)
+        self._kept = self._ends - self.gates
+        S = len(self.gates)
+
+        # Preallocated per-step results
+        self.histograms       = _n.zeros((S, self.max_count+2), dtype=_n.uint32)
+        self.n                = _n.zeros(S, dtype=_n.int64)
+        self.sum              = _n.zeros(S, dtype=_n.int64)
+        self.sum2             = _n.zeros(S, dtype=_n.int64)
+        self.first_iteration  = _n.full (S, -1, dtype=_n.int64)
+        self.last_iteration   = _n.full (S, -1, dtype=_n.int64)
+
+        # Number of samples taken so far and the most recently requested step
+        self.samples   = 0
+        self.requested = -1
+
+    def __len__(self): return len(self.gates)
+
+    def event_step(self, step, setting):
+        """
+        Called whenever a new step's setting is requested. Overwrite this to
+        drive the hardware.
+        """
+        return
+
+    def start(self):
+        """
+        Requests the first step's setting.
+        """
+        self._request(0)
+        return self
+
+    def _request(self, step):
+        """
+        Requests all steps up to and including the specified one.
+        """
+        while self.requested < min(step, len(self)-1):
+            self.requested += 1
+            self.event_step(self.requested, self.settings[self.requested])
+
+    def get_step(self):
+        """
+        Returns the index of the step currently being acquired (len(self) when done).
+        """
+        return int(_n.searchsorted(self._ends, self.samples, side='right'))
+
+    def is_done(self):
+        """
+        Returns True when every step has all of its gates.
+        """
+        return self.samples >= self._ends[-1]
+
+    def append_data(self, iterations, counts):
+        """
+        Accumulates a batch of gates from PCIT1_api.read_all_data(). Anything
+        arriving after the last step is complete is ignored.
+
+        Parameters
+        ----------
+        iterations : list or 1D array
+            Iteration numbers of the counter.
+        counts : list or 1D array
+            Counts at each respective iteration.
+
+        Returns
+        -------
+        completed : list
+            Indices of the steps completed by this batch.
+        """
+        C = _n.asarray(counts,     dtype=_n.int64)[:max(0, self._ends[-1]-self.samples)]
+        N = _n.asarray(iterations, dtype=_n.int64)[:len(C)]
+        if len(C) == 0: return []
+
+        S = len(self)
+        B = self.max_count+2
+        before = self.get_step()
+
+        # Step index of every sample in this batch, all in one go, dropping
+        # the ones still settling.
+        i = self.samples + _n.arange(len(C))
+        s = _n.searchsorted(self._ends, i, side='right')
+        self.samples += len(C)
+
+        keep = i >= self._kept[s]
+        C = C[keep]
+        N = N[keep]
+        s = s[keep]
+        b = _n.clip(C, 0, B-1)
+
+        self.histograms += _n.bincount(s*B+b, minlength=S*B).reshape(S,B).astype(_n.uint32)
+        self.n          += _n.bincount(s, minlength=S)
+        self.sum        += _n.bincount(s, weights=C,   minlength=S).astype(_n.int64)
+        self.sum2       += _n.bincount(s, weights=C*C, minlength=S).astype(_n.int64)
+
+        # Iteration range of each step touched by this batch
+        first = _n.flatnonzero(_n.diff(s, prepend=-1))
+        last  = _n.append(first[1:], len(s))-1
+        for i, j in zip(first, last):
+            if self.first_iteration[s[i]] < 0: self.first_iteration[s[i]] = N[i]
+            self.last_iteration[s[j]] = N[j]
+
+        # Request upcoming settings ahead of the boundary
+        self._request(int(_n.searchsorted(self._ends, self.samples+self.lead_gates, side='right')))
+
+        return list(range(before, min(self.get_step(), S)))
+
+    def get_means(self):
+        """
+        Returns the mean count of each step (nan for steps with no data).
+        """
+        with _n.errstate(invalid='ignore', divide='ignore'):
+            return self.sum / self.n
+
+    def get_stds(self):
+        """
+        Returns the standard deviation of the counts in each step.
+        """
+        with _n.errstate(invalid='ignore', divide='ignore'):
+            m = self.sum / self.n
+            return _n.sqrt(_n.maximum(self.sum2 / self.n - m*m, 0))
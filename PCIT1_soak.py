@@ -0,0 +1,193 @@
+"""
+Accelerated soak test of the histo GUI. Runs histo offscreen, fed by a fast
+simulated source, for the equivalent of many hours of acquisition, switching
+to the next tab on every tick so each one gets drawn, and records memory,
+Qt object counts, plot list lengths and tick latency as it goes. It fails (exit status 1) if any of them keeps growing, e.g.
+
+    python PCIT1_soak.py --hours 24 --gate 0.01 --output soak.csv
+"""
+import os       as _os
+import sys      as _sys
+import gc       as _gc
+import time     as _time
+import tempfile as _tempfile
+import argparse as _argparse
+import resource as _resource
+import collections as _collections
+
+# Must be set before Qt is imported
+_os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy     as _n
+import pyqtgraph as _pg
+
+import PCIT1
+from PCIT1_api import PCIT1_api
+
+
+class fast_simulation(PCIT1_api):
+    """
+    Simulated PCIT1_api that returns a whole tick's worth of gates at once
+    (as arrays), so hours of acquisition can be replayed in minutes.
+
+    Parameters
+    ----------
+    gates=10000 : int
+        Number of gates returned by each read_all_data().
+    mean=50 : float
+        Mean counts per gate (Poisson).
+    """
+    gates = 10000
+    mean  = 50.0
+
+    def __init__(self, port='Simulation', address=0, baudrate=230400, timeout=15):
+        PCIT1_api.__init__(self, 'Simulation', address, baudrate, timeout)
+
+    def read_all_data(self):
+        N = (self.n + _n.arange(1, self.gates+1)) % 65536
+        self.n = int(N[-1])
+        return N, _n.random.poisson(self.mean, self.gates)
+
+
+def get_rss():
+    """
+    Returns the resident memory of this process (bytes).
+    """
+    try:
+        f = open('/proc/self/statm')
+        pages = int(f.read().split()[1])
+        f.close()
+        return pages*_os.sysconf('SC_PAGE_SIZE')
+
+    # Not Linux: peak rather than current, but still catches growth
+    except Exception: return _resource.getrusage(_resource.RUSAGE_SELF).ru_maxrss*(1 if _sys.platform == 'darwin' else 1024)
+
+def get_qt_objects():
+    """
+    Returns the number of live Qt objects with Python wrappers.
+    """
+    return sum([isinstance(o, _pg.QtCore.QObject) for o in _gc.get_objects()])
+
+# Quantities sampled, and whether growth is allowed to be proportional
+# (memory) or must level off completely (counts of things)
+METRICS = ['rss', 'qt_objects', 'widgets', 'plot_curves', 'plot_errors', 'plot_widgets',
+           'scatter_curves', 'scatter_errors', 'scatter_widgets', 'latency']
+
+def sample(self, latency):
+    """
+    Returns the current value of each of METRICS for histo self.
+    """
+    return [get_rss(), get_qt_objects(), len(_pg.QtWidgets.QApplication.instance().allWidgets()),
+            len(self.plot._curves),    len(self.plot._errors),    len(self.plot.plot_widgets),
+            len(self.scatter._curves), len(self.scatter._errors), len(self.scatter.plot_widgets),
+            latency]
+
+def find_growth(history, rss_slack=0.2, rss_min=20e6, count_slack=5, latency_factor=3.0):
+    """
+    Compares the last quarter of the run with the second quarter (after
+    warm-up) and returns a list of complaints about metrics that kept growing.
+    """
+    h = _n.array(history, dtype=float)
+    q = max(len(h)//4, 1)
+    early, late = h[q:2*q], h[-q:]
+
+    problems = []
+    for n, name in enumerate(METRICS):
+        a, b = _n.median(early[:,n]), _n.median(late[:,n])
+        if   name == 'rss':     limit = a*(1+rss_slack) + rss_min
+        elif name == 'latency': limit = a*latency_factor + 1e-3
+        else:                   limit = a + count_slack
+        if b > limit: problems.append('%s grew from %g to %g (limit %g)' % (name, a, b, limit))
+    return problems
+
+def run_soak(hours=24, gate=0.01, gates_per_tick=10000, budget=50, samples=200, output='soak.csv', quiet=False):
+    """
+    Runs histo for hours of simulated acquisition and returns the list of
+    problems found (empty if it passed).
+
+    Parameters
+    ----------
+    hours=24 : float
+        Simulated duration.
+    gate=0.01 : float
+        Simulated gate period (s).
+    gates_per_tick=10000 : int
+        Gates delivered per timer tick.
+    budget=50 : float
+        Memory budget for the raw samples (MB).
+    samples=200 : int
+        Number of times to record the metrics.
+    output='soak.csv' : str
+        File receiving the metrics (None for no file).
+    quiet=False : bool
+        If True, don't print progress.
+    """
+    # Keep the test's files out of the way
+    directory = _tempfile.mkdtemp(prefix='PCIT1_soak_')
+    PCIT1.SPILL_PATH      = _os.path.join(directory, 'spill.arc')
+    PCIT1.CATALOG_PATH    = _os.path.join(directory, 'runs.sqlite')
+    PCIT1.CHECKPOINT_PATH = _os.path.join(directory, 'checkpoint.json')
+
+    fast_simulation.gates = gates_per_tick
+    self = PCIT1.histo(name='PCIT1-A soak', api=fast_simulation)
+    self.number_budget.set_value(budget)
+    self.number_gate  .set_value(gate)
+
+    # Connect, but drive the ticks ourselves
+    self.button_connect.set_checked(True)
+    self.timer.stop()
+    app = _pg.QtWidgets.QApplication.instance()
+
+    ticks   = max(int(hours*3600/gate/gates_per_tick), samples)
+    every   = max(ticks//samples, 1)
+    history = []
+    t_start = _time.time()
+
+    # Tick latency over the last round of tabs (latency depends on the tab)
+    recent = _collections.deque(maxlen=len(self._tab_list))
+
+    for tick in range(ticks):
+
+        # Visit every tab in turn, since only the visible one is drawn
+        self.tabs.set_current_tab(tick % len(self._tab_list))
+
+        t = _time.perf_counter()
+        self._timer_tick()
+        app.processEvents()
+        recent.append(_time.perf_counter()-t)
+
+        # Let the background plot scripts finish now and then
+        if tick % every == 0:
+            _time.sleep(0.06)
+            app.processEvents()
+            history.append(sample(self, max(recent)))
+            if not quiet: print('\r%5.1f%%  %.1f simulated hours in %.0f s   ' % (100*(tick+1)/ticks, (tick+1)*gates_per_tick*gate/3600, _time.time()-t_start), end='')
+
+    if not quiet: print()
+    self.button_connect.set_checked(False)
+
+    if output:
+        f = open(output, 'w')
+        f.write(','.join(METRICS)+'\n')
+        for row in history: f.write(','.join([repr(x) for x in row])+'\n')
+        f.close()
+
+    problems = find_growth(history)
+    if not quiet:
+        for p in problems: print('FAIL:', p)
+        if not problems:   print('PASS')
+    return problems
+
+
+if __name__ == '__main__':
+
+    parser = _argparse.ArgumentParser(description='Accelerated soak test of the PCIT1 histo GUI.')
+    parser.add_argument('--hours',   type=float, default=24,    help='Simulated acquisition time.')
+    parser.add_argument('--gate',    type=float, default=0.01,  help='Simulated gate period (s).')
+    parser.add_argument('--gates-per-tick', type=int, default=10000, help='Gates delivered per timer tick.')
+    parser.add_argument('--budget',  type=float, default=50,    help='Memory budget for raw samples (MB).')
+    parser.add_argument('--samples', type=int,   default=200,   help='Number of metric samples.')
+    parser.add_argument('--output',  default='soak.csv',        help='CSV file for the metrics.')
+    a = parser.parse_args()
+
+    _sys.exit(1 if run_soak(a.hours, a.gate, a.gates_per_tick, a.budget, a.samples, a.output) else 0)
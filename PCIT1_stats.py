@@ -0,0 +1,884 @@
+import threading as _threading
+import queue     as _queue
+import numpy     as _n
+
+
+class window_histogram():
+    """
+    Histogram and statistics of the counts that arrived in the last "window"
+    seconds, kept as a ring of per-slab bin counts. Each time the clock moves
+    into a new slab, the slab leaving the window is subtracted from the running
+    totals and the new one starts empty, so an update costs O(bins) per
+    elapsed slab rather than a re-histogram of the whole window.
+
+    The ring holds max_window seconds of slabs regardless of the current
+    window, so the window can be changed (up to max_window) without touching
+    the raw data. Bin i holds the count origin+i; negative counts (e.g.
+    after background subtraction) move the origin down.
+
+    Parameters
+    ----------
+    window=60 : number
+        Width of the window (s).
+    slab=1 : number
+        Time resolution of the window (s).
+    max_window=3600 : number
+        Largest window that can be selected later (s).
+    """
+    def __init__(self, window=60, slab=1, max_window=3600):
+
+        self.slab     = float(slab)
+        self.capacity = max(int(_n.ceil(max_window/self.slab)), 1)
+
+        # Ring of slabs: bin counts, sample count and moments of each slab,
+        # plus the absolute slab index stored in each slot (-1 = empty).
+        self._bins  = _n.zeros((self.capacity, 16), dtype=_n.int64)
+        self._n     = _n.zeros(self.capacity, dtype=_n.int64)
+        self._sum   = _n.zeros(self.capacity, dtype=_n.int64)
+        self._sum2  = _n.zeros(self.capacity, dtype=_n.int64)
+        self._index = _n.full (self.capacity, -1, dtype=_n.int64)
+
+        # Running totals over the window, and the count of bin 0
+        self.counts = _n.zeros(16, dtype=_n.int64)
+        self.origin = 0
+        self.n      = 0
+        self.sum    = 0
+        self.sum2   = 0
+
+        # Newest slab index seen so far
+        self.head = None
+
+        self.W = 1
+        self.set_window(window)
+
+    def _add_slab(self, slot, sign):
+        """
+        Adds (sign=1) or subtracts (sign=-1) the slab in the specified slot
+        to the window totals.
+        """
+        self.counts += sign*self._bins[slot]
+        self.n      += sign*int(self._n   [slot])
+        self.sum    += sign*int(self._sum [slot])
+        self.sum2   += sign*int(self._sum2[slot])
+
+    def _in_ring(self, k):
+        """
+        Returns the ring slot of absolute slab index k, or None if it is gone.
+        """
+        slot = k % self.capacity
+        if k >= 0 and self._index[slot] == k: return slot
+        return None
+
+    def _grow_bins(self, lo, hi):
+        """
+        Makes sure counts lo through hi have bins, at least doubling the
+        number of bins on whichever side needs more.
+        """
+        B     = len(self.counts)
+        left  = max(self.origin-lo, 0)
+        right = max(hi-self.origin+1-B, 0)
+        if left:  left  = max(left,  B)
+        if right: right = max(right, B)
+        if not left and not right: return
+
+        self._bins   = _n.pad(self._bins, ((0,0),(left,right)))
+        self.counts  = _n.pad(self.counts, (left,right))
+        self.origin -= left
+
+    def _claim(self, j):
+        """
+        Starts an empty slab for absolute slab index j (in the window but not
+        yet in the ring, e.g. early in a batch spanning many slabs, or after a
+        long gap) and returns its slot. Whatever the slot held is older than
+        the window, so it is not part of the totals.
+        """
+        slot = j % self.capacity
+        self._bins[slot] = 0
+        self._n   [slot] = self._sum[slot] = self._sum2[slot] = 0
+        self._index[slot] = j
+        return slot
+
+    def _advance(self, k):
+        """
+        Moves the head of the ring forward to absolute slab index k.
+        """
+        if self.head is None: self.head = k-1
+        if k <= self.head: return
+
+        # Long gap: nothing in the ring survives.
+        if k - self.head >= self.capacity:
+            self._bins [:] = 0
+            self._n    [:] = 0
+            self._sum  [:] = 0
+            self._sum2 [:] = 0
+            self._index[:] = -1
+            self.counts[:] = 0
+            self.n = self.sum = self.sum2 = 0
+
+        else:
+            for j in range(self.head+1, k+1):
+
+                # Retire the slab leaving the window
+                slot = self._in_ring(j-self.W)
+                if slot is not None: self._add_slab(slot, -1)
+
+                # Recycle the oldest slot in the ring for slab j
+                self._claim(j)
+
+        self.head = k
+
+    def append_data(self, t, counts):
+        """
+        Adds a batch of counts that arrived at time(s) t.
+
+        Parameters
+        ----------
+        t : number or 1D array
+            Time of the batch, or of each count (s).
+        counts : list or 1D array
+            Counts to add.
+        """
+        C = _n.asarray(counts, dtype=_n.int64)
+        if len(C) == 0: return self
+
+        k = _n.floor(_n.broadcast_to(_n.asarray(t, dtype=float), C.shape)/self.slab).astype(_n.int64)
+        self._advance(int(k.max()))
+        self._grow_bins(int(C.min()), int(C.max()))
+
+        # Drop anything too old to be in the window
+        keep = k > self.head-self.W
+        k, C = k[keep], C[keep]
+
+        for j in _n.unique(k):
+            c    = C[k==j]
+            slot = self._in_ring(int(j))
+            if slot is None: slot = self._claim(int(j))
+            h    = _n.bincount(c-self.origin, minlength=len(self.counts))
+
+            self._bins[slot] += h
+            self._n   [slot] += len(c)
+            self._sum [slot] += int(c.sum())
+            self._sum2[slot] += int((c*c).sum())
+
+            self.counts += h
+            self.n      += len(c)
+            self.sum    += int(c.sum())
+            self.sum2   += int((c*c).sum())
+
+        return self
+
+    def set_window(self, window):
+        """
+        Changes the window width (s), clipped to max_window. Slabs entering or
+        leaving the window are added / subtracted from the totals.
+        """
+        W = min(max(int(round(window/self.slab)), 1), self.capacity)
+        if self.head is not None:
+            for j in range(self.head-max(W, self.W)+1, self.head-min(W, self.W)+1):
+                slot = self._in_ring(j)
+                if slot is not None: self._add_slab(slot, 1 if W > self.W else -1)
+        self.W = W
+        return self
+
+    def get_window(self):
+        """
+        Returns the current window width (s).
+        """
+        return self.W*self.slab
+
+    def get_histogram(self):
+        """
+        Returns the bin counts and bin edges of the window histogram, trimmed
+        to the occupied range.
+        """
+        nz = _n.flatnonzero(self.counts)
+        if len(nz) == 0: return _n.zeros(0, dtype=_n.int64), _n.zeros(1)
+        return self.counts[nz[0]:nz[-1]+1], self.origin+_n.arange(nz[0], nz[-1]+2)-0.5
+
+    def get_mean(self):
+        """
+        Returns the mean count in the window.
+        """
+        return self.sum/self.n if self.n else _n.nan
+
+    def get_std(self):
+        """
+        Returns the standard deviation of the counts in the window.
+        """
+        if not self.n: return _n.nan
+        m = self.sum/self.n
+        return _n.sqrt(max(self.sum2/self.n - m*m, 0))
+
+
+class count_histogram():
+    """
+    Incrementally maintained histogram of integer counts. Bin i covers the
+    counts origin + i*width to origin + (i+1)*width - 1, and the bin array
+    grows in place (doubling, so amortized O(1) per sample) only when a
+    count lands outside the current range; existing bins are never
+    recomputed. The mean and standard deviation are exact regardless of the
+    bin width.
+
+    Parameters
+    ----------
+    width=1 : int
+        Number of consecutive counts per bin.
+    """
+    def __init__(self, width=1):
+
+        self.width  = max(int(width), 1)
+        self.origin = None # Lowest count covered by self._bins[0]
+        self._bins  = _n.zeros(0, dtype=_n.int64)
+
+        self.n    = 0
+        self.sum  = 0
+        self.sum2 = 0
+
+    def _integers(self, values):
+        """
+        Returns the values as an int64 array, raising a ValueError if they
+        are not whole numbers.
+        """
+        v = _n.asarray(values)
+        if v.dtype.kind in 'iub': return v.astype(_n.int64, copy=False).ravel()
+
+        i = _n.rint(v).astype(_n.int64).ravel()
+        if not _n.array_equal(i, v.ravel()): raise ValueError('count_histogram only accepts whole numbers.')
+        return i
+
+    def _fit(self, lo, hi):
+        """
+        Grows the bin array so that counts lo through hi have bins.
+        """
+        if self.origin is None:
+            self.origin = lo - lo % self.width
+            self._bins  = _n.zeros(max((hi-self.origin)//self.width+1, 16), dtype=_n.int64)
+            return
+
+        B     = len(self._bins)
+        left  = max(-((lo-self.origin)//self.width), 0)
+        right = max((hi-self.origin)//self.width+1-B, 0)
+        if not left and not right: return
+
+        # Grow by at least the current size on whichever side needs it.
+        if left:  left  = max(left,  B)
+        if right: right = max(right, B)
+        self._bins   = _n.pad(self._bins, (left, right))
+        self.origin -= left*self.width
+
+    def _add(self, i, sign):
+        """
+        Adds sign to the bins with indices i. Small batches (e.g. one row per
+        append_row()) are added in place to avoid touching every bin.
+        """
+        if len(i) < len(self._bins)//8: _n.add.at(self._bins, i, sign)
+        else:                          self._bins += sign*_n.bincount(i, minlength=len(self._bins))
+
+    def append_data(self, values):
+        """
+        Adds the supplied counts to the histogram.
+        """
+        v = self._integers(values)
+        if len(v) == 0: return self
+
+        self._fit(int(v.min()), int(v.max()))
+        self._add((v-self.origin)//self.width, 1)
+
+        self.n    += len(v)
+        self.sum  += int(v.sum())
+        self.sum2 += int((v*v).sum())
+        return self
+
+    def remove_data(self, values):
+        """
+        Removes the supplied counts (previously added) from the histogram.
+        """
+        v = self._integers(values)
+        if len(v) == 0: return self
+
+        self._add((v-self.origin)//self.width, -1)
+
+        self.n    -= len(v)
+        self.sum  -= int(v.sum())
+        self.sum2 -= int((v*v).sum())
+        return self
+
+    def set_width(self, width):
+        """
+        Rebins to a new bin width without the raw data. This is only possible
+        if the new width is a multiple of the current one; otherwise a
+        ValueError is raised and the histogram must be rebuilt from the data.
+        """
+        width = max(int(width), 1)
+        if width % self.width: raise ValueError('New bin width must be a multiple of '+str(self.width)+'.')
+        if width == self.width: return self
+
+        if self.origin is not None:
+
+            # Align the new origin and merge groups of m old bins.
+            m      = width//self.width
+            origin = self.origin - self.origin % width
+            b      = _n.pad(self._bins, ((self.origin-origin)//self.width, 0))
+            b      = _n.pad(b, (0, -len(b) % m))
+            self._bins  = b.reshape(-1, m).sum(axis=1)
+            self.origin = origin
+
+        self.width = width
+        return self
+
+    def get_histogram(self):
+        """
+        Returns the bin counts and bin edges, trimmed to the occupied range.
+        Edges sit half a count below each bin, so that with width=1 every bin
+        is centered on its count.
+        """
+        nz = _n.flatnonzero(self._bins)
+        if len(nz) == 0: return _n.zeros(0, dtype=_n.int64), _n.zeros(1)
+
+        edges = self.origin + _n.arange(nz[0], nz[-1]+2)*self.width - 0.5
+        return self._bins[nz[0]:nz[-1]+1], edges
+
+    def get_quantiles(self, q):
+        """
+        Returns the quantiles q (0 to 1, number or array) of the counts, from
+        the cumulative sum of the bins. With width=1 these are exact and
+        match numpy.quantile() of the raw counts; otherwise each count is
+        taken to sit at the center of its bin.
+        """
+        q = _n.asarray(q, dtype=float)
+        if not self.n: return _n.full(q.shape, _n.nan)
+
+        # Ranks (0-based) either side of each quantile, and the weight between them
+        r  = _n.clip(q, 0, 1)*(self.n-1)
+        r0 = _n.floor(r).astype(_n.int64)
+        r1 = _n.minimum(r0+1, self.n-1)
+
+        cumulative = _n.cumsum(self._bins)
+        v0 = _n.searchsorted(cumulative, r0, side='right')
+        v1 = _n.searchsorted(cumulative, r1, side='right')
+        v  = v0 + (r-r0)*(v1-v0)
+        return self.origin + v*self.width + 0.5*(self.width-1)
+
+    def get_state(self):
+        """
+        Returns a JSON-friendly dictionary from which set_state() can rebuild
+        this histogram (occupied bins only).
+        """
+        nz = _n.flatnonzero(self._bins)
+        a, b = (int(nz[0]), int(nz[-1])+1) if len(nz) else (0, 0)
+        return dict(width=self.width, n=self.n, sum=self.sum, sum2=self.sum2,
+                    origin=None if self.origin is None else self.origin+a*self.width,
+                    bins=self._bins[a:b].tolist())
+
+    def set_state(self, state):
+        """
+        Restores the histogram from a dictionary made by get_state().
+        """
+        self.width  = int(state['width'])
+        self.origin = state['origin']
+        self._bins  = _n.array(state['bins'], dtype=_n.int64)
+        self.n      = int(state['n'])
+        self.sum    = int(state['sum'])
+        self.sum2   = int(state['sum2'])
+        return self
+
+    def get_mean(self):
+        """
+        Returns the mean count.
+        """
+        return self.sum/self.n if self.n else _n.nan
+
+    def get_std(self):
+        """
+        Returns the standard deviation of the counts.
+        """
+        if not self.n: return _n.nan
+        m = self.sum/self.n
+        return _n.sqrt(max(self.sum2/self.n - m*m, 0))
+
+
+class quantile_sketch():
+    """
+    Streaming quantile estimate for values of unbounded range (e.g. interval
+    timer ticks), in memory proportional to the log of the range. Values are
+    counted in logarithmic buckets (a count_histogram of bucket indices), so
+    every quantile is within relative_accuracy of a value that actually
+    occurred. Use count_histogram.get_quantiles() for exact quantiles of
+    counts with a modest range.
+
+    Parameters
+    ----------
+    relative_accuracy=0.01 : float
+        Maximum relative error of the returned quantiles.
+    """
+    def __init__(self, relative_accuracy=0.01):
+
+        self.relative_accuracy = relative_accuracy
+        self._log_gamma = _n.log((1+relative_accuracy)/(1-relative_accuracy))
+
+        # Buckets of positive values and of -(negative values), and zeros
+        self._positive = count_histogram()
+        self._negative = count_histogram()
+        self.zeros = 0
+        self.n     = 0
+
+    def _index(self, v):
+        """
+        Returns the bucket index of each positive value.
+        """
+        return _n.ceil(_n.log(v)/self._log_gamma).astype(_n.int64)
+
+    def _value(self, i):
+        """
+        Returns the representative value of each bucket index.
+        """
+        return 2*_n.exp(i*self._log_gamma)/(_n.exp(self._log_gamma)+1)
+
+    def append_data(self, values):
+        """
+        Adds the supplied values.
+        """
+        v = _n.asarray(values, dtype=float).ravel()
+        v = v[_n.isfinite(v)]
+        if len(v) == 0: return self
+
+        self._positive.append_data(self._index(v[v > 0]))
+        self._negative.append_data(self._index(-v[v < 0]))
+        self.zeros += int(_n.count_nonzero(v == 0))
+        self.n     += len(v)
+        return self
+
+    def get_quantiles(self, q):
+        """
+        Returns the quantiles q (0 to 1, number or array) of the values.
+        """
+        q = _n.asarray(q, dtype=float)
+        if not self.n: return _n.full(q.shape, _n.nan)
+
+        # Rank of each quantile, counted from the most negative value
+        r = _n.rint(_n.clip(q, 0, 1)*(self.n-1))
+        N, Z = self._negative.n, self.zeros
+
+        result = _n.zeros(r.shape)
+        negative = r < N
+        positive = r >= N+Z
+
+        # Negative values are stored reversed (largest magnitude = lowest rank)
+        if _n.any(negative): result[negative] = -self._value(self._negative.get_quantiles(1-r[negative]/max(N-1, 1)))
+        if _n.any(positive): result[positive] =  self._value(self._positive.get_quantiles((r[positive]-N-Z)/max(self._positive.n-1, 1)))
+        return result
+
+
+class log_histogram():
+    """
+    Streaming histogram with logarithmically spaced bins, for inter-arrival
+    times spanning many decades. Each batch is binned with one vectorized
+    log10 and bincount; values below the first or above the last edge are
+    tallied separately.
+
+    Parameters
+    ----------
+    minimum=1 : number
+        Lower edge of the first bin.
+    maximum=1e9 : number
+        Upper edge of the last bin.
+    bins_per_decade=20 : int
+        Number of bins per factor of 10.
+    """
+    def __init__(self, minimum=1, maximum=1e9, bins_per_decade=20):
+
+        self.minimum         = float(minimum)
+        self.bins_per_decade = int(bins_per_decade)
+
+        B = int(_n.ceil(_n.log10(maximum/self.minimum)*self.bins_per_decade))
+        self.edges  = self.minimum*10**(_n.arange(B+1)/self.bins_per_decade)
+        self.counts = _n.zeros(B, dtype=_n.int64)
+
+        self.underflow = 0
+        self.overflow  = 0
+        self.n         = 0
+        self.sum       = 0.0
+
+    def append_data(self, values):
+        """
+        Adds the supplied values to the histogram.
+        """
+        v = _n.asarray(values, dtype=float).ravel()
+        if len(v) == 0: return self
+
+        B = len(self.counts)
+        with _n.errstate(divide='ignore', invalid='ignore'):
+            i = _n.floor(_n.log10(v/self.minimum)*self.bins_per_decade)
+
+        low  = ~(i >= 0) # includes nan from v <= 0
+        high = i >= B
+        self.underflow += int(low .sum())
+        self.overflow  += int(high.sum())
+        self.counts    += _n.bincount(i[~(low|high)].astype(_n.int64), minlength=B)
+
+        self.n   += len(v)
+        self.sum += float(v.sum())
+        return self
+
+    def get_density(self):
+        """
+        Returns the bin counts divided by the bin widths, which is what one
+        normally plots on log-log axes.
+        """
+        return self.counts/_n.diff(self.edges)
+
+    def get_mean(self):
+        """
+        Returns the mean of all values added.
+        """
+        return self.sum/self.n if self.n else _n.nan
+
+
+class photon_statistics():
+    """
+    Streaming photon statistics of a count series: the autocorrelation
+    between gates up to max_lag, and the Fano factor (variance / mean) of the
+    counts summed over windows of adjacent gates.
+
+    The lag products are accumulated block by block with an FFT of each new
+    block against itself plus the last max_lag samples, so each update costs
+    O((m + max_lag) log(m + max_lag)) for m new samples, never a pass over
+    the whole series. The Fano factor keeps running sums of the aggregated
+    counts for every window size, carrying incomplete windows to the next
+    block.
+
+    Parameters
+    ----------
+    max_lag=100 : int
+        Largest lag (in gates) of the autocorrelation.
+    windows=None : list of ints
+        Window sizes (in gates) for the Fano factor. Default is 1, 2, 4, ...
+        up to 65536.
+    """
+    def __init__(self, max_lag=100, windows=None):
+
+        self.max_lag = int(max_lag)
+        if windows is None: windows = 2**_n.arange(17)
+        self.windows = _n.array(windows, dtype=_n.int64)
+
+        # Autocorrelation: lag products, last max_lag samples, and the totals
+        self._products = _n.zeros(self.max_lag+1)
+        self._tail     = _n.zeros(0)
+        self.n         = 0
+        self.sum       = 0.0
+
+        # Fano factor: partially filled window, and sums of the complete ones
+        self._carry    = _n.zeros(len(self.windows))
+        self._carry_n  = _n.zeros(len(self.windows), dtype=_n.int64)
+        self._A_n      = _n.zeros(len(self.windows), dtype=_n.int64)
+        self._A_sum    = _n.zeros(len(self.windows))
+        self._A_sum2   = _n.zeros(len(self.windows))
+
+    def append_data(self, counts):
+        """
+        Adds new counts to the end of the series.
+        """
+        x = _n.asarray(counts, dtype=float).ravel()
+        m = len(x)
+        if m == 0: return self
+
+        self._append_lags(x)
+
+        # Aggregate into windows using the cumulative sum
+        c = _n.concatenate(([0.0], _n.cumsum(x)))
+        for i in range(len(self.windows)):
+            W     = int(self.windows[i])
+            first = W - int(self._carry_n[i])
+
+            # Not enough to finish the partial window
+            if m < first:
+                self._carry  [i] += c[m]
+                self._carry_n[i] += m
+                continue
+
+            k = (m-first)//W
+            A = _n.concatenate(([self._carry[i]+c[first]], c[first+W:first+W*k+1:W]-c[first:first+W*(k-1)+1:W]))
+
+            self._A_n   [i] += len(A)
+            self._A_sum [i] += A.sum()
+            self._A_sum2[i] += (A*A).sum()
+
+            self._carry  [i] = c[m]-c[first+W*k]
+            self._carry_n[i] = m-first-W*k
+
+        return self
+
+    def _append_lags(self, x):
+        """
+        Adds the lag products between the new samples x (float array) and
+        everything up to max_lag before them.
+        """
+        L = self.max_lag
+        z = _n.concatenate((self._tail, x))
+        w = _n.zeros(len(z))
+        w[len(self._tail):] = x
+        nfft = 1 << int(_n.ceil(_n.log2(len(z)+L+1)))
+        self._products += _n.fft.irfft(_n.fft.rfft(w, nfft)*_n.conj(_n.fft.rfft(z, nfft)), nfft)[:L+1]
+        self._tail = z[len(z)-L:]
+
+        self.n   += len(x)
+        self.sum += float(x.sum())
+
+    def with_max_lag(self, max_lag, history=None):
+        """
+        Returns a new photon_statistics with a different max_lag and the same
+        Fano factor sums. Lowering max_lag keeps the autocorrelation too.
+        Raising it needs the whole series again: the autocorrelation is
+        recomputed from history if given, or starts over otherwise.
+
+        Parameters
+        ----------
+        max_lag : int
+            New largest lag (in gates).
+        history=None : iterable of 1D arrays
+            Every count so far, in order, in chunks of any size.
+        """
+        new = photon_statistics(max_lag, self.windows)
+        for key in ['_carry', '_carry_n', '_A_n', '_A_sum', '_A_sum2']: setattr(new, key, getattr(self, key).copy())
+
+        if new.max_lag <= self.max_lag:
+            new._products = self._products[:new.max_lag+1].copy()
+            new._tail     = self._tail[len(self._tail)-new.max_lag:].copy()
+            new.n         = self.n
+            new.sum       = self.sum
+
+        elif history is not None:
+            for x in history: new._append_lags(_n.asarray(x, dtype=float).ravel())
+
+        return new
+
+    def get_autocorrelation(self):
+        """
+        Returns the lags (gates) and the normalized autocorrelation
+        (autocovariance / variance) at each lag.
+        """
+        k  = _n.arange(self.max_lag+1)
+        nk = self.n - k
+        if self.n < 2: return k, _n.full(len(k), _n.nan)
+
+        mean = self.sum/self.n
+        var  = self._products[0]/self.n - mean*mean
+        with _n.errstate(invalid='ignore', divide='ignore'):
+            return k, _n.where(nk > 0, (self._products/nk - mean*mean)/var, _n.nan)
+
+    def get_fano(self):
+        """
+        Returns the window sizes (gates) and the Fano factor of the counts
+        summed over each window size (nan until there are two windows).
+        """
+        with _n.errstate(invalid='ignore', divide='ignore'):
+            mean = self._A_sum/self._A_n
+            var  = self._A_sum2/self._A_n - mean*mean
+            return self.windows, _n.where(self._A_n > 1, var/mean, _n.nan)
+
+
+class allan_deviation():
+    """
+    Incrementally maintained overlapping Allan deviation of a count series,
+    at averaging times of m = 1, 2, 4, ... gates.
+
+    With X the cumulative sum of the counts, every new sample n completes
+    one term (X[n] - 2 X[n-m] + X[n-2m])^2 for each m, so only the last
+    2*max_m+1 cumulative sums are kept (in a buffer that is compacted only
+    when full) and an update costs O(levels) per sample, no matter how long
+    the run is.
+
+    Parameters
+    ----------
+    max_m=1048576 : int
+        Largest averaging time (gates). Rounded down to a power of 2.
+    """
+    def __init__(self, max_m=2**20):
+
+        self.m = 2**_n.arange(int(_n.log2(max(max_m, 1)))+1)
+
+        # Buffer whose first self._length entries are the most recent
+        # cumulative sums (starting with X[0] = 0); at least the last
+        # 2*max_m+1 are always kept.
+        self._history = 2*int(self.m[-1])+1
+        self._buffer  = _n.zeros(2*self._history)
+        self._length  = 1
+        self._terms = _n.zeros(len(self.m), dtype=_n.int64)
+        self._sums  = _n.zeros(len(self.m))
+
+        self.n   = 0
+        self.sum = 0.0
+
+    def append_data(self, counts):
+        """
+        Adds new counts to the end of the series.
+        """
+        x = _n.asarray(counts, dtype=float).ravel()
+        k = len(x)
+        if k == 0: return self
+
+        # Make room, dropping cumulative sums older than the history
+        H = self._history
+        if self._length + k > len(self._buffer):
+            keep = min(self._length, H)
+            self._buffer[:keep] = self._buffer[self._length-keep:self._length]
+            self._length = keep
+            if keep + k > len(self._buffer):
+                self._buffer = _n.concatenate((self._buffer[:keep], _n.zeros(k+H)))
+
+        # Append the new cumulative sums; X[i] is the sum of the first
+        # (first+i) samples.
+        L = self._length
+        self._buffer[L:L+k] = self._buffer[L-1] + _n.cumsum(x)
+        self._length = L+k
+        X     = self._buffer[:self._length]
+        first = self.n + 1 - L
+
+        for i in range(len(self.m)):
+            m = int(self.m[i])
+
+            # New samples whose index (in the full series) is at least 2m
+            a = max(self.n+1, 2*m) - first
+            b = len(X)
+            if a >= b: continue
+
+            D = X[a:b] - 2*X[a-m:b-m] + X[a-2*m:b-2*m]
+            self._terms[i] += len(D)
+            self._sums [i] += float((D*D).sum())
+
+        self.n   += k
+        self.sum += float(x.sum())
+        return self
+
+    def get_allan_deviation(self, fractional=False):
+        """
+        Returns the averaging times m (gates) and the overlapping Allan
+        deviation of the mean counts per gate, for every m with at least one
+        term.
+
+        Parameters
+        ----------
+        fractional=False : bool
+            If True, divide by the mean count to get the fractional deviation.
+        """
+        ok = self._terms > 0
+        m  = self.m[ok]
+        adev = _n.sqrt(self._sums[ok]/(2*self._terms[ok]*m*m))
+        if fractional and self.n: adev = adev/(self.sum/self.n)
+        return m, adev
+
+
+class analysis_worker():
+    """
+    Runs an analyzer's append_data() (e.g. photon_statistics) in a
+    background thread, so the GUI only pays for queuing the new data.
+    Batches that pile up while the worker is busy are merged into one call.
+    Use call() to read results while holding the analyzer's lock, and
+    replace_analyzer() for changes that need the worker to do a lot of work
+    (e.g. going through the whole run again).
+
+    Parameters
+    ----------
+    analyzer
+        Object with an append_data(values) method.
+    """
+    def __init__(self, analyzer):
+
+        self.analyzer = analyzer
+        self._queue   = _queue.Queue()
+        self._lock    = _threading.Lock()
+
+        # Incremented after each update, so readers can tell if anything changed
+        self.version  = 0
+
+        # Incremented by set_analyzer(); data queued for an older analyzer is dropped
+        self._generation = 0
+
+        self._thread  = _threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def append_data(self, values):
+        """
+        Queues a copy of the values for the analyzer.
+        """
+        if len(values): self._queue.put((self._generation, _n.array(values)))
+        return self
+
+    def _run(self):
+        """
+        Worker loop (runs in the background thread).
+        """
+        while True:
+            x = self._queue.get()
+            if x is None: return
+
+            # Take everything else that is waiting too
+            batches = [x]
+            while not self._queue.empty():
+                x = self._queue.get()
+                if x is None:
+                    self._queue.put(None)
+                    break
+                batches.append(x)
+
+            # Runs of data go in one call; replacements in order between them
+            while len(batches):
+                x = []
+                while len(batches) and not callable(batches[0][1]): x.append(batches.pop(0))
+                with self._lock:
+                    x = [b for g, b in x if g == self._generation]
+                    if len(x):
+                        self.analyzer.append_data(_n.concatenate(x))
+                        self.version += 1
+                if len(batches): self._replace(*batches.pop(0))
+
+    def _replace(self, generation, f):
+        """
+        Builds and swaps in the analyzer for replace_analyzer() (runs in the
+        background thread, which is the only one changing the analyzer, so
+        f can read it without the lock).
+        """
+        if generation != self._generation: return
+        try:    analyzer = f(self.analyzer)
+        except Exception as e:
+            print('analysis_worker:', e)
+            return
+
+        with self._lock:
+            if generation != self._generation: return
+            self.analyzer = analyzer
+            self.version += 1
+
+    def call(self, f, *args, **kwargs):
+        """
+        Returns f(*args, **kwargs), called while the analyzer is not being updated.
+        """
+        with self._lock: return f(*args, **kwargs)
+
+    def replace_analyzer(self, f):
+        """
+        Queues f(analyzer) to be called in the background thread once the
+        data queued so far has been added. It returns the new analyzer, which
+        gets all data queued after this call. Results from the current
+        analyzer stay readable while f runs.
+        """
+        self._queue.put((self._generation, f))
+        return self
+
+    def set_analyzer(self, analyzer):
+        """
+        Swaps in a new analyzer (e.g. with different settings). Data queued
+        before this call is not given to the new analyzer.
+        """
+        with self._lock:
+            self.analyzer     = analyzer
+            self._generation += 1
+            self.version     += 1
+        return self
+
+    def stop(self):
+        """
+        Finishes the queued work and stops the thread.
+        """
+        self._queue.put(None)
+        self._thread.join()
@@ -0,0 +1,888 @@
+import os      as _os
+import json    as _json
+import struct  as _struct
+import zlib    as _zlib
+import lzma    as _lzma
+import time    as _time
+import atexit  as _atexit
+import threading as _threading
+import itertools as _itertools
+import numpy   as _n
+
+from PCIT1_stats import count_histogram
+
+
+class acquisition_store():
+    """
+    Append-only column store for acquired samples, with compact dtypes:
+
+        'Sample'     : int64   running sample index
+        'Time (s)'   : float64 time since the start of the run
+        'Number'     : uint16  iteration number of the counter
+        'Counts (C)' : uint16  number of counts
+
+    Integer columns are promoted (e.g. to uint32) the first time a value
+    does not fit. Columns are preallocated and grown by doubling, so a batch
+    costs O(batch) amortized. Indexing with a key returns a view of the
+    rows held in memory (no copy), which is how several databoxes share one
+    store; see update_databox().
+
+    With a memory budget, the oldest rows are moved ("spilled") to a
+    compressed archive at spill_path whenever the rows in memory would
+    exceed it, keeping the newest half of the budget in memory. self.first
+    is then the index of the first row still in memory, and read_rows() /
+    read_time() page older rows back in from the archive on demand.
+
+    The public methods hold a lock, so scripts and workers in other threads
+    can read (e.g. read_rows()) while the GUI thread appends, spills and
+    reallocates.
+
+    Parameters
+    ----------
+    capacity=1024 : int
+        Initial number of rows to allocate.
+    budget=None : int
+        Memory budget (bytes) for the rows held in memory. None for no limit.
+    spill_path='acquisition_spill.arc' : str
+        Archive receiving the spilled rows. It is deleted by clear().
+    """
+    def __init__(self, capacity=1024, budget=None, spill_path='acquisition_spill.arc'):
+
+        self._dtypes = dict([('Sample',     _n.int64  ),
+                             ('Time (s)',   _n.float64),
+                             ('Number',     _n.uint16 ),
+                             ('Counts (C)', _n.uint16 )])
+        self.budget     = budget
+        self.spill_path = spill_path
+        self._spill     = None
+        self._lock      = _threading.RLock()
+        self.clear(capacity)
+
+    def __len__(self): return self.n
+
+    def __getitem__(self, key):
+        with self._lock: return self._columns[key][:self.n-self.first]
+
+    def __repr__(self): return '<acquisition_store: '+str(self.n)+' rows ('+str(self.first)+' spilled), '+str(self.nbytes())+' bytes>'
+
+    def keys(self):
+        """
+        Returns the list of column keys.
+        """
+        return list(self._columns.keys())
+
+    def clear(self, capacity=1024):
+        """
+        Removes all rows (including any spilled to disk).
+        """
+        with self._lock:
+            self._columns = dict()
+            for key in self._dtypes: self._columns[key] = _n.zeros(capacity, dtype=self._dtypes[key])
+            self.n     = 0
+            self.first = 0
+
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
+                if _os.path.exists(self.spill_path): _os.remove(self.spill_path)
+            self._spill_reader = None
+            return self
+
+    def nbytes(self):
+        """
+        Returns the number of bytes allocated for all columns.
+        """
+        return sum([c.nbytes for c in self._columns.values()])
+
+    def set_budget(self, budget):
+        """
+        Sets the memory budget (bytes, or None for no limit), spilling right
+        away and releasing the memory beyond the budget if needed.
+        """
+        with self._lock:
+            self.budget = int(budget) if budget else None
+            self._spill_rows(0)
+
+            # Shrink the allocation to the budget
+            if self.budget and self.nbytes() > self.budget: self._reallocate(self.budget//self._row_bytes())
+            return self
+
+    def _row_bytes(self):
+        """
+        Returns the number of bytes per row.
+        """
+        return sum([c.itemsize for c in self._columns.values()])
+
+    def _spill_rows(self, m):
+        """
+        Makes room for m more rows within the budget by writing the oldest
+        rows to the spill archive.
+        """
+        if not self.budget: return
+        kept = self.n-self.first
+        if (kept+m)*self._row_bytes() <= self.budget: return
+
+        # Keep the newest half of the budget (minus the incoming rows)
+        keep = max(self.budget//(2*self._row_bytes()) - m, 0)
+        k    = kept-min(keep, kept)
+        if k == 0: return
+
+        if self._spill is None:
+            keys = self.keys()
+            self._spill = archive_writer(self.spill_path, keys,
+                [_n.int64 if self._columns[key].dtype.kind in 'iu' else self._columns[key].dtype for key in keys],
+                time_key='Time (s)')
+
+        self._spill.append_data([self._columns[key][:k] for key in self._spill.ckeys]).flush()
+        self._spill_reader = None
+
+        # New arrays no bigger than the budget
+        self._reallocate(min(len(self._columns['Sample']), self.budget//self._row_bytes()), k)
+        self.first += k
+
+    def _reallocate(self, size, k=0):
+        """
+        Moves the rows in memory, minus the first k, into new arrays of at
+        least size rows. New arrays (rather than resizing in place) keep the
+        views handed out earlier (e.g. to plot scripts) intact, and let the
+        old memory go once nobody uses them.
+        """
+        kept = self.n-self.first
+        size = max(int(size), kept-k, 1)
+        for key in self._columns:
+            c = _n.zeros(size, dtype=self._columns[key].dtype)
+            c[:kept-k] = self._columns[key][k:kept]
+            self._columns[key] = c
+
+    def _get_spill_reader(self):
+        """
+        Returns an archive_reader for the spilled rows (or None).
+        """
+        if self._spill is None: return None
+        if self._spill_reader is None: self._spill_reader = archive_reader(self.spill_path)
+        return self._spill_reader
+
+    def _fit(self, key, values):
+        """
+        Promotes integer column key to a wider dtype if values do not fit.
+        """
+        c = self._columns[key]
+        if c.dtype.kind not in 'iu' or len(values) == 0: return
+
+        lo, hi = int(values.min()), int(values.max())
+        info = _n.iinfo(c.dtype)
+        if info.min <= lo and hi <= info.max: return
+
+        for dtype in [_n.uint16, _n.uint32, _n.uint64] if lo >= 0 else [_n.int32, _n.int64]:
+            if _n.iinfo(dtype).min <= lo and hi <= _n.iinfo(dtype).max and _n.iinfo(dtype).bits > info.bits: break
+        self._columns[key] = c.astype(dtype)
+
+    def append_data(self, t, iterations, counts):
+        """
+        Appends a batch of samples.
+
+        Parameters
+        ----------
+        t : number or 1D array
+            Time of the batch, or of each sample (s).
+        iterations : list or 1D array
+            Iteration numbers of the counter.
+        counts : list or 1D array
+            Counts at each respective iteration.
+        """
+        with self._lock:
+            C = _n.asarray(counts)
+            N = _n.asarray(iterations)
+            m = len(C)
+            if m == 0: return self
+
+            self._fit('Number',     N)
+            self._fit('Counts (C)', C)
+            self._spill_rows(m)
+
+            # Grow by doubling (but not past the budget)
+            kept = self.n-self.first
+            if kept + m > len(self._columns['Sample']):
+                size = 2*len(self._columns['Sample'])
+                if self.budget: size = min(size, self.budget//self._row_bytes())
+                self._reallocate(max(size, kept+m))
+
+            a, b = kept, kept+m
+            self._columns['Sample']    [a:b] = _n.arange(self.n, self.n+m)
+            self._columns['Time (s)']  [a:b] = t
+            self._columns['Number']    [a:b] = N
+            self._columns['Counts (C)'][a:b] = C
+            self.n += m
+
+            return self
+
+    def read_rows(self, keys, start=0, stop=None):
+        """
+        Returns a list of arrays holding rows start through stop-1 of the
+        specified columns, reading spilled rows back from disk if needed.
+        """
+        with self._lock:
+            if stop is None or stop > self.n: stop = self.n
+            start = max(start, 0)
+            stop  = max(stop, start)
+
+            # Part in memory
+            memory = [self._columns[key][max(start,self.first)-self.first:max(stop,self.first)-self.first] for key in keys]
+            if start >= self.first: return memory
+
+            # Part on disk
+            r = self._get_spill_reader()
+            disk = r.read_rows(start, min(stop, self.first))
+            return [_n.concatenate((disk[r.ckeys.index(key)], memory[n])) for n, key in enumerate(keys)]
+
+    def read_time(self, keys, t0=None, t1=None, max_rows=None):
+        """
+        Returns a list of arrays holding the specified columns for the rows
+        with t0 <= time <= t1, reading spilled rows back from disk if needed.
+        If max_rows is given and there are more rows than that, every k'th
+        row is returned instead, with k chosen to stay within max_rows.
+        """
+        with self._lock:
+            if t0 is None: t0 = -_n.inf
+            if t1 is None: t1 =  _n.inf
+
+            t    = self['Time (s)']
+            keep = _n.flatnonzero((t >= t0) & (t <= t1))
+
+            r = self._get_spill_reader()
+            if r is None or len(t) and t[0] < t0: r = None
+
+            # Decimate long ranges
+            step = 1
+            if max_rows:
+                rows = len(keep) + (r.count_time(t0, t1) if r is not None else 0)
+                step = max(-(-rows//max_rows), 1)
+
+            if r is None: return [self[key][keep[::step]] for key in keys]
+
+            disk = r.read_time(t0, t1, step)
+            return [_n.concatenate((disk[r.ckeys.index(key)], self[key][keep[::step]])) for key in keys]
+
+    def update_databox(self, databox, keys, history=0):
+        """
+        Points the databox's columns at views of the specified store columns
+        (no data is copied). Call this after each append_data(). Only rows
+        held in memory are shown. The views keep the store's compact dtypes;
+        DataboxPlot scripts see them as float64 (see _databox_snapshot).
+
+        Parameters
+        ----------
+        databox : spinmob databox
+            Databox (or DataboxPlot) whose columns should show the data.
+        keys : list of str
+            Store column keys to show, in order. These become the databox ckeys.
+        history=0 : int
+            If nonzero, only show the last history rows.
+
+        Returns
+        -------
+        start : int
+            Index of the first store row shown.
+        """
+        with self._lock:
+            start = max(self.n-history, self.first) if history else self.first
+
+            if list(databox.ckeys) != list(keys):
+                databox.clear_columns()
+                databox.ckeys = list(keys)
+
+            for key in keys: databox.columns[key] = self._columns[key][start-self.first:self.n-self.first]
+            return start
+
+
+# Compressed chunked archives
+#
+# File layout:
+#   b'PCIT1ARC', uint32 length, JSON description (ckeys, dtypes, codec, headers)
+#   then any number of chunks, each
+#   b'CHNK', uint32 rows, int64 first & last row, float64 first & last time,
+#   uint32 compressed length of each column, compressed columns.
+#
+# Integer columns are delta encoded and every column is byte-shuffled before
+# compression, which makes slowly varying count series very compressible.
+# Chunks can be appended to an existing archive, and the index is rebuilt by
+# skipping from chunk header to chunk header, so a partially written final
+# chunk (e.g. after a crash) is simply ignored.
+
+_ARCHIVE_MAGIC = b'PCIT1ARC'
+_CHUNK_MAGIC   = b'CHNK'
+_CHUNK_HEADER  = _struct.Struct('<4sIqqdd')
+
+def _codec(name):
+    """
+    Returns the (compress, decompress) functions for the codec name.
+    """
+    if name == 'zlib': return _zlib.compress, _zlib.decompress
+    if name == 'lzma': return _lzma.compress, _lzma.decompress
+    raise Exception('Unknown archive codec "'+str(name)+'". Use "zlib" or "lzma".')
+
+def _encode_column(a, delta):
+    """
+    Returns the delta-encoded (optional), byte-shuffled bytes of 1D array a.
+    """
+    a = _n.ascontiguousarray(a, dtype=a.dtype.newbyteorder('<'))
+    if delta and len(a): a = _n.diff(a, prepend=a.dtype.type(0))
+    return a.view(_n.uint8).reshape(len(a), a.dtype.itemsize).T.tobytes()
+
+def _decode_column(b, dtype, rows, delta):
+    """
+    Inverse of _encode_column().
+    """
+    dtype = _n.dtype(dtype)
+    a = _n.frombuffer(b, dtype=_n.uint8).reshape(dtype.itemsize, rows).T.copy().view(dtype).ravel()
+    if delta: a = _n.cumsum(a, dtype=dtype)
+    return a
+
+def is_archive(path):
+    """
+    Returns True if the file at path is a chunked run archive.
+    """
+    try:
+        f = open(path, 'rb')
+        magic = f.read(len(_ARCHIVE_MAGIC))
+        f.close()
+    except Exception: return False
+    return magic == _ARCHIVE_MAGIC
+
+
+class archive_writer():
+    """
+    Writes acquisition columns to a compressed chunked archive (see
+    archive_reader). Rows are buffered and written chunk_size at a time;
+    call flush() or close() to write a partial chunk.
+
+    Parameters
+    ----------
+    path : str
+        Path of the archive. If it already exists and append=True, new chunks
+        are added to the end (the column keys and dtypes must match).
+    ckeys : list of str
+        Column keys.
+    dtypes : list of dtypes
+        Column dtypes, e.g. [numpy.float64, numpy.uint16].
+    headers={} : dict
+        Header information to store with the archive (must be JSON-friendly;
+        anything else is stored as a string).
+    chunk_size=65536 : int
+        Number of rows per chunk.
+    codec='zlib' : str
+        Compression, either 'zlib' or 'lzma'.
+    time_key=None : str
+        Column used to index chunks by time. Defaults to the first ckey
+        starting with 'Time', if any.
+    append=False : bool
+        Whether to add to an existing archive rather than overwrite it.
+    """
+    def __init__(self, path, ckeys, dtypes, headers={}, chunk_size=65536, codec='zlib', time_key=None, append=False):
+
+        self.path       = path
+        self.ckeys      = list(ckeys)
+        self.dtypes     = [_n.dtype(d).newbyteorder('<') for d in dtypes]
+        self.chunk_size = int(chunk_size)
+        self._compress  = _codec(codec)[0]
+
+        if time_key is None:
+            for k in self.ckeys:
+                if k.startswith('Time'): time_key = k; break
+        self.time_key = time_key
+
+        # Where the rows wait for a full chunk
+        self._buffer = [[] for k in self.ckeys]
+        self._buffered = 0
+
+        if append and _os.path.exists(path):
+            r = archive_reader(path)
+            if r.ckeys != self.ckeys or [d.str for d in r.dtypes] != [d.str for d in self.dtypes]:
+                raise Exception('Cannot append to '+path+': columns do not match.')
+
+            # Drop any partial chunk at the end
+            self.rows = r.rows
+            self._file = open(path, 'r+b')
+            self._file.truncate(r._end)
+            self._file.seek(r._end)
+
+        else:
+            description = dict(version=1, codec=codec, ckeys=self.ckeys,
+                               dtypes=[d.str for d in self.dtypes],
+                               delta=[d.kind in 'iu' for d in self.dtypes],
+                               time_key=time_key, headers=headers)
+            j = _json.dumps(description, default=str).encode()
+
+            self.rows = 0
+            self._file = open(path, 'wb')
+            self._file.write(_ARCHIVE_MAGIC + _struct.pack('<I', len(j)) + j)
+
+        self._delta = [d.kind in 'iu' for d in self.dtypes]
+
+    def append_data(self, columns):
+        """
+        Adds rows to the archive.
+
+        Parameters
+        ----------
+        columns : list of 1D arrays
+            One equal-length array per ckey.
+        """
+        if len(columns) != len(self.ckeys): raise Exception('Expected '+str(len(self.ckeys))+' columns.')
+
+        for n in range(len(columns)):
+            self._buffer[n].append(_n.asarray(columns[n], dtype=self.dtypes[n]))
+        self._buffered += len(columns[0])
+
+        # Write all the full chunks
+        if self._buffered >= self.chunk_size:
+            data = [_n.concatenate(b) for b in self._buffer]
+            m = 0
+            while self._buffered - m >= self.chunk_size:
+                self._write_chunk([c[m:m+self.chunk_size] for c in data])
+                m += self.chunk_size
+            self._buffer = [[c[m:]] for c in data]
+            self._buffered -= m
+
+        return self
+
+    def _write_chunk(self, columns):
+        """
+        Compresses and writes one chunk.
+        """
+        rows = len(columns[0])
+        if rows == 0: return
+
+        if self.time_key in self.ckeys:
+            t = columns[self.ckeys.index(self.time_key)]
+            t0, t1 = float(t[0]), float(t[-1])
+        else: t0 = t1 = _n.nan
+
+        payload = [self._compress(_encode_column(columns[n], self._delta[n])) for n in range(len(columns))]
+
+        self._file.write(_CHUNK_HEADER.pack(_CHUNK_MAGIC, rows, self.rows, self.rows+rows-1, t0, t1))
+        self._file.write(_struct.pack('<'+str(len(payload))+'I', *[len(p) for p in payload]))
+        for p in payload: self._file.write(p)
+
+        self.rows += rows
+
+    def flush(self):
+        """
+        Writes any buffered rows as a (possibly short) chunk.
+        """
+        if self._buffered:
+            self._write_chunk([_n.concatenate(b) for b in self._buffer])
+            self._buffer = [[] for k in self.ckeys]
+            self._buffered = 0
+        self._file.flush()
+        return self
+
+    def close(self):
+        """
+        Flushes and closes the file.
+        """
+        if self._file is None: return
+        self.flush()
+        self._file.close()
+        self._file = None
+
+
+class archive_reader():
+    """
+    Random access to a compressed chunked archive written by archive_writer.
+    Opening the archive only reads the chunk headers; reading a range of
+    rows or times decompresses only the chunks that overlap it.
+
+    Parameters
+    ----------
+    path : str
+        Path of the archive.
+
+    Attributes
+    ----------
+    ckeys, dtypes, headers, rows
+        Column keys, column dtypes, stored header and total number of rows.
+    index : dict of arrays
+        Per-chunk 'offset', 'rows', 'first', 'last', 't0' and 't1'.
+    """
+    def __init__(self, path):
+
+        self.path = path
+        f = open(path, 'rb')
+
+        if f.read(len(_ARCHIVE_MAGIC)) != _ARCHIVE_MAGIC:
+            f.close()
+            raise Exception(path+' is not a run archive.')
+
+        description = _json.loads(f.read(_struct.unpack('<I', f.read(4))[0]).decode())
+        self.ckeys    = description['ckeys']
+        self.dtypes   = [_n.dtype(d) for d in description['dtypes']]
+        self.headers  = description['headers']
+        self.time_key = description['time_key']
+        self._delta   = description['delta']
+        self._decompress = _codec(description['codec'])[1]
+
+        # Scan the chunk headers
+        index = dict(offset=[], rows=[], first=[], last=[], t0=[], t1=[])
+        size  = _os.path.getsize(path)
+        pos   = f.tell()
+        lengths_size = 4*len(self.ckeys)
+        while pos + _CHUNK_HEADER.size + lengths_size <= size:
+            f.seek(pos)
+            magic, rows, first, last, t0, t1 = _CHUNK_HEADER.unpack(f.read(_CHUNK_HEADER.size))
+            if magic != _CHUNK_MAGIC: break
+
+            lengths = _struct.unpack('<'+str(len(self.ckeys))+'I', f.read(lengths_size))
+            end = pos + _CHUNK_HEADER.size + lengths_size + sum(lengths)
+            if end > size: break
+
+            for k, v in zip(index, [pos, rows, first, last, t0, t1]): index[k].append(v)
+            pos = end
+        f.close()
+
+        self._end  = pos
+        self.index = dict()
+        for k in index: self.index[k] = _n.array(index[k], dtype=float if k in ['t0','t1'] else _n.int64)
+        self.rows  = int(self.index['rows'].sum())
+
+    def __len__(self): return self.rows
+
+    def _read_chunks(self, i0, i1):
+        """
+        Decompresses chunks i0 through i1-1 and returns the concatenated columns.
+        """
+        columns = [[] for k in self.ckeys]
+        f = open(self.path, 'rb')
+        for i in range(i0, i1):
+            f.seek(self.index['offset'][i] + _CHUNK_HEADER.size)
+            rows    = int(self.index['rows'][i])
+            lengths = _struct.unpack('<'+str(len(self.ckeys))+'I', f.read(4*len(self.ckeys)))
+            for n in range(len(self.ckeys)):
+                columns[n].append(_decode_column(self._decompress(f.read(lengths[n])), self.dtypes[n], rows, self._delta[n]))
+        f.close()
+
+        for n in range(len(columns)):
+            columns[n] = _n.concatenate(columns[n]) if len(columns[n]) else _n.zeros(0, dtype=self.dtypes[n])
+        return columns
+
+    def read_rows(self, start=0, stop=None):
+        """
+        Returns a list of column arrays for rows start through stop-1.
+        """
+        if stop is None or stop > self.rows: stop = self.rows
+        start = max(start, 0)
+        if stop <= start: return [_n.zeros(0, dtype=d) for d in self.dtypes]
+
+        i0 = int(_n.searchsorted(self.index['last'],  start, side='left'))
+        i1 = int(_n.searchsorted(self.index['first'], stop,  side='left'))
+
+        columns = self._read_chunks(i0, i1)
+        a = start - self.index['first'][i0]
+        return [c[a:a+stop-start] for c in columns]
+
+    def count_time(self, t0=None, t1=None):
+        """
+        Returns (an upper limit on) the number of rows with t0 <= time <= t1,
+        from the index alone.
+        """
+        if t0 is None: t0 = -_n.inf
+        if t1 is None: t1 =  _n.inf
+        i0 = int(_n.searchsorted(self.index['t1'], t0, side='left'))
+        i1 = int(_n.searchsorted(self.index['t0'], t1, side='right'))
+        return int(self.index['rows'][i0:max(i0, i1)].sum())
+
+    def read_time(self, t0=None, t1=None, step=1):
+        """
+        Returns a list of column arrays for the rows with t0 <= time <= t1,
+        assuming the time column never decreases. With step > 1, only every
+        step'th of these rows is returned, reading one chunk at a time, so
+        long ranges can be previewed without loading them whole.
+        """
+        if self.time_key is None: raise Exception(self.path+' has no time column.')
+        if t0 is None: t0 = -_n.inf
+        if t1 is None: t1 =  _n.inf
+
+        i0 = int(_n.searchsorted(self.index['t1'], t0, side='left'))
+        i1 = int(_n.searchsorted(self.index['t0'], t1, side='right'))
+
+        result = [[] for k in self.ckeys]
+        skip   = 0 # Rows to skip at the start of the next chunk
+        for i in range(i0, max(i0, i1)) if step > 1 else [None]:
+            columns = self._read_chunks(i, i+1) if step > 1 else self._read_chunks(i0, max(i0, i1))
+
+            t = columns[self.ckeys.index(self.time_key)]
+            a = int(_n.searchsorted(t, t0, side='left'))
+            b = int(_n.searchsorted(t, t1, side='right'))
+            for n in range(len(columns)): result[n].append(columns[n][a+skip:b:step])
+            if step > 1: skip = (skip-(b-a)) % step
+
+        return [_n.concatenate(result[n]) if len(result[n]) else _n.zeros(0, dtype=self.dtypes[n]) for n in range(len(result))]
+
+
+def json_safe(x):
+    """
+    Converts numpy values, nan / inf (to None) and anything else json can't
+    store (to its repr) into plain python, for headers, results and
+    statistics written as JSON.
+    """
+    if isinstance(x, _n.ndarray): return [json_safe(y) for y in x.tolist()]
+    if isinstance(x, _n.generic): x = x.item()
+    if isinstance(x, float) and not _n.isfinite(x): return None
+    if isinstance(x, (list, tuple)): return [json_safe(y) for y in x]
+    if isinstance(x, dict): return dict([(str(k), json_safe(x[k])) for k in x])
+    if x is None or isinstance(x, (bool, int, float, str)): return x
+    return repr(x)
+
+def _is_number(x):
+    """
+    Returns True if the string x is a number (or '_', spinmob's missing value).
+    """
+    if x.strip() == '_': return True
+    try:    complex(x.strip().replace('i','j'))
+    except ValueError: return False
+    return True
+
+def _split(line, delimiter):
+    """
+    Splits a line like spinmob does, dropping a trailing empty element.
+    """
+    s = line.strip().split(delimiter)
+    if len(s) and s[-1].strip() == '': s.pop(-1)
+    return s
+
+def _read_text_run(path, chunk_size):
+    """
+    Reads the header of a spinmob text data file line by line, and returns
+    (headers, ckeys, chunks) like read_run(), with the data lines parsed
+    chunk_size at a time. Follows spinmob's rules: the data starts at the
+    first line whose elements are all numbers, and the column keys are the
+    line above it if it has enough elements. Tabs are tried as the delimiter
+    before other whitespace, so keys like 'Counts (C)' survive.
+    """
+    f = open(path, 'r', errors='ignore')
+
+    # Header lines, until the first line of pure data
+    lines = []
+    delimiter = None
+    for line in f:
+        if line.strip():
+            for delimiter in ['\t', ',', ';', None]:
+                s = _split(line, delimiter)
+                if len(s) and all([_is_number(x) for x in s]): break
+            else: s = None
+            if s is not None: break
+        lines.append(line)
+    else:
+        f.close()
+        raise Exception('Could not find a line of pure data in '+path+'.')
+    first = line
+
+    # Header: key, then the value (evaluated if possible, like spinmob)
+    headers = dict()
+    for line in lines:
+        s = _split(line, delimiter)
+        if not len(s): continue
+        remainder = (' ' if delimiter is None else delimiter).join(s[1:])
+        try:    headers[s[0]] = eval(remainder, dict(_n.__dict__, _n=_n, np=_n, numpy=_n))
+        except: headers[s[0]] = remainder
+
+    # Column keys
+    columns = len(_split(first, delimiter))
+    ckeys   = _split(lines[-1], delimiter) if len(lines) else []
+    if len(ckeys) >= columns: ckeys = ckeys[:columns]
+    else:                     ckeys = ['c'+str(m) for m in range(columns)]
+
+    # Make them unique
+    rest, ckeys = ckeys, []
+    while len(rest):
+        ckey = rest.pop(0)
+        if ckey in rest or ckey in ckeys:
+            n = 0
+            while ckey+'_'+str(n) in rest or ckey+'_'+str(n) in ckeys: n += 1
+            ckey = ckey+'_'+str(n)
+        ckeys.append(ckey)
+
+    def chunks():
+        try:
+            rows = _itertools.chain([first], f)
+            while True:
+                block = [x for x in _itertools.islice(rows, chunk_size) if x.strip()]
+                if not block: break
+                z = _n.genfromtxt(block, delimiter=delimiter, missing_values=['_'], filling_values=_n.nan, dtype=float, ndmin=2)
+                yield [z[:,m] for m in range(columns)]
+        finally: f.close()
+
+    return headers, ckeys, chunks()
+
+def _is_text_run(path):
+    """
+    Returns True if path is a data file that isn't SPINMOB_BINARY.
+    """
+    f = open(path, 'rb')
+    binary = f.read(14) == b'SPINMOB_BINARY'
+    f.close()
+    return not binary
+
+def read_run(path, chunk_size=65536):
+    """
+    Opens a saved run for reading in chunks, so runs larger than memory can
+    be processed. Archives are read one stored chunk at a time and text
+    files chunk_size lines at a time; SPINMOB_BINARY files are loaded with
+    spinmob.data.load() and then handed out in chunks.
+
+    Parameters
+    ----------
+    path : str
+        Path of the run (archive or spinmob data file).
+    chunk_size=65536 : int
+        Rows per chunk for files other than archives.
+
+    Returns
+    -------
+    headers : dict
+        Header of the run.
+    ckeys : list of str
+        Column keys.
+    chunks : generator
+        Yields a list of column arrays (in ckeys order) for each chunk.
+    """
+    if is_archive(path):
+        r = archive_reader(path)
+        def chunks():
+            for i in range(len(r.index['rows'])): yield r._read_chunks(i, i+1)
+        return dict(r.headers), list(r.ckeys), chunks()
+
+    if _is_text_run(path): return _read_text_run(path, chunk_size)
+
+    # Only needed for spinmob binary files
+    import spinmob as _s
+    d = _s.data.load(path, quiet=True)
+    if d is None: raise Exception('Could not load '+path+'.')
+
+    headers = dict()
+    for k in d.hkeys: headers[k] = d.headers[k]
+    columns = [_n.asarray(d[k]) for k in d.ckeys]
+
+    def chunks():
+        rows = len(columns[0]) if len(columns) else 0
+        for a in range(0, rows, chunk_size): yield [c[a:a+chunk_size] for c in columns]
+    return headers, list(d.ckeys), chunks()
+
+
+def save_histogram(path, histogram, headers={}):
+    """
+    Saves a PCIT1_stats.count_histogram and a header (JSON-friendly
+    dictionary) as a small JSON file. The file is written next to path and
+    then moved into place, so it is never seen half written.
+    """
+    state = dict(format='PCIT1 histogram', version=1, headers=headers, histogram=histogram.get_state())
+
+    f = open(path+'.tmp', 'w')
+    _json.dump(state, f, default=str)
+    f.close()
+    _os.replace(path+'.tmp', path)
+
+def load_histogram(path):
+    """
+    Loads a file written by save_histogram(). Returns the count_histogram
+    and the header.
+    """
+    f = open(path, 'r')
+    state = _json.load(f)
+    f.close()
+
+    if state.get('format') != 'PCIT1 histogram': raise Exception(path+' is not a saved histogram.')
+    return count_histogram().set_state(state['histogram']), state['headers']
+
+
+class deferred_saver():
+    """
+    Coalesces frequent small-file saves (e.g. GUI settings, which are saved
+    on every keystroke in a script editor). submit() only remembers the
+    latest snapshot for each path; a background thread writes it once no new
+    snapshot has arrived for delay seconds. flush() writes everything still
+    pending right away, and is also called at interpreter exit.
+
+    Snapshots are objects with a save_file(path, force_overwrite=True) method
+    (e.g. a databox holding only a header), which writes to a temporary file
+    and moves it into place, so a crash never leaves a half-written file.
+    Writes are done one at a time (flush() can run alongside the background
+    thread), and a snapshot older than the last one written to its path is
+    dropped.
+
+    Parameters
+    ----------
+    delay=1 : float
+        Quiet period (s) before a snapshot is written.
+    """
+    def __init__(self, delay=1.0):
+
+        self.delay = delay
+
+        # path : [deadline, sequence number, snapshot]
+        self._pending = dict()
+        self._lock    = _threading.Lock()
+        self._wake    = _threading.Event()
+
+        # Serializes writes; path : sequence number of the last snapshot written
+        self._write_lock = _threading.Lock()
+        self._written    = dict()
+        self._sequence   = _itertools.count()
+
+        self._thread = _threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        _atexit.register(self.flush)
+
+    def submit(self, path, snapshot):
+        """
+        Schedules snapshot to be written to path, replacing any snapshot
+        still pending for the same path.
+        """
+        with self._lock: self._pending[path] = [_time.time()+self.delay, next(self._sequence), snapshot]
+        self._wake.set()
+
+    def _pop(self, due=None):
+        """
+        Removes and returns the pending (path, sequence number, snapshot)
+        entries with deadlines before due (all of them if due is None), and
+        the next deadline.
+        """
+        with self._lock:
+            ready = [p for p in self._pending if due is None or self._pending[p][0] <= due]
+            ready = [(p,)+tuple(self._pending.pop(p)[1:]) for p in ready]
+            later = min([x[0] for x in self._pending.values()], default=None)
+        return ready, later
+
+    def _write(self, ready):
+        """
+        Writes the supplied (path, sequence number, snapshot) entries, unless
+        a newer snapshot has already been written to the same path.
+        """
+        with self._write_lock:
+            for path, sequence, snapshot in ready:
+                if self._written.get(path, -1) > sequence: continue
+                self._written[path] = sequence
+                try:
+                    directory = _os.path.dirname(path)
+                    if directory and not _os.path.exists(directory): _os.makedirs(directory, exist_ok=True)
+                    snapshot.save_file(path, force_overwrite=True)
+                except Exception as e: print('deferred_saver:', path, e)
+
+    def _run(self):
+        """
+        Writes snapshots once they have been quiet long enough (runs in the
+        background thread).
+        """
+        later = None
+        while True:
+            self._wake.wait(None if later is None else max(later-_time.time(), 0))
+            self._wake.clear()
+
+            ready, later = self._pop(_time.time())
+            self._write(ready)
+
+    def flush(self):
+        """
+        Writes all pending snapshots now (e.g. when the window closes).
+        """
+        self._write(self._pop()[0])
@@ -0,0 +1,672 @@
+import threading   as _threading
+import collections as _collections
+import time        as _time
+import asyncio     as _asyncio
+import socket      as _socket
+import struct      as _struct
+from multiprocessing import shared_memory    as _shared_memory_module
+from multiprocessing import resource_tracker as _resource_tracker
+import numpy       as _n
+
+from PCIT1_api import PCIT1_api
+
+
+class subscription():
+    """
+    One subscriber's bounded queue of batches from a PCIT1_broker. It has the
+    same read_all_data() / disconnect() / simulation_mode interface as
+    PCIT1_api, so it can be used anywhere an api is expected.
+
+    Parameters
+    ----------
+    broker : PCIT1_broker
+        Broker publishing the batches.
+    maxsize=256 : int
+        Maximum number of batches to hold.
+    policy='drop_oldest' : str
+        What to do when the queue is full: 'drop_oldest' discards the oldest
+        batch, 'drop_newest' discards the incoming batch, and 'disconnect'
+        unsubscribes this consumer. The broker never waits on a subscriber.
+    """
+    def __init__(self, broker, maxsize=256, policy='drop_oldest'):
+
+        if not policy in ['drop_oldest', 'drop_newest', 'disconnect']:
+            raise Exception('Unknown slow-consumer policy "'+str(policy)+'".')
+
+        self.broker  = broker
+        self.maxsize = int(maxsize)
+        self.policy  = policy
+
+        self._queue     = _collections.deque()
+        self._condition = _threading.Condition()
+
+        # Number of batches lost to the policy, and whether we're still subscribed
+        self.dropped   = 0
+        self.connected = True
+
+    @property
+    def simulation_mode(self): return self.broker.api is None or self.broker.api.simulation_mode
+
+    @property
+    def error(self): return self.broker.error
+
+    def _put(self, batch):
+        """
+        Called by the broker. Queues the batch according to the policy and
+        returns False if this subscriber should be removed.
+        """
+        with self._condition:
+            if len(self._queue) >= self.maxsize:
+                if   self.policy == 'drop_newest':
+                    self.dropped += 1
+                    return True
+                elif self.policy == 'drop_oldest':
+                    self._queue.popleft()
+                    self.dropped += 1
+                else:
+                    self.connected = False
+                    return False
+
+            self._queue.append(batch)
+            self._condition.notify()
+        return True
+
+    def get_batches(self, timeout=0):
+        """
+        Returns a list of all waiting (t, iterations, counts) batches, waiting
+        up to timeout seconds for at least one. The arrays are read-only and
+        shared with the other subscribers.
+        """
+        with self._condition:
+            if not self._queue and timeout: self._condition.wait(timeout)
+            batches = list(self._queue)
+            self._queue.clear()
+        return batches
+
+    def read_all_data(self):
+        """
+        Returns all waiting data as (iterations, counts) arrays, like
+        PCIT1_api.read_all_data(). A single waiting batch is returned as is,
+        without copying.
+        """
+        batches = self.get_batches()
+        if len(batches) == 0: return _n.zeros(0, dtype=_n.int64), _n.zeros(0, dtype=_n.int64)
+        if len(batches) == 1: return batches[0][1], batches[0][2]
+        return _n.concatenate([b[1] for b in batches]), _n.concatenate([b[2] for b in batches])
+
+    def disconnect(self):
+        """
+        Unsubscribes from the broker.
+        """
+        self.broker.unsubscribe(self)
+
+
+class PCIT1_broker():
+    """
+    Owns a single PCIT1_api connection and fans each batch from
+    read_all_data() out to any number of subscribers (histo windows,
+    loggers, fitters, ...). A background thread polls the instrument, and
+    each batch is published as one set of read-only numpy arrays shared by
+    every subscriber, so adding subscribers costs no copies. Each subscriber
+    has its own bounded queue (see subscription), so a slow one cannot stall
+    the others.
+
+    To have two windows watch the same detector:
+
+        broker = PCIT1_broker()
+        a = PCIT1.histo(name='PCIT1-A', api=broker.subscribe)
+        b = PCIT1.histo(name='PCIT1-B', api=broker.subscribe)
+
+    Parameters
+    ----------
+    api_class=PCIT1_api : class
+        Class used to open the connection.
+    interval=0.05 : float
+        Time between polls of the instrument (s).
+    """
+    def __init__(self, api_class=PCIT1_api, interval=0.05):
+
+        self._api_class = api_class
+        self.interval   = interval
+
+        self.api          = None
+        self.subscribers  = []
+        self._lock        = _threading.Lock()
+        self._thread      = None
+        self._stop        = _threading.Event()
+
+        # Functions called with each (t, iterations, counts) batch from the
+        # polling thread. Used by the servers in this module.
+        self.listeners = []
+
+        # Last exception raised while polling (None once polling succeeds
+        # again), and the number of failed polls
+        self.error  = None
+        self.errors = 0
+
+    def start(self, port='Simulation', baudrate=230400, timeout=15):
+        """
+        Opens the connection (if needed) and starts polling.
+        """
+        if self.api is None: self.api = self._api_class(port=port, baudrate=baudrate, timeout=timeout)
+
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = _threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops polling and closes the connection.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+        if self.api is not None:
+            self.api.disconnect()
+            self.api = None
+        return self
+
+    def _run(self):
+        """
+        Polling loop (runs in the background thread). A failed poll is
+        recorded in self.error (also visible as each subscription's error)
+        and polling carries on, so a transient fault doesn't silently end
+        the stream.
+        """
+        while not self._stop.is_set():
+            try:
+                self.poll()
+                self.error = None
+
+            except Exception as e:
+                if self.error is None or str(e) != str(self.error): print('PCIT1_broker:', e)
+                self.error   = e
+                self.errors += 1
+
+            self._stop.wait(self.interval)
+
+    def poll(self):
+        """
+        Reads everything waiting on the instrument and publishes it.
+        """
+        t    = _time.time()
+        N, C = self.api.read_all_data()
+        if len(C) == 0: return self
+
+        N = _n.array(N, dtype=_n.int64)
+        C = _n.array(C, dtype=_n.int64)
+        N.setflags(write=False)
+        C.setflags(write=False)
+        self.publish(t, N, C)
+        return self
+
+    def publish(self, t, iterations, counts):
+        """
+        Sends a batch to every subscriber and listener.
+        """
+        batch = (t, iterations, counts)
+
+        with self._lock: subscribers = list(self.subscribers)
+        for s in subscribers:
+            if not s._put(batch): self.unsubscribe(s)
+
+        for f in list(self.listeners): f(batch)
+
+    def subscribe(self, port=None, baudrate=230400, timeout=15, maxsize=256, policy='drop_oldest'):
+        """
+        Adds a subscriber and returns its subscription. If the broker is not
+        running yet, it is started on the specified port. The signature
+        matches PCIT1_api, so this method can be passed as histo's api.
+
+        Parameters
+        ----------
+        port=None : str
+            Port to open if not already connected. None means 'Simulation'.
+        baudrate=230400, timeout=15
+            Connection settings used if not already connected.
+        maxsize=256 : int
+            Maximum number of batches to queue for this subscriber.
+        policy='drop_oldest' : str
+            Slow-consumer policy; see subscription.
+        """
+        if self._thread is None: self.start(port or 'Simulation', baudrate, timeout)
+
+        s = subscription(self, maxsize, policy)
+        with self._lock: self.subscribers.append(s)
+        return s
+
+    def unsubscribe(self, s):
+        """
+        Removes a subscriber.
+        """
+        with self._lock:
+            if s in self.subscribers: self.subscribers.remove(s)
+        s.connected = False
+
+
+# Binary framing used by PCIT1_server / PCIT1_client. Each batch is
+#   b'PCB1', float64 host time, uint32 number of samples n,
+#   n uint32 iteration numbers, n uint32 counts
+# all little-endian.
+_FRAME_MAGIC  = b'PCB1'
+_FRAME_HEADER = _struct.Struct('<4sdI')
+
+def encode_batch(t, iterations, counts):
+    """
+    Returns the bytes of one framed batch.
+    """
+    N = _n.asarray(iterations, dtype='<u4')
+    C = _n.asarray(counts,     dtype='<u4')
+    return _FRAME_HEADER.pack(_FRAME_MAGIC, t, len(C)) + N.tobytes() + C.tobytes()
+
+
+class PCIT1_server():
+    """
+    Streams every batch published by a PCIT1_broker to any number of TCP
+    clients (see PCIT1_client), e.g. notebooks or lock-in scripts on the
+    same machine.
+
+    The server runs its own asyncio loop in a background thread. Each batch
+    is framed once (in the broker's thread) and handed to the loop; every
+    client has its own bounded queue drained at the speed of its socket, and
+    when a client falls behind its oldest frames are dropped. Nothing here
+    ever waits on a client, so acquisition and the GUI are unaffected.
+
+    Parameters
+    ----------
+    broker : PCIT1_broker
+        Source of the data.
+    host='127.0.0.1' : str
+        Interface to listen on. The default only accepts local connections.
+    port=50007 : int
+        TCP port to listen on.
+    maxsize=64 : int
+        Maximum number of frames queued per client.
+    """
+    def __init__(self, broker, host='127.0.0.1', port=50007, maxsize=64):
+
+        self.broker  = broker
+        self.host    = host
+        self.port    = port
+        self.maxsize = maxsize
+
+        self._loop    = None
+        self._server  = None
+        self._thread  = None
+        self._queues  = set()
+        self._tasks   = set()
+        self._ready   = _threading.Event()
+        self._error   = None
+
+        # Frames dropped because a client was too slow
+        self.dropped = 0
+
+    def start(self, timeout=10):
+        """
+        Starts listening and streaming. Raises the error if the server could
+        not be started (e.g. the port is in use) within timeout seconds.
+        """
+        if self._thread is not None: return self
+
+        self._ready.clear()
+        self._error  = None
+        self._thread = _threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+        if not self._ready.wait(timeout): self._error = TimeoutError('Server did not start within '+str(timeout)+' s.')
+        if self._error is not None:
+            if self._loop is not None and not self._loop.is_closed(): self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread = None
+            raise self._error
+
+        self.broker.listeners.append(self._listener)
+        return self
+
+    def stop(self):
+        """
+        Disconnects all clients and stops listening.
+        """
+        if self._thread is None: return self
+
+        if self._listener in self.broker.listeners: self.broker.listeners.remove(self._listener)
+        _asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+        return self
+
+    def get_client_count(self):
+        """
+        Returns the number of connected clients.
+        """
+        return len(self._queues)
+
+    def _run(self):
+        """
+        Event loop (runs in the background thread).
+        """
+        self._loop = _asyncio.new_event_loop()
+        _asyncio.set_event_loop(self._loop)
+        try:
+            self._server = self._loop.run_until_complete(_asyncio.start_server(self._handle, self.host, self.port))
+        except Exception as e:
+            self._error = e
+            self._loop.close()
+            return
+        finally: self._ready.set()
+
+        self._loop.run_forever()
+        self._loop.close()
+
+    async def _shutdown(self):
+        # Since Python 3.12.1, wait_closed() also waits for every connection
+        # to close, so the client handlers (which close their writers on the
+        # way out) have to be cancelled and finished first.
+        self._server.close()
+        tasks = list(self._tasks)
+        for task in tasks: task.cancel()
+        await _asyncio.gather(*tasks, return_exceptions=True)
+        await self._server.wait_closed()
+
+    def _listener(self, batch):
+        """
+        Called by the broker (in its thread) with each batch.
+        """
+        self._loop.call_soon_threadsafe(self._fan_out, encode_batch(*batch))
+
+    def _fan_out(self, frame):
+        """
+        Queues a frame for every client, dropping the oldest if a queue is full.
+        """
+        for q in self._queues:
+            if q.full():
+                q.get_nowait()
+                self.dropped += 1
+            q.put_nowait(frame)
+
+    async def _handle(self, reader, writer):
+        """
+        Sends queued frames to one client until it goes away.
+        """
+        q = _asyncio.Queue(self.maxsize)
+        self._queues.add(q)
+        self._tasks .add(_asyncio.current_task())
+        try:
+            while True:
+                writer.write(await q.get())
+                await writer.drain()
+        except (ConnectionError, _asyncio.CancelledError): pass
+        finally:
+            self._queues.discard(q)
+            self._tasks .discard(_asyncio.current_task())
+            writer.close()
+
+
+class PCIT1_client():
+    """
+    Receives batches from a PCIT1_server.
+
+        for t, iterations, counts in PCIT1_client():
+            print(t, counts.mean())
+
+    Parameters
+    ----------
+    host='127.0.0.1' : str
+        Address of the server.
+    port=50007 : int
+        Port of the server.
+    timeout=None : float
+        Socket timeout (s). None waits forever.
+    """
+    def __init__(self, host='127.0.0.1', port=50007, timeout=None):
+        self.socket = _socket.create_connection((host, port), timeout)
+
+    def _receive(self, n):
+        """
+        Returns exactly n bytes from the socket.
+        """
+        b = bytearray(n)
+        v = memoryview(b)
+        while len(v):
+            m = self.socket.recv_into(v)
+            if m == 0: raise ConnectionError('Server closed the connection.')
+            v = v[m:]
+        return b
+
+    def read_batch(self):
+        """
+        Waits for the next batch and returns it as (t, iterations, counts),
+        with uint32 arrays.
+        """
+        magic, t, n = _FRAME_HEADER.unpack(self._receive(_FRAME_HEADER.size))
+        if magic != _FRAME_MAGIC: raise ConnectionError('Lost framing with the server.')
+
+        data = _n.frombuffer(self._receive(8*n), dtype='<u4')
+        return t, data[:n], data[n:]
+
+    def __iter__(self):
+        try:
+            while True: yield self.read_batch()
+        except ConnectionError: return
+
+    def close(self):
+        """
+        Closes the connection.
+        """
+        self.socket.close()
+
+
+# Shared-memory ring buffer layout (one multiprocessing.shared_memory block):
+#   int64[8] header: magic, capacity, sequence (total samples written), ...
+#   float64[capacity] time, uint32[capacity] iteration, uint32[capacity] counts
+# The writer fills the slots and only then advances the sequence counter, so
+# a reader that sees sequence s knows samples up to s are in place.
+_SHARED_MAGIC  = 0x5043495431524E47 # "PCIT1RNG"
+_SHARED_HEADER = 64
+
+# Names of the blocks created by writers in this process
+_shared_created = set()
+
+def _shared_memory(name, create=False, size=0):
+    """
+    Opens (or creates) a SharedMemory block. Blocks opened by readers are
+    not tracked, so a reader exiting does not destroy the writer's buffer.
+    """
+    if create:
+        _shared_created.add(name)
+        return _shared_memory_module.SharedMemory(name=name, create=True, size=size)
+
+    try: return _shared_memory_module.SharedMemory(name=name, track=False)
+    except TypeError: pass
+
+    # Python < 3.13: untrack by hand, unless this process created the block
+    shm = _shared_memory_module.SharedMemory(name=name)
+    if not name in _shared_created:
+        try: _resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception: pass
+    return shm
+
+def _shared_arrays(buffer, capacity):
+    """
+    Returns the header, time, iteration and count arrays in the buffer.
+    """
+    header = _n.ndarray(8, dtype=_n.int64, buffer=buffer)
+    a = _SHARED_HEADER
+    t = _n.ndarray(capacity, dtype=_n.float64, buffer=buffer, offset=a); a += 8*capacity
+    N = _n.ndarray(capacity, dtype=_n.uint32,  buffer=buffer, offset=a); a += 4*capacity
+    C = _n.ndarray(capacity, dtype=_n.uint32,  buffer=buffer, offset=a)
+    return header, t, N, C
+
+
+class shared_ring_writer():
+    """
+    Publishes samples into a ring buffer in shared memory, so that analysis
+    processes on the same machine can read them (see shared_ring_reader)
+    without any serialization or copying.
+
+    To publish everything a broker reads:
+
+        writer = shared_ring_writer('PCIT1')
+        broker.listeners.append(writer.publish)
+
+    Parameters
+    ----------
+    name='PCIT1' : str
+        Name of the shared memory block readers will open.
+    capacity=1048576 : int
+        Number of samples held before the oldest are overwritten.
+    """
+    def __init__(self, name='PCIT1', capacity=1048576):
+
+        self.name     = name
+        self.capacity = int(capacity)
+        self._shm     = _shared_memory(name, True, _SHARED_HEADER + 16*self.capacity)
+
+        self._header, self._t, self._N, self._C = _shared_arrays(self._shm.buf, self.capacity)
+        self._header[:] = 0
+        self._header[1] = self.capacity
+        self._header[0] = _SHARED_MAGIC
+
+    def publish(self, batch):
+        """
+        Writes a (t, iterations, counts) batch, as published by PCIT1_broker.
+        """
+        self.append_data(*batch)
+
+    def append_data(self, t, iterations, counts):
+        """
+        Writes samples into the ring.
+
+        Parameters
+        ----------
+        t : number or 1D array
+            Time of the batch, or of each sample (s).
+        iterations, counts : 1D arrays
+            Iteration numbers and counts.
+        """
+        C = _n.asarray(counts)[-self.capacity:]
+        N = _n.asarray(iterations)[-self.capacity:]
+        t = _n.broadcast_to(_n.asarray(t, dtype=float), _n.shape(counts))[-self.capacity:]
+        m = len(C)
+        if m == 0: return self
+
+        seq = int(self._header[2]) + len(counts) - m
+        a   = seq % self.capacity
+        k   = min(m, self.capacity-a)
+
+        # Up to two slices, then advance the sequence
+        self._t[a:a+k] = t[:k]; self._t[:m-k] = t[k:]
+        self._N[a:a+k] = N[:k]; self._N[:m-k] = N[k:]
+        self._C[a:a+k] = C[:k]; self._C[:m-k] = C[k:]
+        self._header[2] = seq + m
+        return self
+
+    def close(self):
+        """
+        Releases and destroys the shared memory block.
+        """
+        if self._shm is None: return
+        del self._header, self._t, self._N, self._C
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+
+class shared_ring_reader():
+    """
+    Reads samples published by a shared_ring_writer in another process.
+
+        reader = shared_ring_reader('PCIT1')
+        while True:
+            first, t, iterations, counts = reader.read()
+            ... use the arrays ...
+            if not reader.is_valid(first): print('Lapped while reading!')
+
+    Parameters
+    ----------
+    name='PCIT1' : str
+        Name of the shared memory block.
+    from_start=False : bool
+        If True, the first read() returns everything still in the ring;
+        otherwise only samples written after the reader was created.
+    """
+    def __init__(self, name='PCIT1', from_start=False):
+
+        self._shm = _shared_memory(name)
+        header = _n.ndarray(8, dtype=_n.int64, buffer=self._shm.buf)
+        if header[0] != _SHARED_MAGIC: raise Exception('"'+name+'" is not a PCIT1 ring buffer.')
+
+        self.capacity = int(header[1])
+        self._header, self._t, self._N, self._C = _shared_arrays(self._shm.buf, self.capacity)
+
+        # Sequence number of the next sample to read, and the number of samples
+        # overwritten before we got to them.
+        seq = int(self._header[2])
+        self.position = max(seq-self.capacity, 0) if from_start else seq
+        self.lost     = 0
+
+    def get_sequence(self):
+        """
+        Returns the total number of samples written so far.
+        """
+        return int(self._header[2])
+
+    def is_valid(self, first):
+        """
+        Returns True if the samples from sequence number first onward have not
+        been overwritten yet.
+        """
+        return self.get_sequence() - first <= self.capacity
+
+    def read(self):
+        """
+        Returns (first, t, iterations, counts) for all new samples, where first
+        is the sequence number of the first one. The arrays are views of the
+        shared memory when the samples do not wrap around the end of the ring
+        (otherwise they are joined into new arrays). If the writer lapped us,
+        the skipped samples are added to self.lost and the oldest available
+        samples are returned.
+        """
+        seq = self.get_sequence()
+        if seq - self.position > self.capacity:
+            self.lost    += seq - self.capacity - self.position
+            self.position = seq - self.capacity
+
+        first = self.position
+        a = first % self.capacity
+        b = a + seq - first
+        self.position = seq
+
+        if b <= self.capacity: return first, self._t[a:b], self._N[a:b], self._C[a:b]
+
+        b -= self.capacity
+        return (first, _n.concatenate((self._t[a:], self._t[:b])),
+                       _n.concatenate((self._N[a:], self._N[:b])),
+                       _n.concatenate((self._C[a:], self._C[:b])))
+
+    def close(self):
+        """
+        Detaches from the shared memory (the writer keeps it).
+        """
+        if self._shm is None: return
+        del self._header, self._t, self._N, self._C
+        self._shm.close()
+        self._shm = None
+
+
+if __name__ == '__main__':
+
+    # Headless streaming: python PCIT1_stream.py [port] [tcp port]
+    import sys as _sys
+    broker = PCIT1_broker().start(_sys.argv[1] if len(_sys.argv) > 1 else 'Simulation')
+    server = PCIT1_server(broker, port=int(_sys.argv[2]) if len(_sys.argv) > 2 else 50007).start()
+    print('Streaming on '+server.host+':'+str(server.port)+'. Ctrl-C to quit.')
+    try:
+        while True: _time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+        broker.stop()
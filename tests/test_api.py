@@ -0,0 +1,42 @@
+import numpy as _n
+
+from PCIT1_api import PCIT1_api
+
+
+class _device():
+    def __init__(self, data):
+        self.data       = data
+        self.in_waiting = len(data)
+
+    def read(self, n):
+        data, self.data = self.data, b''
+        return data
+
+
+def _api(data):
+    api = PCIT1_api.__new__(PCIT1_api)
+    api.simulation_mode  = False
+    api.device           = _device(data)
+    api._interval_buffer = b''
+    api._interval_clock  = 0
+    api.rejected         = 0
+    return api
+
+
+def test_read_all_intervals_clean_buffer():
+    api = _api(b''.join(b'%d,%d\r\n' % (10*n, 10) for n in range(1000)) + b'10000,')
+    timestamps, intervals = api.read_all_intervals()
+
+    assert _n.array_equal(timestamps, 10*_n.arange(1000))
+    assert (intervals == 10).all()
+    assert api.rejected == 0
+    assert api._interval_buffer == b'10000,'
+
+
+def test_read_all_intervals_garbled_buffer():
+    api = _api(b'0\r\n3,4\r\nx,1\r\n1,2,3\r\n5,6\r\n')
+    timestamps, intervals = api.read_all_intervals()
+
+    assert list(timestamps) == [3, 5]
+    assert list(intervals)  == [4, 6]
+    assert api.rejected == 3
@@ -0,0 +1,42 @@
+import os   as _os
+import time as _time
+import pytest
+
+# Must be set before Qt is imported
+_os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+pytest.importorskip('spinmob')
+pytest.importorskip('pyqtgraph')
+PCIT1 = pytest.importorskip('PCIT1')
+
+
+def _wait_for_script(p, timeout=10):
+    """
+    Runs the script timer until the background script is done or abandoned.
+    """
+    t0 = _time.time()
+    while p._script_job is not None and _time.time()-t0 < timeout:
+        _time.sleep(0.05)
+        p._script_timer_tick()
+
+def test_runaway_script_does_not_block_later_plots():
+    """
+    A script that never returns is abandoned after the budget, and the next
+    (good) script draws.
+    """
+    p = PCIT1.DataboxPlot(autoscript=0)
+    p['Number']     = [1, 2, 3, 4]
+    p['Counts (C)'] = [5, 6, 6, 7]
+    p.number_script_budget.set_value(0.2)
+
+    p.script.set_text('while True: pass')
+    p.plot()
+    _wait_for_script(p)
+    assert p._script_job is None
+    assert isinstance(p._e, TimeoutError)
+
+    p.script.set_text('x = d[0]\ny = d[1]')
+    p.plot()
+    _wait_for_script(p)
+    assert p._script_job is None
+    assert len(p.plot_widgets) == 1
@@ -0,0 +1,34 @@
+import numpy as _n
+
+from PCIT1_pipeline import dead_time, background, pipeline
+
+
+def test_dead_time_total_is_unbiased():
+    """
+    Corrections much smaller than one count per gate still add up, across
+    batches, to the exact corrected total.
+    """
+    C = _n.random.RandomState(1).poisson(50, 100000)
+    d = dead_time(tau=50e-9, gate=0.01)
+    out = _n.concatenate([d.process(_n.arange(1000), C[i:i+1000])[1] for i in range(0, len(C), 1000)])
+
+    exact = C/(1-C*5e-6)
+    assert out.dtype == _n.int64
+    assert abs(out.sum()-exact.sum()) <= 0.5
+    assert (_n.abs(out-exact) < 1).all()
+
+
+def test_background_is_unbiased():
+    """
+    Subtracting a fractional background from low counts keeps the mean,
+    negative results included, and the whole pipeline passes them on.
+    """
+    C = _n.random.RandomState(2).poisson(1.5, 100000)
+    p = pipeline([background(counts=1.0)])
+    N, out = p.process(_n.arange(len(C)), C)
+    assert out.min() < 0
+    assert abs(out.mean()-(C.mean()-1.0)) < 1e-9
+
+    p = pipeline([background(counts=0.3)])
+    out = _n.concatenate([p.process(_n.arange(1000), C[i:i+1000])[1] for i in range(0, len(C), 1000)])
+    assert abs(out.sum()-(C.sum()-0.3*len(C))) <= 0.5
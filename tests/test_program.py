@@ -0,0 +1,27 @@
+import numpy as _n
+
+from PCIT1_program import program_runner
+
+
+def test_settle_gates_discarded():
+    p = program_runner([0, 1], [3, 3], max_count=10, settle_gates=2)
+
+    # One batch straddling the boundary: 2 settling + 3 kept, then 2 settling + 3 kept
+    done = p.append_data(_n.arange(10), [9, 9, 1, 1, 1, 9, 9, 2, 2, 2])
+
+    assert done == [0, 1]
+    assert p.is_done()
+    assert list(p.n)          == [3, 3]
+    assert list(p.get_means()) == [1, 2]
+    assert list(p.first_iteration) == [2, 7]
+    assert list(p.last_iteration)  == [4, 9]
+
+
+def test_settle_split_across_batches():
+    p = program_runner([0, 1], [2, 2], max_count=10, settle_gates=1)
+    p.append_data([0, 1], [5, 1])
+    p.append_data([2, 3], [1, 5])
+    p.append_data([4, 5], [2, 2])
+
+    assert list(p.n) == [2, 2]
+    assert list(p.get_means()) == [1, 2]
@@ -0,0 +1,64 @@
+import numpy as _n
+
+from PCIT1_stats import window_histogram, photon_statistics, analysis_worker
+
+
+def test_window_histogram_batch_spanning_many_slabs():
+    """
+    A single batch covering more slabs than the window keeps exactly the
+    counts of the last window.
+    """
+    w = window_histogram(window=10, slab=1, max_window=20)
+    t = _n.arange(0, 50, 0.1)
+    C = _n.random.RandomState(0).poisson(5, len(t))
+    w.append_data(t, C)
+
+    last = C[t >= 40]
+    assert w.n   == len(last)
+    assert w.sum == last.sum()
+    assert (w.counts == _n.bincount(last, minlength=len(w.counts))).all()
+    assert _n.isclose(w.get_mean(), last.mean())
+
+def test_window_histogram_after_long_gap():
+    """
+    A batch arriving after a gap longer than the ring only counts itself.
+    """
+    w = window_histogram(window=10, slab=1, max_window=20)
+    w.append_data(_n.arange(0, 5, 0.5), _n.full(10, 3))
+    w.append_data(_n.arange(1000, 1030, 0.5), _n.ones(60, dtype=int))
+
+    assert w.n   == 20
+    assert w.sum == 20
+    assert w.counts[1] == 20
+
+def test_max_lag_change_in_worker():
+    """
+    Changing max_lag through the worker gives the same results as starting
+    with it, whether lowered or raised (replaying the history in chunks),
+    with data arriving before and after the change.
+    """
+    x = _n.random.RandomState(0).poisson(5, 20000)
+    w = analysis_worker(photon_statistics(50))
+    w.append_data(x[:15000])
+    w.replace_analyzer(lambda a: a.with_max_lag(20))
+    w.replace_analyzer(lambda a: a.with_max_lag(200, (x[i:min(i+4000, 15000)] for i in range(0, 15000, 4000))))
+    w.append_data(x[15000:])
+    w.stop()
+
+    expected = photon_statistics(200).append_data(x)
+    assert w.analyzer.max_lag == 200
+    assert _n.allclose(w.analyzer.get_autocorrelation()[1], expected.get_autocorrelation()[1])
+    assert _n.allclose(w.analyzer.get_fano()[1], expected.get_fano()[1], equal_nan=True)
+
+def test_window_histogram_negative_counts():
+    """
+    Negative counts (e.g. after background subtraction) get their own bins.
+    """
+    w = window_histogram(window=10, slab=1, max_window=20)
+    w.append_data(0.5, [3, 4, 4])
+    w.append_data(1.5, [-2, 0, 40])
+
+    h, edges = w.get_histogram()
+    centers  = edges[:-1]+0.5
+    assert dict(zip(centers[h > 0], h[h > 0])) == {-2:1, 0:1, 3:1, 4:2, 40:1}
+    assert w.sum == 49 and w.n == 6
@@ -0,0 +1,88 @@
+import numpy as _n
+
+from PCIT1_storage import acquisition_store
+
+
+def test_spilling_releases_memory(tmp_path):
+    """
+    Lowering the budget spills old rows and shrinks the allocation, and all
+    rows can still be read back.
+    """
+    s = acquisition_store(spill_path=str(tmp_path/'spill.arc'))
+    for i in range(100): s.append_data(_n.arange(10000)*1e-3+10*i, _n.arange(10000), _n.full(10000, 50))
+    assert s.nbytes() > 20e6
+
+    s.set_budget(1e6)
+    assert s.first > 0
+    assert s.nbytes() <= 1e6
+
+    s.append_data(_n.full(10000, 1000.0), _n.arange(10000), _n.ones(10000, dtype=int))
+    assert s.nbytes() <= 1e6
+    assert (s.read_rows(['Sample'])[0] == _n.arange(s.n)).all()
+
+def test_read_time_max_rows(tmp_path):
+    """
+    Long time ranges are thinned to at most max_rows, spilled part included.
+    """
+    s = acquisition_store(budget=200000, spill_path=str(tmp_path/'spill.arc'))
+    for i in range(50): s.append_data(_n.arange(10000)*1e-3+10*i, _n.arange(10000), _n.arange(10000)%1000)
+
+    t = s.read_time(['Time (s)'], 100, 400, max_rows=1000)[0]
+    assert 0 < len(t) <= 1000
+    assert t[0] >= 100 and t[-1] <= 400
+    assert (_n.diff(t) > 0).all()
+
+def test_read_rows_while_spilling(tmp_path):
+    """
+    Another thread reading rows while batches are appended and spilled always
+    gets consistent rows.
+    """
+    import sys       as _sys
+    import threading as _threading
+
+    s = acquisition_store(budget=100000, spill_path=str(tmp_path/'spill.arc'))
+    s.append_data(0.0, [0], [0])
+    errors = []
+    done   = _threading.Event()
+
+    def read():
+        while not done.is_set():
+            n = len(s)
+            x = s.read_rows(['Sample'], max(n-50000, 0), n)[0]
+            if not (x == _n.arange(max(n-50000, 0), n)).all(): errors.append(n)
+
+    # Switch threads as often as possible
+    interval = _sys.getswitchinterval()
+    _sys.setswitchinterval(1e-6)
+    thread = _threading.Thread(target=read)
+    thread.start()
+    try:
+        for i in range(3000): s.append_data(float(i), _n.arange(1000), _n.ones(1000, dtype=int))
+    finally:
+        done.set()
+        thread.join()
+        _sys.setswitchinterval(interval)
+
+    assert s.first > 0
+    assert errors == []
+
+def test_deferred_saver_drops_stale_snapshot(tmp_path):
+    """
+    A snapshot taken by the background thread just before flush() writes a
+    newer one for the same path is not written over it.
+    """
+    from PCIT1_storage import deferred_saver
+
+    class snapshot():
+        def __init__(self, text): self.text = text
+        def save_file(self, path, force_overwrite=False): open(path, 'w').write(self.text)
+
+    path  = str(tmp_path/'settings.txt')
+    saver = deferred_saver(1e3)
+    saver.submit(path, snapshot('old'))
+    stale = saver._pop()[0]   # as the background thread does
+
+    saver.submit(path, snapshot('new'))
+    saver.flush()
+    saver._write(stale)
+    assert open(path).read() == 'new'
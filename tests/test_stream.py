@@ -0,0 +1,23 @@
+import socket as _socket
+import time   as _time
+
+from PCIT1_stream import PCIT1_server
+
+
+class _broker():
+    listeners = []
+
+
+def test_stop_with_client_connected():
+    server = PCIT1_server(_broker(), port=0).start()
+    port   = server._server.sockets[0].getsockname()[1]
+
+    client = _socket.create_connection(('127.0.0.1', port))
+    for n in range(100):
+        if server.get_client_count(): break
+        _time.sleep(0.01)
+    assert server.get_client_count() == 1
+
+    server.stop()
+    client.close()
+    assert server.get_client_count() == 0